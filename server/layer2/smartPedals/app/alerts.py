@@ -0,0 +1,151 @@
+import math
+import threading
+
+from datetime import datetime, timezone
+
+"""
+Zero-availability alerts, one state machine per station ("*" = whole fleet):
+    ok --count 0--> pending --ZERO_ALERT_SECONDS--> alerted --count > 0--> ok ("available again" SMS)
+    pending --count > 0--> ok (nothing sent)
+The pending deadline sits in a hashed timer wheel (O(1) arm/cancel) advanced by a ticker, so the alert fires
+on time even when no more availability messages arrive. States are persisted (alert_state collection) by the
+caller through the persist callback and reloaded with load() on start.
+"""
+
+FLEET = "*"
+
+# Hashed timer wheel: key -> absolute tick, stored in slot tick % slots with the number of remaining turns
+class TimerWheel:
+    def __init__(self, now, tick=1.0, slots=4096):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]
+        self.where = {}  # key -> slot index
+        self.current = math.floor(now / tick)
+
+    def arm(self, key, at):
+        self.cancel(key)
+        due = max(math.ceil(at / self.tick), self.current + 1)
+        index = due % len(self.slots)
+        self.slots[index][key] = (due - self.current - 1) // len(self.slots)
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def __len__(self):
+        return len(self.where)
+
+    # Keys whose deadline is <= now, in deadline order
+    def advance(self, now):
+        fired = []
+        target = math.floor(now / self.tick)
+        while self.current < target:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            for key, turns in list(slot.items()):
+                if turns:
+                    slot[key] = turns - 1
+                else:
+                    del slot[key]
+                    del self.where[key]
+                    fired.append(key)
+        return fired
+
+class ZeroAlerts:
+    def __init__(self, delay, now, persist=None, retry=60, tick=1.0):
+        self.delay = delay
+        self.retry = retry  # Delay before a failed alert SMS is tried again
+        self.persist = persist or (lambda station, state: None)
+        self.states = {}  # station -> {"zero_since": epoch s, "alerted": bool}
+        self.wheel = TimerWheel(now, tick)
+        self.lock = threading.Lock()
+        # State writes happen after self.lock is released (a slow Mongo must not stall tick/observe callers),
+        # taken over under it so they still reach persist in the order the states changed
+        self.persist_lock = threading.Lock()
+
+    def load(self, docs, now):
+        with self.lock:
+            for doc in docs:
+                zero_since = doc["zero_since"]
+                if isinstance(zero_since, datetime):
+                    zero_since = (zero_since if zero_since.tzinfo else zero_since.replace(tzinfo=timezone.utc)).timestamp()
+                self.states[doc["_id"]] = {"zero_since": zero_since, "alerted": bool(doc.get("alerted"))}
+                if not doc.get("alerted"):
+                    self.wheel.arm(doc["_id"], zero_since + self.delay)
+            return len(self.states)
+
+    # New availability count for a station: returns the notifications to send as (kind, station, count)
+    def observe(self, station, count, now):
+        notifications, change = [], None
+        with self.lock:
+            state = self.states.get(station)
+            if count == 0:
+                if state is None:
+                    self.states[station] = state = {"zero_since": now, "alerted": False}
+                    self.wheel.arm(station, now + self.delay)
+                    change = self._hand_over(station, state)
+            elif state is not None:
+                del self.states[station]
+                self.wheel.cancel(station)
+                change = self._hand_over(station, None)
+                if state["alerted"]:
+                    notifications = [("recovered", station, count)]
+        self._write(change)
+        return notifications
+
+    # Station removed: drop its state without notifying
+    def forget(self, station):
+        change = None
+        with self.lock:
+            if self.states.pop(station, None) is not None:
+                self.wheel.cancel(station)
+                change = self._hand_over(station, None)
+        self._write(change)
+
+    # Deadlines reached by now: ("zero", station, 0) for each, confirm with sent()
+    def tick(self, now):
+        with self.lock:
+            return [("zero", station, 0) for station in self.wheel.advance(now) if station in self.states]
+
+    def sent(self, station, ok, now):
+        change = None
+        with self.lock:
+            state = self.states.get(station)
+            if state is None or state["alerted"]:
+                return
+            if ok:
+                state["alerted"] = True
+                change = self._hand_over(station, state)
+            else:
+                self.wheel.arm(station, now + self.retry)
+        self._write(change)
+
+    # Under self.lock: a copy of the change to write, the persist turn taken
+    def _hand_over(self, station, state):
+        self.persist_lock.acquire()
+        return station, None if state is None else dict(state)
+
+    def _write(self, change):
+        if change is None:
+            return
+        try:
+            self.persist(*change)
+        finally:
+            self.persist_lock.release()
+
+    def summary(self):
+        with self.lock:
+            alerted = sum(1 for s in self.states.values() if s["alerted"])
+        return {("pending",): len(self.states) - alerted, ("alerted",): alerted}
+
+def alert_text(kind, station, count, delay):
+    where = "" if station == FLEET else f" at station {station}"
+    if kind == "zero":
+        return f"No bikes available{where} for {delay // 60} minutes!"
+    return f"Bikes available again{where}: {count}."
+
+def state_document(station, state):
+    return {"_id": station, "zero_since": datetime.fromtimestamp(state["zero_since"], timezone.utc),
+            "alerted": state["alerted"]}
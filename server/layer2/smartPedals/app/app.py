@@ -2,95 +2,92 @@ import os
 import queue
 import threading
 import time
-import ssl
 import re
 import json
+import math
+import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from zoneinfo import ZoneInfo
 
 import requests
 from functools import wraps # For Flask decorators
 from flask import (
-    Flask, render_template, request, flash,
+    Flask, render_template, request, flash, g,
     Response, stream_with_context, url_for, redirect,
-    jsonify, abort
+    jsonify, abort, make_response
 )
-from pymongo import MongoClient
-import paho.mqtt.client as mqtt
 from bson import ObjectId
-from twilio.rest import Client as TwilioClient
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+import cache
+import compress
+import logs
+from bsonjson import STREAM_BATCH, BsonJSONProvider, iter_array
+import export
+import fleet
+import gps
+import metrics
+import profiler
+import trips
+from common import BRUSSELS, EVENTS_SOCKET, init_db
+from events import EventSubscriber
+
+"""
+Web tier: no side effect on import, safe to run under a multi-worker WSGI server (gunicorn -c gunicorn.conf.py app:app).
+MQTT ingest runs in its own process (ingest.py) and pushes live events through the local event channel.
+"""
 
 # Flask
 FLASK_TLS_CERT = os.environ.get("FLASK_TLS_CERT", "/etc/ssl/client-flask.crt")
 FLASK_TLS_KEY = os.environ.get("FLASK_TLS_KEY",  "/etc/ssl/client-flask.key.unlocked")
 FLASK_TLS_PORT = int(os.environ.get("FLASK_TLS_PORT", "8443"))
 SMARTPEDALS_API_KEY = os.environ.get("SMARTPEDALS_API_KEY", "changeme")
-
-# MongoDB
-MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
-
-# MQTT (local / secured)
-MQTT_BROKER = os.environ.get("MQTT_BROKER", "localhost")
-MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
-MQTT_USERNAME = os.environ.get("MQTT_USERNAME", "smartadmin")
-MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD", "smartpass")
-MQTT_CLIENT_ID = os.environ.get("MQTT_CLIENT_ID", "trusted-hepl_smartPedals")
-
-# TLS certs (paths must exist in container/host)
-MQTT_CA_CERT = os.environ.get("MQTT_CA_CERT", "/etc/ssl/ca.crt")
-MQTT_CLIENT_CERT = os.environ.get("MQTT_CLIENT_CERT", "/etc/ssl/client-mqtt.crt")
-MQTT_CLIENT_KEY = os.environ.get("MQTT_CLIENT_KEY", "/etc/ssl/client-mqtt.key.unlocked")
-
-# External MQTT (test.mosquitto.org)
-EXT_MQTT_BROKER = os.environ.get("EXT_MQTT_BROKER", "test.mosquitto.org")
-EXT_MQTT_PORT = int(os.environ.get("EXT_MQTT_PORT", 8884))
-EXT_MQTT_CLIENT_ID = os.environ.get("EXT_MQTT_CLIENT_ID", "smartPedals-ext-disponibilities")
-EXT_MQTT_CA_CERT = os.environ.get("EXT_MQTT_CA_CERT", "/etc/ssl/testmosquitto/mosquitto.org.crt")
-EXT_MQTT_CLIENT_CERT = os.environ.get("EXT_MQTT_CLIENT_CERT", "/etc/ssl/testmosquitto/client.crt")
-EXT_MQTT_CLIENT_KEY = os.environ.get("EXT_MQTT_CLIENT_KEY", "/etc/ssl/testmosquitto/client.key")
+SMARTPEDALS_ADMIN_KEY = os.environ.get("SMARTPEDALS_ADMIN_KEY", "") # Admin endpoints are disabled when empty
 
 # OpenWeatherMap
 OPENWEATHER_API_KEY = os.environ.get("OPENWEATHER_API_KEY", "")
 DEFAULT_CITY = os.environ.get("DEFAULT_CITY", "Angleur")
 OPENWEATHER_LANG = os.environ.get("OPENWEATHER_LANG", "en")
 
-# Mailtrap
-MAILTRAP_TOKEN = os.environ.get("MAILTRAP_TOKEN", "")
-MAILTRAP_EMAIL = os.environ.get("MAILTRAP_EMAIL", "")
-MAILTRAP_CAT = os.environ.get("MAILTRAP_CAT", "end-user")
-
-# Twilio (SMS notifications)
-TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
-TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
-TWILIO_NUMBER = os.environ.get("TWILIO_NUMBER", "")
-TARGET_NUMBER = os.environ.get("TARGET_NUMBER", "")
-ZERO_ALERT_SECONDS = int(os.environ.get("ZERO_ALERT_SECONDS", 15 * 60)) # Send message after 15
-
 # Webex
 WEBEX_API_BASE = os.environ.get("WEBEX_API_BASE", "https://webexapis.com/v1")
 WEBEX_ACCESS_TOKEN = os.environ.get("WEBEX_ACCESS_TOKEN", "")
 SUPPORT_DEFAULT_TITLE = os.environ.get("SUPPORT_DEFAULT_TITLE", "Support - HEPL")
+SUPPORT_CONCURRENCY = int(os.environ.get("SUPPORT_CONCURRENCY", "5")) # Parallel deletions/invites per job
+SUPPORT_JOBS_KEEP = int(os.environ.get("SUPPORT_JOBS_KEEP", "50")) # Finished jobs kept in memory
+WEBEX_MAX_RETRIES = int(os.environ.get("WEBEX_MAX_RETRIES", "3"))
 
 # Shodan
 SHODAN_API_BASE = os.environ.get("SHODAN_API_BASE", "https://api.shodan.io")
 SHODAN_API_KEY = os.environ.get("SHODAN_API_KEY", "")
 
+# List/get endpoints: ?fields=a,b (projection), ?limit=N&after=<id> (keyset pages in _id order)
+API_PAGE_SIZE = int(os.environ.get("API_PAGE_SIZE", "100")) # Page size when only after= is given
+API_PAGE_MAX = int(os.environ.get("API_PAGE_MAX", "1000")) # Largest limit=
+
+# Bulk endpoints
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", "20000")) # Items per bulk request
+
 # SSE (Server-Sent Events)
 events_listeners = []
 LISTENER_QUEUE_SIZE = 10
 
-# Other
-BRUSSELS = ZoneInfo("Europe/Brussels")
-AUTH_MAX_SKEW_SECONDS = int(os.environ.get("AUTH_MAX_SKEW_SECONDS", "120"))
-# External topic cache
+# Support provisioning jobs (job_id -> job dict)
+support_jobs = {}
+support_jobs_lock = threading.Lock()
+
+# Profiling windows started by this worker (profile id -> process -> stacks or error)
+profile_results = {}
+PROFILE_GRACE_SECONDS = 2 # Wait for the other processes after the window
+
+# External topic cache (pushed by the ingest worker)
 latest_disponibilities = None
 latest_disponibilities_count = None
-# Twilio
-twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-# Zero-availability alert state
-zero_since_ts = None
-zero_alert_sent = False
+
+# Availability counters from the rack state (pushed by the ingest worker, availability.py)
+latest_availability = None
 
 """
 Initialization and helpers
@@ -99,6 +96,7 @@ Initialization and helpers
 # App
 app = Flask(__name__)
 app.secret_key = "dev"
+app.json = BsonJSONProvider(app)  # ObjectId/datetime/Decimal128 and cursors, orjson when installed
 
 # API Key
 def require_api_key(f):
@@ -110,19 +108,21 @@ def require_api_key(f):
         return f(*args, **kwargs)
     return decorated
 
-# Initialize MongoDB
-def init_db():
-    client = MongoClient(MONGO_URL)
-    db = client.smartpedals
-    data_col = db.data
-    users_col = db.users
-    bikes_col = db.bikes
-    racks_col = db.racks
-    stations_col = db.stations
-    locations_col = db.locations
-    return client, db, data_col, users_col, bikes_col, racks_col, stations_col, locations_col
+# Admin Key
+def require_admin_key(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not SMARTPEDALS_ADMIN_KEY:
+            abort(404)
+        admin_key = request.headers.get("x-admin-key")
+        if not admin_key or admin_key != SMARTPEDALS_ADMIN_KEY:
+            abort(401)  # Unauthorized
+        return f(*args, **kwargs)
+    return decorated
 
+# Initialize MongoDB (lazy client, connects on first query)
 client, db, data_col, users_col, bikes_col, racks_col, stations_col, locations_col = init_db()
+trips_col = db[trips.TRIPS_COLLECTION]
 
 # SSE (Server-Sent Events)
 def publish_ping():
@@ -140,6 +140,174 @@ def publish_ping():
         except ValueError:
             pass
 
+# Live events from the ingest worker (and relayed from the other web workers)
+def on_ingest_event(event):
+    global latest_disponibilities, latest_disponibilities_count, latest_availability
+    kind = event.get("type")
+    if kind == "ping":
+        publish_ping()
+    elif kind == "availability":
+        latest_availability = event
+        publish_ping()
+    elif kind == "cache_invalidate":
+        response_cache.invalidate(event.get("keys"))
+    elif kind == "disponibilities":
+        latest_disponibilities = event.get("message")
+        latest_disponibilities_count = event.get("count")
+        publish_ping()
+    elif kind == "support_job":
+        support_job_merge(event["job"])
+    elif kind == "metrics":
+        metrics.store_remote(event["process"], event["metrics"])
+    elif kind == "profile" and event.get("scope") in ("all", "web"):
+        profiler.run_requested(event, f"web-{os.getpid()}", events.send, profile_hooks)
+    elif kind == "profile_result" and event["id"] in profile_results:
+        profile_results[event["id"]][event["process"]] = event["stacks"] if "stacks" in event else event.get("error")
+
+events = EventSubscriber(EVENTS_SOCKET, on_ingest_event)
+metrics_started = threading.Event()
+
+# Docked bikes changed through the API: the ingest recounts these racks
+def racks_changed(*rack_ids):
+    rack_ids = [r for r in rack_ids if r]
+    if rack_ids:
+        events.send({"type": "racks_changed", "racks": rack_ids})
+
+# Read-through cache of the GET user/bike/rack/station responses (cache.py), 200 only
+response_cache = cache.ResponseCache()
+
+metrics.Gauge("smartpedals_response_cache_entries", "Response cache entries (local backend)",
+              fn=lambda: response_cache.stats()["size"] or 0)
+metrics.Gauge("smartpedals_response_cache_hit_ratio", "Response cache hits / lookups since start",
+              fn=lambda: response_cache.stats()["hit_ratio"] or 0)
+
+def cached(kind):
+    def wrap(f):
+        @wraps(f)
+        def decorated(**kwargs):
+            if "fields" in request.args or "expand" in request.args:
+                return f(**kwargs)  # Partial or expanded documents are not cached
+            key = cache.key(kind, next(iter(kwargs.values())))
+            body = response_cache.get(key)
+            if body is not None:
+                return Response(body, mimetype="application/json", headers={"X-Cache": "hit"})
+            token = response_cache.token()
+            response = make_response(f(**kwargs))
+            # Not stored when served by the fleet read model: already in memory, with its own staleness bound
+            if response.status_code == 200 and "X-Fleet-Version" not in response.headers:
+                response_cache.put(key, response.get_data(), token)
+            response.headers["X-Cache"] = "miss"
+            return response
+        return decorated
+    return wrap
+
+# After a write: drop the keys here and in the other workers (relayed by the ingest hub)
+def invalidate(keys):
+    if keys:
+        response_cache.invalidate(keys)
+        events.send({"type": "cache_invalidate", "keys": keys})
+
+# Connect to the ingest hub on the first request of each worker
+@app.before_request
+def start_events():
+    events.start()
+    if not metrics_started.is_set():
+        metrics_started.set()
+        metrics.start_push(f"web-{os.getpid()}", events.send)
+        fleet.model.start(db)
+
+"""
+Metrics (Prometheus text format, every process of the deployment)
+"""
+
+@app.before_request
+def metrics_start_timer():
+    g.metrics_t0 = time.perf_counter()
+
+@app.after_request
+def metrics_observe_request(response):
+    t0 = g.pop("metrics_t0", None)
+    if t0 is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - t0, request.method, route)
+        metrics.HTTP_REQUESTS.inc(request.method, route, str(response.status_code))
+    return response
+
+# Negotiated gzip/br (compress.py): buffered bodies over COMPRESS_MIN_BYTES, streams chunk by chunk, SSE flushed per event
+@app.after_request
+def compress_response(response):
+    return compress.apply(response, request.headers.get("Accept-Encoding"), request.method)
+
+def sse_subscribers():
+    with support_jobs_lock:
+        job_listeners = sum(len(job["listeners"]) for job in support_jobs.values())
+    return {("live",): len(events_listeners), ("support_job",): job_listeners}
+
+metrics.Gauge("smartpedals_sse_subscribers", "Open SSE streams", ("stream",), fn=sse_subscribers)
+
+@app.route("/smartpedals/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(f"web-{os.getpid()}"), mimetype="text/plain; version=0.0.4")
+
+"""
+Profiler (admin): one bounded window, collapsed stacks for flamegraph.pl / speedscope
+"""
+
+# cprofile mode: every Nth request of this worker goes through cProfile (view + before/after hooks)
+def profile_hooks(wrap):
+    original = app.wsgi_app
+    app.wsgi_app = wrap(original)
+    return lambda: setattr(app, "wsgi_app", original)
+
+# POST /smartpedals/admin/profile?mode=sample&seconds=10&hz=100&scope=all
+#   mode: sample (value = samples) or cprofile (every=N, value = µs)
+#   scope: all (every process), web, ingest or self (this worker only)
+@app.route("/smartpedals/admin/profile", methods=["POST"])
+@require_admin_key
+def admin_profile():
+    mode = request.args.get("mode", "sample")
+    scope = request.args.get("scope", "all")
+    try:
+        seconds = float(request.args.get("seconds", "10"))
+        hz = float(request.args.get("hz", "100"))
+        every = int(request.args.get("every", "10"))
+    except ValueError:
+        return jsonify({"error": "seconds, hz and every must be numbers"}), 400
+    if not math.isfinite(seconds) or seconds <= 0:
+        return jsonify({"error": "seconds must be a finite number above 0"}), 400
+    seconds = min(seconds, profiler.PROFILE_MAX_SECONDS)
+    if mode not in ("sample", "cprofile") or scope not in ("all", "web", "ingest", "self"):
+        return jsonify({"error": "mode: sample|cprofile, scope: all|web|ingest|self"}), 400
+
+    profile_id = uuid.uuid4().hex
+    results = profile_results[profile_id] = {}
+    event = {"type": "profile", "id": profile_id, "mode": mode, "seconds": seconds, "hz": hz, "every": every,
+             "scope": scope}
+    try:
+        if scope != "self":
+            events.send(event)
+        if scope != "ingest":
+            try:
+                results[f"web-{os.getpid()}"] = profiler.run(mode, seconds, hz, every, profile_hooks)
+            except (profiler.ProfilerBusy, ValueError) as e:
+                results[f"web-{os.getpid()}"] = str(e)
+        else:
+            time.sleep(seconds)
+        # The other processes answer right after their own window
+        deadline = time.time() + PROFILE_GRACE_SECONDS
+        while scope != "self" and time.time() < deadline:
+            time.sleep(0.1)
+    finally:
+        profile_results.pop(profile_id, None)
+
+    stacks = {p: r for p, r in results.items() if isinstance(r, dict)}
+    errors = {p: r for p, r in results.items() if not isinstance(r, dict)}
+    app.logger.info("[PROFILE] %s %ss scope=%s: %s errors=%s", mode, seconds, scope, sorted(stacks), errors)
+    headers = {"X-Profile-Processes": ",".join(sorted(stacks))}
+    if errors:
+        headers["X-Profile-Errors"] = "; ".join(f"{p}: {e}" for p, e in sorted(errors.items()))
+    return Response(profiler.collapsed(stacks), mimetype="text/plain", headers=headers)
+
 @app.route("/smartpedals/stream")
 def stream():
     q = queue.Queue(maxsize=LISTENER_QUEUE_SIZE)
@@ -159,456 +327,161 @@ def stream():
                 pass
     return Response(stream_with_context(gen()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
-# Insert MQTT messages inside the mongodb
-def insert_to_mongo(topic, payload):
-    try:
-        temp_client = MongoClient(MONGO_URL)
-        temp_db = temp_client.smartpedals
-        temp_data_col = temp_db.data
-        result = temp_data_col.insert_one({"topic": topic, "payload": payload})
-        print(f"[MQTT] Inserted: {result.inserted_id}")
-        publish_ping()
-        temp_client.close()
-    except Exception as e:
-        print(f"[MQTT] Error during insert: {e}")
-
-# Send email via Mailtrap
-def send_mailtrap_email(to_email: str, subject: str, text: str, to_name: str | None = None) -> bool:
-    try:
-        if not MAILTRAP_TOKEN or not MAILTRAP_EMAIL:
-            app.logger.warning("[MAILTRAP] Missing MAILTRAP_TOKEN or MAILTRAP_EMAIL")
-            return False
-
-        headers = {
-            "Authorization": f"Bearer {MAILTRAP_TOKEN}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "from": {"email": MAILTRAP_EMAIL, "name": "SmartPedals"},
-            "to": [{"email": to_email, "name": (to_name or "User")}],
-            "subject": subject,
-            "text": text,
-            "category": MAILTRAP_CAT,
-        }
-
-        resp = requests.post(
-            "https://send.api.mailtrap.io/api/send",
-            headers=headers,
-            json=payload,
-            timeout=5,
-        )
-        if 200 <= resp.status_code < 300:
-            app.logger.info(f"[MAILTRAP] Email sent to {to_email}: {subject}")
-            return True
-        else:
-            app.logger.warning(f"[MAILTRAP] Send failed {resp.status_code}: {resp.text}")
-            return False
-    except Exception as e:
-        app.logger.exception(f"[MAILTRAP] Exception while sending email: {e}")
-        return False
-
-# Twilio message
-def twilio_send_sms(body: str) -> bool:
-    try:
-        msg = twilio_client.messages.create(
-            from_=TWILIO_NUMBER,
-            to=TARGET_NUMBER,
-            body=body
-        )
-        print(f"[TWILIO] SMS sent: sid={msg.sid}")
-        return True
-    except Exception as e:
-        print(f"[TWILIO] Send error: {e}")
-        return False
-
 """
-MQTT local secured for authentication (+email) and location messages AND external MQTT for disponibilities (+twilio sms)
+MONGO API
 """
-
-# Handle authentication messages
-def handle_auth_message(mqtt_client_instance, payload):
-    reply_topic = "hepl/auth_reply"
-    now = datetime.now(BRUSSELS)
-    now_iso = now.isoformat(timespec="seconds")
-
-    def send_deny(reason=None):
-        reply = {
-            "user_id": user_id,
-            "action": action,
-            "rack_id": rack_id,
-            "timestamp": now_iso,
-            "type": "auth_response",
-            "station_id": station_id if 'station_id' in locals() else None,
-            "reply": "deny"
-        }
-        mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
-        if reason:
-            app.logger.info(f"[AUTH] {reason} → deny")
-
+# API shapes computed by Mongo: "id" is the ObjectId, missing fields come back as null (or their default)
+def api_projection(*fields, **defaults):
+    projection = {"_id": 0, "id": "$_id"}
+    for field in fields:
+        projection[field] = {"$ifNull": [f"${field}", defaults.get(field)]}
+    return projection
+
+USER_PROJECTION = api_projection("firstName", "lastName", "email", "phone", "rfid", "history")
+BIKE_PROJECTION = api_projection("bike_id", "status", "currentUser", "currentRack", "history", history=[])
+RACK_PROJECTION = api_projection("rack_id", "station_id", "currentBike", "history", history=[])
+STATION_PROJECTION = api_projection("station_id", "name", "racks", racks=[])
+
+# Served from the fleet read model (fleet.py, same shapes as the projections above, without history)
+def fleet_response(doc):
+    return jsonify(doc), 200, {"X-Fleet-Version": str(fleet.model.version)}
+
+FIELD_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*")
+
+# ?fields=a,b -> list (None: all), among the projection fields (any name for a projection without "id")
+def requested_fields(projection):
+    text = request.args.get("fields")
+    if not text:
+        return None
+    fields = list(dict.fromkeys(f.strip() for f in text.split(",") if f.strip()))
+    known = "id" in projection
+    bad = [f for f in fields if not FIELD_NAME.fullmatch(f) or (known and f not in projection)]
+    if bad or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(bad) or text}")
+    return fields
+
+def field_projection(projection, fields):
+    if fields is None:
+        return projection
+    if "id" in projection:
+        return {"_id": 0, **{f: projection[f] for f in fields}}
+    return {"_id": 0, **{f: 1 for f in fields}}
+
+# ?limit / ?after -> (query, limit), limit None: everything (unpaged)
+def requested_page():
+    limit, after = request.args.get("limit"), request.args.get("after")
+    if limit is None and after is None:
+        return {}, None
     try:
-        data = json.loads(payload)
-        user_id = data.get("user_id")
-        bike_id = data.get("bike_id")
-        rack_id = data.get("rack_id")
-        # action = data.get("type") or data.get("action") # receive smth different now ...
-        action = data.get("action")
-        action_type = data.get("type")  # 'lock' or 'unlock'
-        ts_str = data.get("timestamp")
-
-        # Check if all required fields are present
-        # if not all([user_id, bike_id, rack_id, action, ts_str]):
-        # if not all([user_id, rack_id, action, ts_str]): # bike_id is optional for lock action
-        if not all([user_id, rack_id, ts_str]): # bike_id is optional for lock action
-            return send_deny("Missing fields")
-
-        # Check user
-        user = users_col.find_one({"rfid": str(user_id)})
-        if not user:
-            return send_deny(f"Unknown user {user_id}")
-
-        # Check bike
-        # bike_doc = bikes_col.find_one({"bike_id": str(bike_id)})
-        # if not bike_doc:
-        #     return send_deny(f"No bike found in rack {rack_id}")
-
-        # Check timestamp
-        try:
-            ts_msg = datetime.fromisoformat(str(ts_str))
-            if ts_msg.tzinfo is None:
-                ts_msg = ts_msg.replace(tzinfo=BRUSSELS)
-            skew = abs((now - ts_msg).total_seconds())
-        except Exception:
-            app.logger.info(f"[AUTH] Invalid timestamp format: {ts_str}, improvement point")
-            pass
-            # return send_deny(f"Invalid timestamp format {ts_str}")
-
-        # if skew > AUTH_MAX_SKEW_SECONDS:
-        #     app.logger.info(f"[AUTH] Timestamp skew too large: {skew:.1f}s (max {AUTH_MAX_SKEW_SECONDS}s), improvement point")
-        #     return send_deny(f"Timestamp skew too large ({skew:.1f}s)")
-
-        # Get rack and station_id for the reply
-        rack_doc = racks_col.find_one({"rack_id": str(rack_id)})
-        app.logger.info(f"[AUTH] Rack doc: {rack_doc}")
-        station_id = str(rack_doc.get("station_id")) if rack_doc else None
-
-        # Action: unlock
-        if action == "unlock":
-            update_bike = bikes_col.update_one(
-                {"bike_id": str(bike_id), "status": "available", "currentRack": str(rack_id)},
-                {"$set": {"status": "in_use", "currentUser": str(user_id), "currentRack": None},
-                "$push": {"history": {"action": "unlock", "user_id": str(user_id), "timestamp": now}}}
-            )
-            if update_bike.modified_count == 0:
-                return send_deny(f"Unlock denied for user={user_id} bike={bike_id} rack={rack_id}")
-
-            update_rack = racks_col.update_one(
-                {"rack_id": str(rack_id), "currentBike": str(bike_id)},
-                {"$set": {"currentBike": None},
-                "$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
-            )
-            if update_rack.modified_count == 0:
-                bikes_col.update_one(
-                    {"bike_id": str(bike_id), "status": "in_use", "currentUser": str(user_id), "currentRack": None},
-                    {"$set": {"status": "available", "currentUser": None, "currentRack": str(rack_id)},
-                    "$push": {"history": {"action": "unlock_rollback", "user_id": str(user_id), "timestamp": now}}}
-                )
-                return send_deny(f"Rack update failed for rack={rack_id} bike={bike_id} [rollback ok]")
-
-            users_col.update_one(
-                {"rfid": str(user_id)},
-                {"$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
-            )
-            reply = {
-                "user_id": user_id,
-                "action": action,
-                "rack_id": rack_id,
-                "timestamp": now_iso,
-                "type": "auth_response",
-                "station_id": station_id,
-                "reply": "accept"
-            }
-            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
-            app.logger.info(f"[AUTH] Unlock accepted for user={user_id} bike={bike_id} rack={rack_id}")
-            publish_ping()
-
-            try:
-                # User email notification
-                to_email = user.get("email") if isinstance(user, dict) else None
-                first = user.get("firstName") if isinstance(user, dict) else None
-                last  = user.get("lastName")  if isinstance(user, dict) else None
-                full_name = f"{first} {last}".strip() if first or last else "User"
-
-                if to_email:
-                    subject = f"Bike {bike_id} unlocked"
-                    text = (
-                        f"Hello {full_name},\n\n"
-                        f"Your bike {bike_id} has been unlocked at {now_iso}.\n"
-                        f"Rack: {rack_id or 'n/a'}.\n"
-                        f"Enjoy the ride!\n\n— HEPL Team"
-                    )
-                    send_mailtrap_email(to_email=to_email, subject=subject, text=text, to_name=full_name)
-                else:
-                    app.logger.warning(f"[MAILTRAP] No email for user {user_id}; skipping email")
-            except Exception as e:
-                app.logger.exception(f"[MAILTRAP] Error while preparing/sending unlock email: {e}")
-
-            # If we reach here, the unlock was successful
-            return
-
-        # Action: lock
-        if action == "lock":
-            # update_bike = bikes_col.update_one(
-            #     {"bike_id": str(bike_id), "status": "in_use", "currentUser": str(user_id)},
-            #     {"$set": {"status": "available", "currentUser": None, "currentRack": str(rack_id)},
-            #     "$push": {"history": {"action": "lock", "user_id": str(user_id), "timestamp": now}}}
-            # )
-            # if update_bike.modified_count == 0:
-            #     return send_deny(f"Lock denied for user={user_id} bike={bike_id} (not in use by this user)")
-
-            update_rack = racks_col.update_one(
-                {"rack_id": str(rack_id), "currentBike": None},
-                {"$set": {"currentBike": str(bike_id)},
-                "$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
-            )
-            # if update_rack.modified_count == 0:
-            #     bikes_col.update_one(
-            #         {"bike_id": str(bike_id), "status": "available", "currentUser": None, "currentRack": str(rack_id)},
-            #         {"$set": {"status": "in_use", "currentUser": str(user_id), "currentRack": None},
-            #         "$push": {"history": {"action": "lock_rollback", "user_id": str(user_id), "timestamp": now}}}
-            #     )
-            #     return send_deny(f"Rack busy/missing for rack={rack_id} bike={bike_id} [rollback ok]")
-
-            users_col.update_one(
-                {"rfid": str(user_id)},
-                {"$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
-            )
-            reply = {
-                "user_id": user_id,
-                "action": action,
-                "rack_id": rack_id,
-                "timestamp": now_iso,
-                "type": "auth_response",
-                "station_id": station_id,
-                "reply": "accept"
-            }
-            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
-            app.logger.info(f"[AUTH] Lock accepted for user={user_id} bike={bike_id} rack={rack_id}")
-            publish_ping()
-            return
-
-        # Unknown action
-        return send_deny(f"Unknown action '{action}'")
-
-    except Exception as e:
-        app.logger.info(f"[AUTH] Error: {e}")
-        try:
-            reply = {
-                "user_id": data.get("user_id") if isinstance(data, dict) else None,
-                "action": (data.get("type") or data.get("action")) if isinstance(data, dict) else None,
-                "rack_id": data.get("rack_id") if isinstance(data, dict) else None,
-                "timestamp": now_iso,
-                "type": "auth_response",
-                "station_id": None,
-                "reply": "deny"
-            }
-            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
-        except Exception:
-            pass
-
-# MQTT local (secured)
-def on_connect(client, userdata, flags, rc):
-    print(f"Connected with result code {rc}")
-    #client.subscribe("sensors/#")
-    client.subscribe("hepl/#")
-    client.subscribe("hepl/auth", qos=2)  # auth messages
-    client.subscribe("hepl/location")  # location messages
-    client.subscribe("hepl/parked", qos=2) # bike_id rack_id station_id
-
-def on_message(client, userdata, msg):
+        limit = int(limit) if limit is not None else API_PAGE_SIZE
+    except ValueError:
+        raise ValueError(f"Invalid limit '{limit}'")
+    if not 1 <= limit <= API_PAGE_MAX:
+        raise ValueError(f"limit must be between 1 and {API_PAGE_MAX}")
+    if after is None:
+        return {}, limit
     try:
-        payload = msg.payload.decode()
-        print(f"[MQTT] Message received: {payload}")
-        # Authentification
-        if msg.topic == "hepl/auth":
-            handle_auth_message(client, payload)
-            insert_to_mongo(msg.topic, payload)
-        elif msg.topic == "hepl/location":
-            try:
-                data = json.loads(payload)
-                data["timestamp"] = datetime.now(BRUSSELS)
-                locations_col.insert_one(data)
-                print(f"[MQTT] Location data inserted into database")
-            except json.JSONDecodeError:
-                print("[MQTT] Error decoding JSON payload for location message")
-            except Exception as e:
-                print(f"[MQTT] Error inserting location data: {e}")
-            insert_to_mongo(msg.topic, payload)
-        else:
-            insert_to_mongo(msg.topic, payload)
-    except Exception as e:
-        print(f"[MQTT] Error in on_message: {e}")
+        return {"_id": {"$gt": ObjectId(after)}}, limit
+    except Exception:
+        raise ValueError(f"Invalid after '{after}'")
 
-def start_mqtt_loop():
-    while True:
-        try:
-            mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
-            mqtt_client.loop_start()
-            while True:
-                if not mqtt_client.is_connected():
-                    print("[MQTT] Disconnected! Reconnecting...")
-                    mqtt_client.reconnect()
-                time.sleep(5)
-        except Exception as e:
-            print(f"[MQTT] loop error: {e}")
-            time.sleep(5)
-
-# MQTT client setup
-mqtt_client = mqtt.Client(client_id=MQTT_CLIENT_ID)
-mqtt_client.username_pw_set(username=MQTT_USERNAME, password=MQTT_PASSWORD)
-mqtt_client.tls_set(
-    ca_certs=MQTT_CA_CERT,
-    certfile=MQTT_CLIENT_CERT,
-    keyfile=MQTT_CLIENT_KEY,
-    tls_version=ssl.PROTOCOL_TLSv1_2
-)
-mqtt_client.tls_insecure_set(True)
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
-
-# Start MQTT thread
-mqtt_thread = threading.Thread(target=start_mqtt_loop)
-mqtt_thread.daemon = True
-mqtt_thread.start()
-
-# MQTT ext (test broker)
-def on_connect_ext(client, userdata, flag, rc):
-    print(f"[EXT MQTT] Connected to {EXT_MQTT_BROKER} with rc {rc}")
-    client.subscribe("hepl/disponibilities")
-
-# Handle disponibilities alerts with twilio
-def handle_disponibility_alerts(count: int):
-    """
-    If count stays 0 for ZERO_ALERT_SECONDS, send one "no bikes" SMS and arm recovery.
-    If count > 0 and a "no bikes" SMS was sent, send one "available again" SMS.
-    If zero resolves before 15 min, send nothing at all.
-    """
-    # init global variables to track state
-    global zero_since_ts, zero_alert_sent
-    t = time.time()
-
-    # If count is 0, check if we need to send an alert
-    if count == 0:
-        if zero_since_ts is None:
-            zero_since_ts = t
-        # If we have not sent an alert yet and the time since zero_since_ts is >= ZERO_ALERT_SECONDS
-        if (not zero_alert_sent) and (t - zero_since_ts) >= ZERO_ALERT_SECONDS:
-            # Send alert
-            if twilio_send_sms(f"No bikes available for {ZERO_ALERT_SECONDS // 60} minutes!"):
-                zero_alert_sent = True
-    else:
-        # If count > 0 and we had sent a zero alert, send an "available again" SMS
-        if zero_alert_sent:
-            twilio_send_sms(f"Bikes available again: {count}.")
-        # reset in all cases when count > 0
-        zero_since_ts = None
-        zero_alert_sent = False
-
-def on_message_ext(client, userdata, msg):
-    global latest_disponibilities, latest_disponibilities_count
+# Full pages carry X-Next-After (the _id to pass as after=), the body stays a plain array
+def list_response(col, projection, query=None):
     try:
-        payload = msg.payload.decode()
-        # latest_disponibilities = payload
-
-        # # Regex to extract number -> old way, without JSONPath (only message)
-        # m = re.search(r"\d+", payload)
-        # latest_disponibilities_count = int(m.group(0)) if m else None
-        
-        try:
-            # Try to parse as JSON
-            data = json.loads(payload)
-            latest_disponibilities = data.get("message", payload) # String
-            latest_disponibilities_count = data.get("availableBikes")  # Number
-            print(f"[EXT MQTT] {msg.topic}={payload} (count={latest_disponibilities_count})")
-        except json.JSONDecodeError:
-            # If not JSON, fallback to regex
-            latest_disponibilities = payload
-            m = re.search(r"\d+", payload)
-            latest_disponibilities_count = int(m.group(0)) if m else None
-            print(f"[EXT MQTT] {msg.topic}={payload} (fallback count={latest_disponibilities_count})")
-
-        # Trigger alerts logic after we have the count
-        if latest_disponibilities_count is not None:
-            handle_disponibility_alerts(latest_disponibilities_count)
-
-        # Reload SSE
-        publish_ping()
-    except Exception as e:
-        print(f"[EXT MQTT] Error in on_message_ext: {e}")
-
-def start_mqtt_loop_ext():
-    while True:
-        try:
-            mqtt_client_ext.connect(EXT_MQTT_BROKER, EXT_MQTT_PORT, 60)
-            mqtt_client_ext.loop_start()
-            while True:
-                if not mqtt_client_ext.is_connected():
-                    print("[MQTT EXT] Disconnected! Reconnecting...")
-                    mqtt_client_ext.reconnect()
-                time.sleep(5)
-        except Exception as e:
-            print(f"[MQTT EXT] loop error: {e}")
-
-mqtt_client_ext = mqtt.Client(client_id=EXT_MQTT_CLIENT_ID)
-mqtt_client_ext.tls_set(
-    ca_certs=EXT_MQTT_CA_CERT,
-    certfile=EXT_MQTT_CLIENT_CERT,
-    keyfile=EXT_MQTT_CLIENT_KEY,
-    tls_version=ssl.PROTOCOL_TLSv1_2
-)
-mqtt_client_ext.on_connect = on_connect_ext
-mqtt_client_ext.on_message = on_message_ext
-
+        projection = field_projection(projection, requested_fields(projection))
+        page, limit = requested_page()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if limit is None:
+        # Whole collection: streamed, one STREAM_BATCH of documents in memory at a time
+        cursor = col.find(query or {}, projection, batch_size=STREAM_BATCH)
+        return Response(stream_with_context(iter_array(cursor)), mimetype="application/json"), 200
+    # _id fetched for the cursor, not returned
+    paged = {k: v for k, v in projection.items() if k != "_id"} or None
+    docs = list(col.find({**(query or {}), **page}, paged, sort=[("_id", 1)], limit=limit))
+    headers = {"X-Next-After": str(docs[-1]["_id"])} if len(docs) == limit else {}
+    for doc in docs:
+        del doc["_id"]
+    return jsonify(docs), 200, headers
+
+# ?fields of the fleet documents (stations, racks, bikes): the read model fields by default, history only when named
+def fleet_fields(collection, projection):
+    return requested_fields(projection) or fleet.api_fields(collection)
+
+# One document, with ?fields. Fleet documents (collection given) come from the read model when it is fresh,
+# history joined from Mongo when asked for
+def get_response(col, query, projection, collection=None):
+    try:
+        fields = requested_fields(projection) if collection is None else fleet_fields(collection, projection)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    model_doc = fleet.model.get(collection, next(iter(query.values()))) if collection is not None else None
+    if model_doc is not None:
+        joined = fleet.not_in_model(collection, fields)
+        extra = col.find_one(query, field_projection(projection, joined)) if joined else {}
+        if extra is not None:  # None: deleted since, answered by Mongo below
+            doc = {**model_doc, **extra}
+            return fleet_response({f: doc[f] for f in fields})
+    doc = col.find_one(query, field_projection(projection, fields))
+    if not doc:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify(doc), 200
+
+# Multi-get: ?ids=a,b,c (GET) or {"ids": [...]} (POST _mget), unique, at most API_PAGE_MAX
+def requested_ids(ids):
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+        raise ValueError("ids must be a list of strings")
+    ids = list(dict.fromkeys(i.strip() for i in ids if i.strip()))
+    if not ids:
+        raise ValueError("No ids given")
+    if len(ids) > API_PAGE_MAX:
+        raise ValueError(f"At most {API_PAGE_MAX} ids per request")
+    return ids
+
+# {key: document with at least fields} of the given ids: the read model first (one $in query joins the history
+# when asked for), one $in query for the rest
+def fetch_many(col, collection, key, ids, projection, fields):
+    found = fleet.model.get_many(collection, ids)
+    joined = fleet.not_in_model(collection, fields)
+    if found and joined:
+        extra = {str(doc[key]): doc for doc in col.find({key: {"$in": list(found)}},
+                                                       field_projection(projection, [key, *joined]))}
+        found = {i: {**doc, **extra[i]} for i, doc in found.items() if i in extra}
+    rest = [i for i in ids if i not in found]
+    if rest:
+        found.update((str(doc[key]), doc) for doc in col.find({key: {"$in": rest}},
+                                                              field_projection(projection, [key, *fields])))
+    return found
+
+# Documents in request order (fleet ?fields), unknown ids listed in X-Missing-Ids
+def mget_response(col, collection, key, ids, projection):
+    try:
+        ids = requested_ids(ids)
+        fields = fleet_fields(collection, projection)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    found = fetch_many(col, collection, key, ids, projection, fields)
+    docs = [{f: found[i][f] for f in fields} for i in ids if i in found]
+    missing = [i for i in ids if i not in found]
+    return jsonify(docs), 200, {"X-Missing-Ids": ",".join(missing)} if missing else {}
 
-# Start MQTT EXT thread
-mqtt_thread_ext = threading.Thread(target=start_mqtt_loop_ext, daemon=True)
-mqtt_thread_ext.start()
+def mget_body():
+    body = request.get_json(silent=True)
+    return body.get("ids") if isinstance(body, dict) else None
 
-"""
-MONGO API
-"""
 # Users
 @app.route("/smartpedals/api/users", methods=["GET"])
 @require_api_key
 def list_users():
-    docs = users_col.find()
-    users = []
-    for d in docs:
-        users.append({
-            "id": str(d["_id"]),
-            "firstName": d.get("firstName"),
-            "lastName": d.get("lastName"),
-            "email": d.get("email"),
-            "phone": d.get("phone"),
-            "rfid": d.get("rfid"),
-            "history": d.get("history")})
-    return jsonify(users), 200
+    return list_response(users_col, USER_PROJECTION)
 
 @app.route("/smartpedals/api/users/<string:rfid>", methods=["GET"])
 @require_api_key
+@cached("user")
 def get_user(rfid):
-    d = users_col.find_one({"rfid": rfid})
-    if not d:
-        return jsonify({"status": "not_found"}), 404
-    user = {
-        "id": str(d["_id"]),
-        "firstName": d.get("firstName"),
-        "lastName": d.get("lastName"),
-        "email": d.get("email"),
-        "phone": d.get("phone"),
-        "rfid": d.get("rfid"),
-        "history": d.get("history")
-    }
-    return jsonify(user), 200
+    return get_response(users_col, {"rfid": rfid}, USER_PROJECTION)
 
 @app.route("/smartpedals/api/users", methods=["POST"])
 @require_api_key
@@ -616,6 +489,7 @@ def create_user():
     user_data = request.get_json()
     try:
         result = users_col.insert_one(user_data)
+        invalidate(cache.keys("user", user_data.get("rfid")))
         return jsonify({"status": "success", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
@@ -631,6 +505,7 @@ def update_user(rfid):
             {"rfid": rfid},
             {"$set": update}
         )
+        invalidate(cache.keys("user", rfid))
         if res.matched_count:
             return jsonify({"status": "updated"}), 200
         else:
@@ -642,6 +517,7 @@ def update_user(rfid):
 @require_api_key
 def delete_user(rfid):
     result = users_col.delete_one({"rfid": rfid})
+    invalidate(cache.keys("user", rfid))
     if result.deleted_count:
         return jsonify({"status": "deleted"}), 200
     return jsonify({"status": "not_found"}), 404
@@ -650,34 +526,47 @@ def delete_user(rfid):
 @app.route("/smartpedals/api/bikes", methods=["GET"])
 @require_api_key
 def list_bikes():
-    docs = bikes_col.find()
-    bikes = []
-    for d in docs:
-        bikes.append({
-            "id": str(d["_id"]),
-            "bike_id": d.get("bike_id"),
-            "status": d.get("status"),
-            "currentUser": d.get("currentUser"),
-            "currentRack": d.get("currentRack"),
-            "history": d.get("history", [])
-        })
-    return jsonify(bikes), 200
+    if "ids" in request.args:
+        return mget_response(bikes_col, "bikes", "bike_id", request.args["ids"], BIKE_PROJECTION)
+    return list_response(bikes_col, BIKE_PROJECTION)
+
+# Multi-get with the ids in the body (lists too long for a URL): {"ids": [...]}
+@app.route("/smartpedals/api/bikes/_mget", methods=["POST"])
+@require_api_key
+def mget_bikes():
+    return mget_response(bikes_col, "bikes", "bike_id", mget_body(), BIKE_PROJECTION)
 
 @app.route("/smartpedals/api/bikes/<string:bike_id>", methods=["GET"])
 @require_api_key
+@cached("bike")
 def get_bike(bike_id):
-    d = bikes_col.find_one({"bike_id": bike_id})
-    if not d:
-        return jsonify({"status": "not_found"}), 404
-    bike = {
-        "id": str(d["_id"]),
-        "bike_id": d.get("bike_id"),
-        "status": d.get("status"),
-        "currentUser": d.get("currentUser"),
-        "currentRack": d.get("currentRack"),
-        "history": d.get("history", [])
-    }
-    return jsonify(bike), 200
+    return get_response(bikes_col, {"bike_id": bike_id}, BIKE_PROJECTION, "bikes")
+
+# Distance, moving time, speeds and idle periods from the bike's GPS fixes (gps.py)
+# Window: ?trip_id (that trip, until now while open) or ?since/?until (ISO 8601, default the last GPS_WINDOW_HOURS)
+@app.route("/smartpedals/api/bikes/<string:bike_id>/metrics", methods=["GET"])
+@require_api_key
+def get_bike_metrics(bike_id):
+    try:
+        since = export.parse_time(request.args.get("since"))
+        until = export.parse_time(request.args.get("until"))
+    except export.ExportError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    trip_id = request.args.get("trip_id")
+    if trip_id:
+        trip = trips_col.find_one({"trip_id": trip_id, "bike_id": bike_id}, {"start": 1, "end": 1})
+        if not trip or not trip.get("start"):
+            return jsonify({"status": "not_found"}), 404
+        since = trips.as_utc(trip["start"]["timestamp"])
+        until = trips.as_utc(trip["end"]["timestamp"]) if trip.get("end") else None
+    since, until = gps.window(since, until)
+    try:
+        result = gps.bike_metrics(locations_col, bike_id, since, until)
+    except gps.TooManyFixes as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if trip_id:
+        result["trip_id"] = trip_id
+    return jsonify(result), 200
 
 @app.route("/smartpedals/api/bikes", methods=["POST"])
 @require_api_key
@@ -705,6 +594,8 @@ def create_bike():
                 "bike_id": bike_data["bike_id"],
                 "action": "dock",
                 "timestamp": now}}})
+            racks_changed(rack_id)
+        invalidate(cache.keys("bike", bike_data.get("bike_id")) + cache.keys("rack", rack_id))
         return jsonify({"status": "success", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
@@ -750,6 +641,8 @@ def update_bike(bike_id):
                     "bike_id": bike_id,
                     "action": "dock",
                     "timestamp": now}}})
+                racks_changed(old_rack, new_rack)
+            invalidate(cache.keys("bike", bike_id) + (cache.keys("rack", old_rack, new_rack) if new_rack is not None else []))
             return jsonify({"status": "updated"}), 200
         else:
             return jsonify({"status": "not_found"}), 404
@@ -773,7 +666,9 @@ def delete_bike(bike_id):
             "bike_id": bike_id,
             "action": "undock",
             "timestamp": now}}})
+        racks_changed(old_rack)
     result = bikes_col.delete_one({"bike_id": bike_id})
+    invalidate(cache.keys("bike", bike_id) + cache.keys("rack", old_rack))
     if result.deleted_count:
         return jsonify({"status": "deleted"}), 200
     return jsonify({"status": "not_found"}), 404
@@ -782,32 +677,20 @@ def delete_bike(bike_id):
 @app.route("/smartpedals/api/racks", methods=["GET"])
 @require_api_key
 def list_racks():
-    docs = racks_col.find()
-    racks = []
-    for d in docs:
-        racks.append({
-            "id": str(d["_id"]),
-            "rack_id": d.get("rack_id"),
-            "station_id": d.get("station_id"),
-            "currentBike": d.get("currentBike"),
-            "history": d.get("history", [])
-        })
-    return jsonify(racks), 200
+    if "ids" in request.args:
+        return mget_response(racks_col, "racks", "rack_id", request.args["ids"], RACK_PROJECTION)
+    return list_response(racks_col, RACK_PROJECTION)
+
+@app.route("/smartpedals/api/racks/_mget", methods=["POST"])
+@require_api_key
+def mget_racks():
+    return mget_response(racks_col, "racks", "rack_id", mget_body(), RACK_PROJECTION)
 
 @app.route("/smartpedals/api/racks/<string:rack_id>", methods=["GET"])
 @require_api_key
+@cached("rack")
 def get_rack(rack_id):
-    d = racks_col.find_one({"rack_id": rack_id})
-    if not d:
-        return jsonify({"status": "not_found"}), 404
-    rack = {
-        "id": str(d["_id"]),
-        "rack_id": d.get("rack_id"),
-        "station_id": d.get("station_id"),
-        "currentBike": d.get("currentBike"),
-        "history": d.get("history", [])
-    }
-    return jsonify(rack), 200
+    return get_response(racks_col, {"rack_id": rack_id}, RACK_PROJECTION, "racks")
 
 @app.route("/smartpedals/api/racks", methods=["POST"])
 @require_api_key
@@ -831,6 +714,8 @@ def create_rack():
                 {"station_id": station_id},
                 {"$push": {"racks": rack_id}}
             )
+        racks_changed(rack_id)
+        invalidate(cache.keys("rack", rack_id) + cache.keys("station", station_id))
         return jsonify({"status": "success", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
@@ -854,7 +739,9 @@ def delete_rack(rack_id):
 
     # Delete the rack
     res = racks_col.delete_one({"rack_id": rack_id})
+    invalidate(cache.keys("rack", rack_id) + cache.keys("station", station_id))
     if res.deleted_count:
+        racks_changed(rack_id)
         return jsonify({"status": "deleted"}), 200
     return jsonify({"status": "not_found"}), 404
 
@@ -862,30 +749,49 @@ def delete_rack(rack_id):
 @app.route("/smartpedals/api/stations", methods=["GET"])
 @require_api_key
 def list_stations():
-    docs = stations_col.find()
-    stations = []
-    for d in docs:
-        stations.append({
-            "id": str(d["_id"]),
-            "station_id": d.get("station_id"),
-            "name": d.get("name"),
-            "racks": d.get("racks")
-        })
-    return jsonify(stations), 200
+    if "ids" in request.args:
+        return mget_response(stations_col, "stations", "station_id", request.args["ids"], STATION_PROJECTION)
+    return list_response(stations_col, STATION_PROJECTION)
+
+# ?expand=racks: rack documents instead of ids (station order); bikes (implies racks): each rack's currentBike document
+# Nested documents carry the read model fields (history: GET the rack or bike with ?fields=history)
+# One read per level (read model, then one $in query), unknown racks/bikes listed in X-Missing-Ids
+STATION_EXPAND = ("racks", "bikes")
+
+def expanded_station(station_id, expand):
+    levels = {e.strip() for e in expand.split(",") if e.strip()}
+    try:
+        fields = requested_fields(STATION_PROJECTION)
+        if not levels or levels - set(STATION_EXPAND):
+            raise ValueError(f"expand must be among {', '.join(STATION_EXPAND)}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    station = fleet.model.station(station_id) or stations_col.find_one({"station_id": station_id}, STATION_PROJECTION)
+    if not station:
+        return jsonify({"status": "not_found"}), 404
+    rack_ids = [str(r) for r in station["racks"]]
+    found = fetch_many(racks_col, "racks", "rack_id", rack_ids, RACK_PROJECTION,
+                       fleet.api_fields("racks")) if rack_ids else {}
+    racks = [found[r] for r in rack_ids if r in found]
+    missing = [r for r in rack_ids if r not in found]
+    if "bikes" in levels:
+        bike_ids = [str(r["currentBike"]) for r in racks if r["currentBike"]]
+        bikes = fetch_many(bikes_col, "bikes", "bike_id", bike_ids, BIKE_PROJECTION,
+                           fleet.api_fields("bikes")) if bike_ids else {}
+        missing += [b for b in bike_ids if b not in bikes]
+        racks = [{**r, "currentBike": bikes.get(str(r["currentBike"])) if r["currentBike"] else None} for r in racks]
+    station = {**station, "racks": racks}  # Read model documents are shared: copy
+    if fields is not None:
+        station = {f: station[f] for f in fields}
+    return jsonify(station), 200, {"X-Missing-Ids": ",".join(missing)} if missing else {}
 
 @app.route("/smartpedals/api/stations/<string:station_id>", methods=["GET"])
 @require_api_key
+@cached("station")
 def get_station(station_id):
-    d = stations_col.find_one({"station_id": station_id})
-    if not d:
-        return jsonify({"status": "not_found"}), 404
-    station = {
-        "id": str(d["_id"]),
-        "station_id": d.get("station_id"),
-        "name": d.get("name"),
-        "racks": d.get("racks", [])
-    }
-    return jsonify(station), 200
+    if "expand" in request.args:
+        return expanded_station(station_id, request.args["expand"])
+    return get_response(stations_col, {"station_id": station_id}, STATION_PROJECTION, "stations")
 
 @app.route("/smartpedals/api/stations", methods=["POST"])
 @require_api_key
@@ -893,6 +799,7 @@ def create_station():
     station_data = request.get_json()
     try:
         result = stations_col.insert_one(station_data)
+        invalidate(cache.keys("station", station_data.get("station_id")))
         return jsonify({"status": "success", "id": str(result.inserted_id)}), 201
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 400
@@ -914,22 +821,261 @@ def delete_station(station_id):
         racks_col.delete_one({"rack_id": rack})
 
     # racks_col.delete_many({"station_id": station_id})
+    racks_changed(*racks)
     result = stations_col.delete_one({"station_id": station_id})
+    invalidate(cache.keys("station", station_id) + cache.keys("rack", *racks))
     if result.deleted_count:
         return jsonify({"status": "deleted"}), 200
     return jsonify({"status": "not_found"}), 404
 
+# Bulk (arrays of the single-route bodies): one $in query per referenced collection, ordered bulk_write,
+# one result per item in request order ("error" items are not written, "not_applied" follow a write error)
+def bulk_input():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return None, (jsonify({"status": "error", "message": "Expected a non-empty JSON array"}), 400)
+    if len(items) > BULK_MAX_ITEMS:
+        return None, (jsonify({"status": "error", "message": f"At most {BULK_MAX_ITEMS} items per request"}), 400)
+    results = [None if isinstance(item, dict) else {"status": "error", "message": "Item is not an object"}
+               for item in items]
+    return items, results
+
+def bulk_fail(results, i, message):
+    if results[i] is None:
+        results[i] = {"status": "error", "message": message}
+
+# Item ids: present, unique in the request, and (not) already stored; returns {id: stored doc}
+def bulk_check_ids(items, results, key, col, exists, projection=None):
+    seen = set()
+    for i, item in enumerate(items):
+        if results[i] is not None:
+            continue
+        ident = item.get(key)
+        if not ident:
+            bulk_fail(results, i, f"Missing {key}")
+        elif ident in seen:
+            bulk_fail(results, i, f"Duplicate {key} '{ident}' in request")
+        else:
+            seen.add(ident)
+    stored = {d[key]: d for d in col.find({key: {"$in": list(seen)}}, projection or {key: 1})}
+    for i, item in enumerate(items):
+        ident = item.get(key) if results[i] is None else None
+        if ident and (ident in stored) != exists:
+            bulk_fail(results, i, f"{key} '{ident}' {'not found' if exists else 'already exists'}")
+    return stored
+
+# Referenced parents (item[field] -> col[key]) with one $in query; returns {id: doc}
+def bulk_parents(items, results, field, col, key, projection=None):
+    wanted = {item.get(field) for i, item in enumerate(items) if results[i] is None and item.get(field)}
+    found = {d[key]: d for d in col.find({key: {"$in": list(wanted)}}, projection or {key: 1})} if wanted else {}
+    for i, item in enumerate(items):
+        parent = item.get(field) if results[i] is None else None
+        if parent and parent not in found:
+            bulk_fail(results, i, f"{field} '{parent}' not found")
+    return found
+
+# Ordered bulk_write of the valid items (one op each); returns the indexes written
+def bulk_apply(col, indexes, ops, results, status):
+    if not ops:
+        return []
+    failed = None
+    try:
+        col.bulk_write(ops, ordered=True)
+    except BulkWriteError as e:
+        error = e.details["writeErrors"][0]
+        failed = error["index"]
+        bulk_fail(results, indexes[failed], error.get("errmsg", "Write error"))
+        for i in indexes[failed + 1:]:
+            results[i] = {"status": "not_applied"}
+    applied = indexes if failed is None else indexes[:failed]
+    for i in applied:
+        results[i] = {"status": status}
+    return applied
+
+# Follow-up writes of the applied items (their racks, their stations): ordered bulk_write, ops[j] made for the
+# item indexes owners[j]. Items whose follow-up failed or was not reached become errors (the item itself is written)
+def bulk_follow_up(col, ops, owners, results, what):
+    if not ops:
+        return
+    try:
+        col.bulk_write(ops, ordered=True)
+        return
+    except BulkWriteError as e:
+        error = e.details["writeErrors"][0]
+        failed, message = error["index"], error.get("errmsg", "Write error")
+    except PyMongoError as e:
+        failed, message = 0, str(e)  # Unknown progress: none counted as done
+    app.logger.error("[BULK] %s update failed at op %s/%s: %s", what, failed, len(ops), message)
+    for indexes in owners[failed:]:
+        for i in indexes:
+            results[i] = {"status": "error", "message": f"Written, but the {what} update failed: {message}"}
+
+def bulk_response(items, results, key, status):
+    for item, result in zip(items, results):
+        if isinstance(item, dict):
+            result["id"] = item.get(key)
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    ok = counts.get(status, 0) == len(results)
+    code = (201 if status == "created" else 200) if ok else 207  # 207: see the per-item results
+    return jsonify({"status": "success" if ok else "partial", "counts": counts, "results": results}), code
+
+def dock_op(rack_id, bike_id, action, now):
+    return UpdateOne({"rack_id": rack_id}, {"$set": {"currentBike": bike_id if action == "dock" else None},
+                                            "$push": {"history": {"bike_id": bike_id, "action": action,
+                                                                  "timestamp": now}}})
+
+@app.route("/smartpedals/api/bikes/_bulk", methods=["POST"])
+@require_api_key
+def bulk_create_bikes():
+    items, results = bulk_input()
+    if items is None:
+        return results
+    bulk_check_ids(items, results, "bike_id", bikes_col, exists=False)
+    racks = bulk_parents(items, results, "currentRack", racks_col, "rack_id", {"rack_id": 1, "currentBike": 1})
+    claimed = set()
+    for i, item in enumerate(items):
+        rack_id = item.get("currentRack") if results[i] is None else None
+        if rack_id and (racks[rack_id].get("currentBike") is not None or rack_id in claimed):
+            bulk_fail(results, i, f"Rack '{rack_id}' is already occupied")
+        elif rack_id:
+            claimed.add(rack_id)
+
+    now = datetime.now(BRUSSELS)
+    valid = [i for i, r in enumerate(results) if r is None]
+    for i in valid:
+        items[i]["status"] = "available"  # Same as create_bike
+    applied = bulk_apply(bikes_col, valid, [InsertOne(items[i]) for i in valid], results, "created")
+    docked = [(items[i]["currentRack"], items[i]["bike_id"], i) for i in applied if items[i].get("currentRack")]
+    if docked:
+        bulk_follow_up(racks_col, [dock_op(rack_id, bike_id, "dock", now) for rack_id, bike_id, _ in docked],
+                       [[i] for _, _, i in docked], results, "rack")
+        racks_changed(*(rack_id for rack_id, _, _ in docked))
+    invalidate(cache.keys("bike", *(items[i]["bike_id"] for i in applied))
+               + cache.keys("rack", *(rack_id for rack_id, _, _ in docked)))
+    return bulk_response(items, results, "bike_id", "created")
+
+# Same rules as update_bike for each item ({"bike_id": ..., fields to set})
+@app.route("/smartpedals/api/bikes/_bulk", methods=["PUT"])
+@require_api_key
+def bulk_update_bikes():
+    items, results = bulk_input()
+    if items is None:
+        return results
+    bikes = bulk_check_ids(items, results, "bike_id", bikes_col, exists=True,
+                           projection={"bike_id": 1, "status": 1, "currentUser": 1, "currentRack": 1})
+    racks = bulk_parents(items, results, "currentRack", racks_col, "rack_id", {"rack_id": 1, "currentBike": 1})
+    claimed = set()
+    for i, item in enumerate(items):
+        if results[i] is not None:
+            continue
+        bike = bikes[item["bike_id"]]
+        new_rack = item.get("currentRack")
+        if bike.get("status") == "in_use" or bike.get("currentUser") is not None:
+            bulk_fail(results, i, f"Cannot change rack while bike '{item['bike_id']}' is in use")
+        elif new_rack is not None and (racks[new_rack].get("currentBike") is not None or new_rack in claimed):
+            bulk_fail(results, i, f"Rack '{new_rack}' is already occupied")
+        elif new_rack is not None:
+            claimed.add(new_rack)
+
+    now = datetime.now(BRUSSELS)
+    valid = [i for i, r in enumerate(results) if r is None]
+    ops = [UpdateOne({"bike_id": items[i]["bike_id"]}, {"$set": {k: v for k, v in items[i].items() if k != "bike_id"}})
+           for i in valid]
+    applied = bulk_apply(bikes_col, valid, ops, results, "updated")
+    rack_ops, owners, touched = [], [], []
+    for i in applied:
+        bike_id, new_rack = items[i]["bike_id"], items[i].get("currentRack")
+        if new_rack is None:
+            continue
+        old_rack = bikes[bike_id].get("currentRack")
+        if old_rack:
+            rack_ops.append(dock_op(old_rack, bike_id, "undock", now))
+            owners.append([i])
+        rack_ops.append(dock_op(new_rack, bike_id, "dock", now))
+        owners.append([i])
+        touched += [old_rack, new_rack]
+    if rack_ops:
+        bulk_follow_up(racks_col, rack_ops, owners, results, "rack")
+        racks_changed(*touched)
+    invalidate(cache.keys("bike", *(items[i]["bike_id"] for i in applied)) + cache.keys("rack", *touched))
+    return bulk_response(items, results, "bike_id", "updated")
+
+@app.route("/smartpedals/api/racks/_bulk", methods=["POST"])
+@require_api_key
+def bulk_create_racks():
+    items, results = bulk_input()
+    if items is None:
+        return results
+    bulk_check_ids(items, results, "rack_id", racks_col, exists=False)
+    bulk_parents(items, results, "station_id", stations_col, "station_id")
+
+    valid = [i for i, r in enumerate(results) if r is None]
+    applied = bulk_apply(racks_col, valid, [InsertOne(items[i]) for i in valid], results, "created")
+    by_station = {}
+    for i in applied:
+        if items[i].get("station_id"):
+            by_station.setdefault(items[i]["station_id"], []).append(i)
+    if by_station:
+        bulk_follow_up(stations_col, [UpdateOne({"station_id": station_id},
+                                                {"$push": {"racks": {"$each": [items[i]["rack_id"] for i in indexes]}}})
+                                      for station_id, indexes in by_station.items()],
+                       list(by_station.values()), results, "station")
+    rack_ids = [items[i]["rack_id"] for i in applied]
+    racks_changed(*rack_ids)
+    invalidate(cache.keys("rack", *rack_ids) + cache.keys("station", *by_station))
+    return bulk_response(items, results, "rack_id", "created")
+
+@app.route("/smartpedals/api/stations/_bulk", methods=["POST"])
+@require_api_key
+def bulk_create_stations():
+    items, results = bulk_input()
+    if items is None:
+        return results
+    bulk_check_ids(items, results, "station_id", stations_col, exists=False)
+
+    valid = [i for i, r in enumerate(results) if r is None]
+    applied = bulk_apply(stations_col, valid, [InsertOne(items[i]) for i in valid], results, "created")
+    invalidate(cache.keys("station", *(items[i]["station_id"] for i in applied)))
+    return bulk_response(items, results, "station_id", "created")
+
 # Locations
 @app.route("/smartpedals/api/locations", methods=["GET"])
 @require_api_key
 def list_locations():
     # Exclude _id -> bug in node red
-    docs = locations_col.find({}, {"_id": 0})
-    locations = []
-    for d in docs:
-        d["timestamp"] = d["timestamp"].isoformat()
-        locations.append(d)
-    return jsonify(locations), 200
+    return list_response(locations_col, {"_id": 0})
+
+# Trips (trips.py, built by the ingest worker): ?bike_id, ?user_id, ?status filters, paged like the other lists
+TRIP_PROJECTION = api_projection("trip_id", "bike_id", "user_id", "status", "start", "end", "duration_s")
+
+@app.route("/smartpedals/api/trips", methods=["GET"])
+@require_api_key
+def list_trips():
+    query = {name: request.args[name] for name in ("bike_id", "user_id", "status") if name in request.args}
+    return list_response(trips_col, TRIP_PROJECTION, query)
+
+# Export (data, locations): streamed in fixed-size compressed batches, resume with after=<last exported id>
+@app.route("/smartpedals/api/export/<string:collection>", methods=["GET"])
+@require_api_key
+def export_collection(collection):
+    fmt = request.args.get("format", "ndjson.gz")
+    try:
+        export.check_format(fmt)
+        query = export.build_query(
+            collection,
+            since=export.parse_time(request.args.get("since")),
+            until=export.parse_time(request.args.get("until")),
+            after=request.args.get("after"),
+            **{name: request.args[name] for name in export.COLLECTIONS.get(collection, {}) if name in request.args},
+        )
+    except export.ExportError as e:
+        return jsonify({"error": str(e)}), 400
+    app.logger.info("[EXPORT] %s %s %s", collection, fmt, query)
+    filename = f"{collection}-{datetime.now(BRUSSELS).strftime('%Y%m%dT%H%M%S')}.{fmt}"
+    return Response(stream_with_context(export.stream(db[collection], query, fmt)), mimetype=export.MIMETYPES[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={filename}", "Cache-Control": "no-store"})
 
 """
 WEB PAGE
@@ -966,8 +1112,9 @@ def database():
         return redirect(url_for("database"))
 
     # Read data
-    data = list(data_col.find({}, {"_id": 1, "topic": 1, "payload": 1}))
-    return render_template("database.html", data=data, disponibilities=latest_disponibilities, disponibilities_count=latest_disponibilities_count)
+    data = list(data_col.find({}, {"_id": 1, "topic": 1, "ts": 1, "payload": 1, "raw": 1}))
+    return render_template("database.html", data=data, disponibilities=latest_disponibilities, disponibilities_count=latest_disponibilities_count,
+                           availability=latest_availability)
 
 # Weather page
 @app.route("/smartpedals/weather", methods=["GET"])
@@ -989,7 +1136,7 @@ def weather():
             resp.raise_for_status()
             weather = resp.json()
         except requests.RequestException as e:
-            app.logger.error(f"Error weather API: {e}")
+            app.logger.error("Error weather API: %s", e)
     return render_template("weather.html", weather=weather, city=city)
 
 # Support page
@@ -1010,122 +1157,261 @@ def support():
             excuse = match.group(1)
 
     except requests.RequestException as e:
-        app.logger.warning(f"Failed to fetch developer excuse: {e}")
+        app.logger.warning("Failed to fetch developer excuse: %s", e)
 
-    return render_template("support.html", room_id=room_id, default_title=SUPPORT_DEFAULT_TITLE, support_members=os.environ.get("SUPPORT_MEMBERS", ""), excuse=excuse)
+    job = support_jobs.get((request.args.get("job_id") or "").strip())
+    if job and job["room_id"] and not room_id and job["status"] in ("done", "partial"):
+        room_id = job["room_id"]
 
-# Create room + invite members + post welcome (capture web URL)
-@app.route("/smartpedals/support/create", methods=["POST"])
-def support_create():
-    token = WEBEX_ACCESS_TOKEN
-    if not token:
-        flash("WEBEX_ACCESS_TOKEN is missing (bot token).", "error")
-        app.logger.error("WEBEX_ACCESS_TOKEN is not set.")
-        return redirect(url_for("support"))
+    return render_template("support.html", room_id=room_id, job=job, default_title=SUPPORT_DEFAULT_TITLE, support_members=os.environ.get("SUPPORT_MEMBERS", ""), excuse=excuse)
 
-    title = (request.form.get("title") or SUPPORT_DEFAULT_TITLE).strip()
+# Webex call with retry on 429/5xx (Retry-After honoured); non-idempotent calls only retry on 429
+def webex_call(method, path, headers, idempotent=True, **kwargs):
+    delay = 1.0
+    for attempt in range(WEBEX_MAX_RETRIES + 1):
+        last = attempt == WEBEX_MAX_RETRIES
+        try:
+            resp = requests.request(method, f"{WEBEX_API_BASE}{path}", headers=headers, timeout=8, **kwargs)
+        except requests.RequestException:
+            if last or not idempotent:
+                raise
+        else:
+            retryable = resp.status_code == 429 or (idempotent and resp.status_code >= 500)
+            if last or not retryable:
+                return resp
+            delay = float(resp.headers.get("Retry-After", delay))
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
+
+# Push a progress event to the job history and its SSE listeners
+def support_job_emit(job, step, message, **extra):
+    event = {"step": step, "message": message, "status": job["status"], "room_id": job["room_id"], **extra}
+    with support_jobs_lock:
+        job["events"].append(event)
+    support_job_notify(job, event)
+    # Replicate the job on the other web workers (SSE/retry may land on any of them)
+    events.send({"type": "support_job", "job": {
+        **{k: v for k, v in job.items() if k not in ("listeners", "events")},
+        "done": sorted(job["done"]),
+        "invited": sorted(job["invited"]),
+        "event": event,
+    }})
+    app.logger.info("[SUPPORT] job=%s %s: %s", job['id'], step, message)
+
+def support_job_notify(job, event):
+    with support_jobs_lock:
+        listeners = list(job["listeners"])
+    for q in listeners:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            pass
+
+# Apply a job snapshot sent by the worker running it
+def support_job_merge(data):
+    event = data.pop("event")
+    with support_jobs_lock:
+        job = support_jobs.get(data["id"])
+        if job and job["owner"] == os.getpid():
+            return
+        if not job:
+            job = support_jobs[data["id"]] = {"events": [], "listeners": []}
+        job.update(data, done=set(data["done"]), invited=set(data["invited"]))
+        job["events"].append(event)
+    support_job_notify(job, event)
+
+def support_job_new(title, members):
+    job = {
+        "id": uuid.uuid4().hex,
+        "title": title,
+        "members": members,
+        "status": "queued",
+        "room_id": None,
+        "done": set(),      # Completed steps, skipped on retry
+        "invited": set(),   # Emails already members of the room
+        "failed": {},       # email -> last error
+        "attempts": 0,
+        "owner": os.getpid(),
+        "events": [],
+        "listeners": [],
+    }
+    with support_jobs_lock:
+        support_jobs[job["id"]] = job
+        # Forget the oldest finished jobs
+        finished = [j for j in support_jobs.values() if j["status"] in ("done", "partial", "failed")]
+        for old in finished[:max(0, len(support_jobs) - SUPPORT_JOBS_KEEP)]:
+            support_jobs.pop(old["id"], None)
+    return job
+
+def support_job_start(job):
+    job["owner"] = os.getpid()
+    job["status"] = "running"
+    job["attempts"] += 1
+    threading.Thread(target=run_support_job, args=(job,), daemon=True).start()
+
+# Provision the support room: cleanup -> create -> invite -> welcome (each step is skipped once done)
+def run_support_job(job):
     headers_json = {
-        "Authorization": f"Bearer {token}",
+        "Authorization": f"Bearer {WEBEX_ACCESS_TOKEN}",
         "Content-Type": "application/json",
         "Accept": "application/json",
     }
-
-    # Check if a room with the same title already exists and delete it
-    app.logger.info(f"Checking for existing support spaces with title: '{title}' to delete.")
+    title = job["title"]
     try:
-        # Get rooms with the specified title (Webex API might return partial matches)
-        search_response = requests.get(
-            f"{WEBEX_API_BASE}/rooms",
-            headers=headers_json,
-            params={"type": "group", "title": title},
-            timeout=8
-        )
-        search_response.raise_for_status()
-        rooms_found = search_response.json().get("items", [])
-
-        deleted_count = 0
-        for room in rooms_found:
-            # Ensure exact title match before deleting
-            if room.get("title") == title:
-                room_to_delete_id = room.get("id")
+        with ThreadPoolExecutor(max_workers=SUPPORT_CONCURRENCY) as pool:
+            # Delete old rooms with the same title (exact match, Webex search is partial)
+            if "cleanup" not in job["done"]:
+                search_response = webex_call("GET", "/rooms", headers_json, params={"type": "group", "title": title})
+                search_response.raise_for_status()
+                old_rooms = [r.get("id") for r in search_response.json().get("items", [])
+                             if r.get("title") == title and r.get("id") != job["room_id"]]
+
+                def delete_room(room_id):
+                    # 404 = already deleted by a previous attempt
+                    return webex_call("DELETE", f"/rooms/{room_id}", headers_json).status_code in (204, 404)
+
+                deleted = sum(pool.map(delete_room, old_rooms))
+                job["done"].add("cleanup")
+                support_job_emit(job, "cleanup", f"Deleted {deleted}/{len(old_rooms)} old support space(s) with title '{title}'.")
+
+            # Create the room (on retry, adopt the room a failed attempt may already have created)
+            if not job["room_id"]:
+                if job["attempts"] > 1:
+                    search_response = webex_call("GET", "/rooms", headers_json, params={"type": "group", "title": title})
+                    if search_response.ok:
+                        existing = [r.get("id") for r in search_response.json().get("items", []) if r.get("title") == title]
+                        job["room_id"] = existing[0] if existing else None
+                if not job["room_id"]:
+                    room_creation_response = webex_call("POST", "/rooms", headers_json, idempotent=False, json={"title": title})
+                    room_creation_response.raise_for_status()
+                    job["room_id"] = room_creation_response.json().get("id")
+                    if not job["room_id"]:
+                        raise RuntimeError("Room creation succeeded but no room ID returned.")
+                support_job_emit(job, "create", f"Created new support space: '{title}'.")
+
+            # Invite members in parallel (409 = already a member)
+            pending = [m for m in job["members"] if m not in job["invited"] and not m.lower().endswith(".bot")]
+
+            def invite(email):
                 try:
-                    delete_response = requests.delete(
-                        f"{WEBEX_API_BASE}/rooms/{room_to_delete_id}",
-                        headers=headers_json,
-                        timeout=8
-                    )
-                    if delete_response.status_code == 204: # 204 No Content is success for DELETE
-                        app.logger.info(f"Successfully deleted existing room: {room_to_delete_id} ('{title}')")
-                        deleted_count += 1
-                    else:
-                        app.logger.warning(f"Failed to delete existing room {room_to_delete_id}: {delete_response.status_code} - {delete_response.text}")
+                    membership_response = webex_call("POST", "/memberships", headers_json,
+                                                     json={"roomId": job["room_id"], "personEmail": email})
+                    if membership_response.status_code not in (200, 409):
+                        membership_response.raise_for_status()
+                    return email, None
                 except requests.RequestException as e:
-                    app.logger.error(f"Error deleting existing room {room_to_delete_id}: {e}")
-
-        if deleted_count > 0:
-            flash(f"Deleted {deleted_count} old support space(s) with title '{title}'.", "info")
-        else:
-            app.logger.info(f"No existing support spaces with title '{title}' found to delete.")
-
-    except requests.RequestException as e:
-        flash(f"Error checking for/deleting old Webex spaces: {e}", "error")
-        app.logger.error(f"Error during pre-creation cleanup of rooms: {e}")
-        # Continue to try creating a new room even if cleanup fails
-        pass
+                    return email, str(e)
 
-    # Create new room
-    room_id = None
-    try:
-        room_creation_response = requests.post(f"{WEBEX_API_BASE}/rooms", headers=headers_json,
-                          json={"title": title}, timeout=8)
-        room_creation_response.raise_for_status()
-        room_id = room_creation_response.json().get("id")
-        if not room_id:
-            flash("Room creation succeeded but no room ID returned.", "error")
-            app.logger.error("New room creation succeeded but no room ID returned.")
-            return redirect(url_for("support"))
-        flash(f"Created new support space: '{title}'.", "success") # Specific success message
-        app.logger.info(f"Created new room with room_id: {room_id}")
+            for email, error in pool.map(invite, pending):
+                if error:
+                    job["failed"][email] = error
+                    support_job_emit(job, "invite", f"Invite {email} failed: {error}", email=email)
+                else:
+                    job["invited"].add(email)
+                    job["failed"].pop(email, None)
+                    support_job_emit(job, "invite", f"Invited {email}.", email=email)
+
+        # Post welcome message
+        if "welcome" not in job["done"]:
+            msg = "Support space created. Open the space and click **Meet** to start the call via the web app."
+            message_response = webex_call("POST", "/messages", headers_json, idempotent=False,
+                                          json={"roomId": job["room_id"], "markdown": msg})
+            message_response.raise_for_status()
+            job["done"].add("welcome")
+            support_job_emit(job, "welcome", "Welcome message posted.")
+
+        job["status"] = "partial" if job["failed"] else "done"
+        support_job_emit(job, "finished", f"{len(job['invited'])} member(s) invited, {len(job['failed'])} failed.")
+    except (requests.RequestException, RuntimeError) as e:
+        job["status"] = "failed"
+        support_job_emit(job, "error", f"Webex provisioning error: {e}")
+    except Exception as e:
+        # Unexpected Webex body (KeyError/ValueError...) or bug: end the job, the page stops waiting
+        app.logger.exception("[SUPPORT] job=%s crashed: %s", job['id'], e)
+        job["status"] = "failed"
+        support_job_emit(job, "error", f"Unexpected error: {e}")
 
-    except requests.RequestException as e:
-        flash(f"Webex room creation error: {e}", "error")
-        app.logger.error(f"Error creating new room: {e}")
+# Create room + invite members + post welcome, in the background (returns the job ID immediately)
+@app.route("/smartpedals/support/create", methods=["POST"])
+def support_create():
+    if not WEBEX_ACCESS_TOKEN:
+        flash("WEBEX_ACCESS_TOKEN is missing (bot token).", "error")
+        app.logger.error("WEBEX_ACCESS_TOKEN is not set.")
         return redirect(url_for("support"))
 
-    # Invite members
+    title = (request.form.get("title") or SUPPORT_DEFAULT_TITLE).strip()
     members_raw = os.environ.get("SUPPORT_MEMBERS", "")
     members = [m.strip() for m in members_raw.split(",") if m.strip()]
-    # Check if there are any members to invite
-    for email in members:
-        # Skip bot emails, already a member
-        if email.lower().endswith(".bot"):
-            app.logger.info(f"Skipping bot email in membership: {email}")
-            continue
-        try:
-            membership_response = requests.post(f"{WEBEX_API_BASE}/memberships", headers=headers_json,
-                               json={"roomId": room_id, "personEmail": email}, timeout=8)
-            if membership_response.status_code not in (200, 409):  # 409 = already a member
-                membership_response.raise_for_status()
-            elif membership_response.status_code == 409: # Explicitly log already a member
-                app.logger.info(f"Member {email} is already in room {room_id}. (Skipped invite)")
-        except requests.RequestException as e:
-            app.logger.error(f"[WEBEX] Invite {email} error: {e}")
-
-    # Post welcome message and capture its web URL (opens the space in the browser)
-    try:
-        msg = "Support space created. Open the space and click **Meet** to start the call via the web app."
-        message_response = requests.post(f"{WEBEX_API_BASE}/messages", headers=headers_json,
-                           json={"roomId": room_id, "markdown": msg}, timeout=8)
-        message_response.raise_for_status()
 
-        app.logger.info(f"Webex Response - Statut: {message_response.status_code}")
-        app.logger.info(f"Webex Response - Text: {message_response.text}")
-    except requests.RequestException as e:
-        app.logger.error(f"[WEBEX] Post message error: {e}")
-        flash("Failed to post welcome message to the new space.", "warning")
+    job = support_job_new(title, members)
+    support_job_start(job)
+
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job_id": job["id"], "status": job["status"]}), 202
+    return redirect(url_for("support", job_id=job["id"]))
+
+# Retry a failed/partial job (completed steps and invited members are skipped)
+@app.route("/smartpedals/support/jobs/<job_id>/retry", methods=["POST"])
+def support_job_retry(job_id):
+    job = support_jobs.get(job_id)
+    if not job:
+        abort(404)
+    if job["status"] in ("failed", "partial"):
+        support_job_start(job)
+    return redirect(url_for("support", job_id=job_id))
+
+# Job status (JSON)
+@app.route("/smartpedals/support/jobs/<job_id>", methods=["GET"])
+def support_job_status(job_id):
+    job = support_jobs.get(job_id)
+    if not job:
+        return jsonify({"status": "not_found"}), 404
+    return jsonify({
+        "job_id": job["id"],
+        "title": job["title"],
+        "status": job["status"],
+        "room_id": job["room_id"],
+        "invited": sorted(job["invited"]),
+        "failed": job["failed"],
+        "events": job["events"],
+    }), 200
+
+# Job progress (SSE): replay past events, then follow until the job ends
+@app.route("/smartpedals/support/jobs/<job_id>/stream")
+def support_job_stream(job_id):
+    job = support_jobs.get(job_id)
+    if not job:
+        abort(404)
+    q = queue.Queue(maxsize=LISTENER_QUEUE_SIZE * 10)
+    terminal = ("finished", "error")
+    with support_jobs_lock:
+        history = list(job["events"])
+        ended = job["status"] not in ("queued", "running") and bool(history) and history[-1]["step"] in terminal
+        job["listeners"].append(q)
 
-    # Redirect back with room_id (and message web URL) as query params
-    return redirect(url_for("support", room_id=room_id))
+    def gen():
+        try:
+            for event in history:
+                yield f"data: {json.dumps(event)}\n\n"
+            while not ended:
+                try:
+                    event = q.get(timeout=15)
+                except queue.Empty:
+                    if job["status"] not in ("queued", "running"):
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+                if event["step"] in terminal:
+                    break
+            yield "event: end\ndata: {}\n\n"
+        finally:
+            with support_jobs_lock:
+                try:
+                    job["listeners"].remove(q)
+                except ValueError:
+                    pass
+    return Response(stream_with_context(gen()), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 # Delete room
 @app.route("/smartpedals/support/delete", methods=["POST"])
@@ -1142,22 +1428,22 @@ def support_delete():
         return redirect(url_for("support"))
 
     headers = {"Authorization": f"Bearer {token}"}
-    app.logger.info(f"Attempting to delete room: {room_id}")
+    app.logger.info("Attempting to delete room: %s", room_id)
     try:
         r = requests.delete(f"{WEBEX_API_BASE}/rooms/{room_id}", headers=headers, timeout=8)
         if r.status_code == 204:
             flash("Space deleted successfully!", "success")
-            app.logger.info(f"Room {room_id} deleted successfully.")
+            app.logger.info("Room %s deleted successfully.", room_id)
         else:
             try:
                 err = r.json()
             except Exception:
                 err = r.text
             flash(f"Delete failed: {r.status_code} {err}", "error")
-            app.logger.error(f"Delete failed for room {room_id}: {r.status_code} {err}")
+            app.logger.error("Delete failed for room %s: %s %s", room_id, r.status_code, err)
     except requests.RequestException as e:
         flash(f"Webex delete error: {e}", "error")
-        app.logger.error(f"Webex delete error for room {room_id}: {e}")
+        app.logger.error("Webex delete error for room %s: %s", room_id, e)
 
     return redirect(url_for("support"))
 
@@ -1190,14 +1476,14 @@ def security():
         resp_info.raise_for_status()
         api_info = resp_info.json()
     except requests.RequestException as e:
-        app.logger.error(f"Error fetching Shodan API info: {e}")
+        app.logger.error("Error fetching Shodan API info: %s", e)
         flash("Failed to fetch Shodan API information.", "error")
 
     # Public IP via ipify
     try:
         local_pub_ip = requests.get("https://api.ipify.org", timeout=5).text.strip()
     except requests.RequestException as e:
-        app.logger.error(f"Error fetching public IP: {e}")
+        app.logger.error("Error fetching public IP: %s", e)
         flash("Failed to fetch public IP address.", "error")
         
 
@@ -1207,7 +1493,7 @@ def security():
         # url_hepl = f"{SHODAN_API_BASE}/shodan/host/{requests.get('https://api.ipify.org').text.strip()}"
         url_hepl = f"{SHODAN_API_BASE}/shodan/host/{local_pub_ip}"
         resp_hepl = requests.get(url_hepl, params=params_key, timeout=10)
-        app.logger.info(f"HEPL lookup response: {resp_hepl.status_code} - {resp_hepl.text}")
+        app.logger.info("HEPL lookup response: %s - %s", resp_hepl.status_code, resp_hepl.text)
         # Handle specific status codes
         if resp_hepl.status_code in (401, 403):
             flash(f"HEPL lookup blocked by Shodan plan (HTTP {resp_hepl.status_code}).", "warning")
@@ -1216,7 +1502,7 @@ def security():
         if "error" in hepl_info:
             flash(f"HEPL lookup: {hepl_info['error']}", "warning")
     except requests.RequestException as e:
-        app.logger.error(f"Error fetching Shodan HEPL info: {e}")
+        app.logger.error("Error fetching Shodan HEPL info: %s", e)
         flash("Failed to fetch Shodan HEPL information.", "error")
 
     # DNS resolve test.mosquitto.org to get its IP
@@ -1229,7 +1515,7 @@ def security():
         if not mosq_ip:
             flash("Shodan DNS resolve returned no IP for test.mosquitto.org.", "warning")
     except requests.RequestException as e:
-        app.logger.error(f"Error resolving test.mosquitto.org: {e}")
+        app.logger.error("Error resolving test.mosquitto.org: %s", e)
         flash("Failed to resolve test.mosquitto.org.", "error")
 
     # Lookup test.mosquitto.org
@@ -1247,7 +1533,7 @@ def security():
             if "error" in mosq_info:
                 flash(f"Mosquitto lookup: {mosq_info['error']}", "warning")
         except requests.RequestException as e:
-            app.logger.error(f"Error fetching Shodan Mosquitto info: {e}")
+            app.logger.error("Error fetching Shodan Mosquitto info: %s", e)
             flash("Failed to fetch Shodan Mosquitto information.", "error")
 
     # list scans
@@ -1261,7 +1547,7 @@ def security():
         scans_list = data.get("matches", [])  # Extract matches from the response
         # app.logger.info(f"Scans list response: {resp_scans.status_code} - {scans_list}")
     except requests.RequestException as e:
-        app.logger.error(f"Error listing Shodan scans: {e}")
+        app.logger.error("Error listing Shodan scans: %s", e)
 
     return render_template("security.html", api_info=api_info, local_pub_ip=local_pub_ip, hepl_info=hepl_info, mosq_ip=mosq_ip, mosq_info=mosq_info, scans_list=scans_list)
 
@@ -1303,11 +1589,13 @@ def security_scan(target):
         scan_result = resp_scan.json()
         flash(f"Scan submitted for {ip_to_scan}. Scan ID: {scan_result.get('id')}", "info")
     except requests.RequestException as e:
-        app.logger.error(f"Error submitting scan for {ip_to_scan}: {e}")
+        app.logger.error("Error submitting scan for %s: %s", ip_to_scan, e)
         flash(f"Failed to submit scan for {ip_to_scan}.", "error")
 
     return redirect(url_for("security"))
 
+# Development server only (production: gunicorn -c gunicorn.conf.py app:app, plus python3 ingest.py)
 if __name__ == "__main__":
+    logs.setup_logging(f"web-{os.getpid()}")
     # app.run(debug=True, use_reloader=False, threaded=True, host="0.0.0.0")
     app.run(debug=True, use_reloader=False, threaded=True, host="0.0.0.0", port=FLASK_TLS_PORT, ssl_context=(FLASK_TLS_CERT, FLASK_TLS_KEY)) # Secured version (tls)
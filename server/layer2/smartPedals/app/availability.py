@@ -0,0 +1,125 @@
+import threading
+
+from datetime import datetime, timezone
+
+"""
+Bike availability from the rack state: a docked bike (rack.currentBike set) is an available bike.
+Counters per station and fleet-wide are updated incrementally from each rack change (lock/unlock by the ingest,
+dock/undock by the web API) and only the stations whose count changed are republished. A rack without a station
+still counts toward the fleet total; the fleet count moving is reported as the FLEET ("*") key of the changes:
+    hepl/availability              {"availableBikes": n, "stations": k, "v": version}    retained
+    hepl/availability/<station>    {"availableBikes": n, "racks": r, "v": version}       retained
+"""
+
+AVAILABILITY_TOPIC = "hepl/availability"
+RACK_FIELDS = {"_id": 0, "rack_id": 1, "station_id": 1, "currentBike": 1}
+FLEET = "*" # Same key as alerts.FLEET
+
+class Availability:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.racks = {}     # rack_id -> (station_id, occupied)
+        self.available = {}  # station_id -> docked bikes
+        self.totals = {}    # station_id -> racks
+        self.fleet = 0      # Docked bikes, racks without a station included
+        self.version = 0
+        self.updated = None
+        self.published_fleet = None
+
+    # Full state from racks_col.find({}, RACK_FIELDS); returns the stations whose count changed
+    def load(self, racks):
+        with self.lock:
+            before = {s: (n, self.totals[s]) for s, n in self.available.items()}
+            fleet = self.fleet
+            self.racks = {}
+            self.available = {}
+            self.totals = {}
+            self.fleet = 0
+            for rack in racks:
+                self._add(str(rack["rack_id"]), rack.get("station_id"), rack.get("currentBike") is not None)
+            after = {s: (n, self.totals[s]) for s, n in self.available.items()}
+            changed = {s for s in set(before) | set(after) if before.get(s) != after.get(s)}
+            if self.fleet != fleet:
+                changed.add(FLEET)
+            return self._changed(changed)
+
+    # One rack as stored now (None: deleted); returns the stations whose count changed
+    def set_rack(self, rack_id, station_id=None, occupied=False, deleted=False):
+        rack_id = str(rack_id)
+        with self.lock:
+            old = self.racks.get(rack_id)
+            new = None if deleted else (station_id, bool(occupied))
+            if old == new:
+                return {}
+            fleet = self.fleet
+            if old is not None:
+                self._remove(rack_id, *old)
+            if new is not None:
+                self._add(rack_id, *new)
+            changed = {s for s in ((old or (None,))[0], station_id if new else None) if s is not None}
+            if self.fleet != fleet:
+                changed.add(FLEET)
+            return self._changed(changed)
+
+    def set_rack_doc(self, rack_id, doc):
+        if doc is None:
+            return self.set_rack(rack_id, deleted=True)
+        return self.set_rack(rack_id, doc.get("station_id"), doc.get("currentBike") is not None)
+
+    def _add(self, rack_id, station_id, occupied):
+        self.racks[rack_id] = (station_id, occupied)
+        self.fleet += occupied
+        if station_id is None:
+            return
+        self.totals[station_id] = self.totals.get(station_id, 0) + 1
+        self.available[station_id] = self.available.get(station_id, 0) + occupied
+
+    def _remove(self, rack_id, station_id, occupied):
+        del self.racks[rack_id]
+        self.fleet -= occupied
+        if station_id is None:
+            return
+        self.totals[station_id] -= 1
+        self.available[station_id] -= occupied
+        if not self.totals[station_id]:
+            del self.totals[station_id]
+            del self.available[station_id]
+
+    def _changed(self, stations):
+        if not stations:
+            return {}
+        self.version += 1
+        self.updated = datetime.now(timezone.utc)
+        return {s: (self.fleet, len(self.racks)) if s == FLEET else (self.available.get(s), self.totals.get(s, 0))
+                for s in stations}
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "fleet": self.fleet,
+                "stations": dict(sorted(self.available.items())),
+                "racks": dict(sorted(self.totals.items())),
+                "version": self.version,
+                "updated": self.updated.isoformat(timespec="seconds") if self.updated else None,
+            }
+
+    # MQTT messages for the changed stations (all of them with full), plus the fleet topic when its count changed;
+    # a removed station gets an empty retained message (cleared on the broker)
+    def messages(self, changed, full=False):
+        with self.lock:
+            if full:
+                changed = {s: (n, self.totals[s]) for s, n in self.available.items()}
+            out = []
+            for station, (count, racks) in sorted(changed.items()):
+                if station == FLEET:
+                    continue
+                topic = f"{AVAILABILITY_TOPIC}/{station}"
+                if count is None:
+                    out.append((topic, b""))
+                else:
+                    out.append((topic, f'{{"availableBikes":{count},"racks":{racks},"v":{self.version}}}'.encode()))
+            if full or self.fleet != self.published_fleet:
+                self.published_fleet = self.fleet
+                out.append((AVAILABILITY_TOPIC,
+                            f'{{"availableBikes":{self.fleet},"stations":{len(self.totals)},"v":{self.version}}}'.encode()))
+            return out
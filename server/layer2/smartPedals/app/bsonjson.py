@@ -0,0 +1,65 @@
+import base64
+import json
+
+from datetime import date, datetime
+from itertools import islice
+
+from bson import Decimal128, ObjectId
+from flask.json.provider import JSONProvider
+
+from common import json_loads
+
+"""
+Flask JSON provider for Mongo documents: ObjectId -> hex string, datetime -> ISO 8601, Decimal128 -> exact string,
+bytes -> base64, cursors and other iterables -> arrays. Encoded by orjson when installed (datetimes natively),
+by json otherwise. Routes can jsonify(cursor) directly when the cursor is bounded (limit); unbounded ones go
+through iter_array, which encodes STREAM_BATCH documents at a time so memory stays at one batch.
+"""
+
+STREAM_BATCH = 500 # Documents encoded per chunk by iter_array
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def bson_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    if isinstance(o, Decimal128):
+        return str(o)
+    if isinstance(o, (bytes, bytearray)):
+        return base64.b64encode(o).decode()
+    if isinstance(o, (set, frozenset)) or hasattr(o, "__iter__"):
+        return list(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+if orjson is not None:
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=bson_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+# JSON array as byte chunks: Response(iter_array(cursor)). An error mid-stream truncates the body (status already sent)
+def iter_array(items, batch=STREAM_BATCH):
+    items = iter(items)
+    sep = b"["
+    while chunk := list(islice(items, batch)):
+        yield sep + dumps_bytes(chunk)[1:-1]
+        sep = b","
+    yield b"[]" if sep == b"[" else b"]"
+
+class BsonJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    # jsonify(): encode straight to bytes
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype="application/json")
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+import metrics
+
+# Shared backend (RESPONSE_CACHE_BACKEND=redis), optional
+try:
+    import redis
+except ImportError:
+    redis = None
+
+"""
+Read-through cache of serialized API responses (GET user/bike/rack/station), keyed "<kind>:<id>".
+Write routes and the ingest auth path invalidate the keys they touch: locally, and through the event channel
+for the other web workers (type "cache_invalidate"). The TTL bounds staleness for writes made outside the API.
+Responses served by the fleet read model (fleet.py) are not stored.
+
+Backends: "local" (LRU + TTL per worker, default), "redis" (one cache for all the workers, RESPONSE_CACHE_URL,
+needs the redis package) or "off". Other backends: register_backend(name, factory).
+"""
+
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "local") # local, redis or off
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "10000")) # Entries per worker (local)
+RESPONSE_CACHE_SECONDS = float(os.environ.get("RESPONSE_CACHE_SECONDS", "30")) # Entry TTL
+RESPONSE_CACHE_URL = os.environ.get("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = "smartpedals:response:"
+
+def key(kind, ident):
+    return f"{kind}:{ident}"
+
+# Keys of the given ids, None/empty ids skipped
+def keys(kind, *idents):
+    return [key(kind, ident) for ident in idents if ident]
+
+# Backend interface: get(key) -> bytes or None, put(key, value, token), delete(keys), token(), size()
+# token() is taken before reading Mongo; put() drops the value when an invalidation happened since (read/write race)
+class LocalBackend:
+    def __init__(self, size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_SECONDS):
+        self.max_size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self.generation = 0  # Invalidations so far
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                metrics.CACHE_EVICTIONS.inc("ttl")
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def token(self):
+        return self.generation
+
+    def put(self, key, value, token):
+        with self.lock:
+            if token != self.generation:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                metrics.CACHE_EVICTIONS.inc("size")
+
+    def delete(self, keys):
+        with self.lock:
+            self.generation += 1
+            for k in keys:
+                self.entries.pop(k, None)
+
+    def size(self):
+        return len(self.entries)
+
+class RedisBackend:
+    def __init__(self, url=RESPONSE_CACHE_URL, ttl=RESPONSE_CACHE_SECONDS):
+        if redis is None:
+            raise RuntimeError("RESPONSE_CACHE_BACKEND=redis needs the redis package")
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        return self.client.get(REDIS_PREFIX + key)
+
+    def token(self):
+        return None
+
+    # Expiry handled by Redis (maxmemory-policy allkeys-lru for the size bound)
+    def put(self, key, value, token):
+        self.client.set(REDIS_PREFIX + key, value, px=int(self.ttl * 1000))
+
+    def delete(self, keys):
+        if keys:
+            self.client.delete(*(REDIS_PREFIX + k for k in keys))
+
+    def size(self):
+        return None
+
+BACKENDS = {"local": LocalBackend, "redis": RedisBackend}
+
+def register_backend(name, factory):
+    BACKENDS[name] = factory
+
+class ResponseCache:
+    def __init__(self, backend=RESPONSE_CACHE_BACKEND):
+        self.backend = None if backend == "off" else BACKENDS[backend]()
+
+    def get(self, key):
+        if self.backend is None:
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            value = None  # Shared backend down: serve from Mongo
+        metrics.CACHE_REQUESTS.inc("miss" if value is None else "hit")
+        return value
+
+    def token(self):
+        return self.backend.token() if self.backend is not None else None
+
+    def put(self, key, value, token):
+        if self.backend is not None:
+            try:
+                self.backend.put(key, value, token)
+            except Exception:
+                pass
+
+    def invalidate(self, keys):
+        if self.backend is not None and keys:
+            try:
+                self.backend.delete(keys)
+            except Exception:
+                pass
+            metrics.CACHE_INVALIDATIONS.inc(value=len(keys))
+
+    # Counts of this process, from the metric (incremented under its lock)
+    def stats(self):
+        hits, misses = metrics.CACHE_REQUESTS.value("hit"), metrics.CACHE_REQUESTS.value("miss")
+        total = hits + misses
+        return {"backend": RESPONSE_CACHE_BACKEND, "size": self.backend.size() if self.backend else 0,
+                "hits": hits, "misses": misses, "hit_ratio": round(hits / total, 4) if total else None}
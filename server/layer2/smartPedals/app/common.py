@@ -0,0 +1,40 @@
+import json
+import os
+
+from zoneinfo import ZoneInfo
+
+from pymongo import MongoClient
+
+from metrics import mongo_listener
+
+# Fast JSON decoding when orjson is installed (same result types as json.loads)
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+"""
+Configuration and helpers shared by the web tier (app.py) and the ingest worker (ingest.py)
+"""
+
+# MongoDB
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+# Local channel between the ingest worker (hub) and the web workers (subscribers)
+EVENTS_SOCKET = os.environ.get("EVENTS_SOCKET", "/tmp/smartpedals-events.sock")
+
+# Other
+BRUSSELS = ZoneInfo("Europe/Brussels")
+
+# Initialize MongoDB (connect=False: no connection nor monitor thread until the first operation)
+def init_db():
+    client = MongoClient(MONGO_URL, connect=False, event_listeners=[mongo_listener])
+    db = client.smartpedals
+    data_col = db.data
+    users_col = db.users
+    bikes_col = db.bikes
+    racks_col = db.racks
+    stations_col = db.stations
+    locations_col = db.locations
+    return client, db, data_col, users_col, bikes_col, racks_col, stations_col, locations_col
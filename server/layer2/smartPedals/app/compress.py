@@ -0,0 +1,143 @@
+import os
+import time
+import zlib
+
+import metrics
+
+# Content-Encoding: br, optional (gzip only without it)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+"""
+Negotiated response compression (Accept-Encoding: br, gzip), applied by an after_request hook in app.py.
+- Buffered responses (JSON, HTML): compressed in one shot when at least COMPRESS_MIN_BYTES long.
+- Streamed responses: compressed chunk by chunk, no threshold (the size is not known up front).
+- text/event-stream: every chunk is flushed (Z_SYNC_FLUSH / brotli flush) so each event reaches the client
+  as soon as it is yielded, at the cost of a few bytes per event.
+Responses that already carry a Content-Encoding, binary types (export downloads: gzip, zstd, parquet) and
+Cache-Control: no-transform go out as they are.
+"""
+
+COMPRESS_ENCODINGS = os.environ.get("COMPRESS_ENCODINGS", "br,gzip") # Server preference order, "" to disable
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024")) # Smaller buffered bodies are sent as is
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "6")) # 1 (fast) .. 9
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "5")) # 0 (fast) .. 11; 11 is far too slow per request
+
+COMPRESSIBLE = ("application/json", "text/html", "text/plain", "text/csv", "text/event-stream",
+                "application/javascript", "text/javascript", "text/css", "application/x-ndjson")
+
+BYTES = metrics.Counter("smartpedals_http_compression_bytes_total", "Response bytes before (in) and after (out) compression",
+                        ("encoding", "direction"))
+SECONDS = metrics.Counter("smartpedals_http_compression_seconds_total", "CPU time spent compressing responses",
+                          ("encoding",))
+
+def available():
+    return [e for e in (x.strip() for x in COMPRESS_ENCODINGS.split(",")) if e == "gzip" or (e == "br" and brotli)]
+
+ENCODINGS = available()
+
+# Accept-Encoding -> "br", "gzip" or None. Highest q wins, ties go to the server order; "*" covers the unlisted ones
+def negotiate(accept_encoding, encodings=None):
+    encodings = ENCODINGS if encodings is None else encodings
+    if not accept_encoding or not encodings:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+def compressible(mimetype):
+    return mimetype in COMPRESSIBLE or (mimetype.startswith("application/") and mimetype.endswith("+json"))
+
+# One stream per response: compress(data) -> bytes so far, flush() -> pending bytes now, finish() -> trailer
+class Compressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.obj = brotli.Compressor(quality=COMPRESS_BROTLI_QUALITY)
+        else:
+            self.obj = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip header + trailer
+
+    def compress(self, data):
+        return self.obj.process(data) if self.encoding == "br" else self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush() if self.encoding == "br" else self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self.obj.finish() if self.encoding == "br" else self.obj.flush(zlib.Z_FINISH)
+
+def compress(data, encoding):
+    t0 = time.process_time()
+    if encoding == "br":
+        out = brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    else:
+        c = Compressor(encoding)
+        out = c.compress(data) + c.finish()
+    SECONDS.inc(encoding, value=time.process_time() - t0)
+    BYTES.inc(encoding, "in", value=len(data))
+    BYTES.inc(encoding, "out", value=len(out))
+    return out
+
+# Wraps a streamed body; closing the wrapper closes the inner generator (SSE listener cleanup runs in its finally)
+def stream(chunks, encoding, flush_each=False):
+    c = Compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            t0 = time.process_time()
+            out = c.compress(chunk)
+            if flush_each:
+                out += c.flush()
+            SECONDS.inc(encoding, value=time.process_time() - t0)
+            BYTES.inc(encoding, "in", value=len(chunk))
+            if out:
+                BYTES.inc(encoding, "out", value=len(out))
+                yield out
+        out = c.finish()
+        BYTES.inc(encoding, "out", value=len(out))
+        yield out
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+
+# Flask/Werkzeug response, in place
+def apply(response, accept_encoding, method="GET"):
+    if method == "HEAD" or response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if "Content-Encoding" in response.headers or response.direct_passthrough or not compressible(response.mimetype):
+        return response
+    if "no-transform" in response.headers.get("Cache-Control", ""):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        flush_each = response.mimetype == "text/event-stream"
+        response.response = stream(response.response, encoding, flush_each)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
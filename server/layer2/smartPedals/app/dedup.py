@@ -0,0 +1,63 @@
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+"""
+Idempotent auth: a redelivered (QoS 1/2 after reconnect) or repeated hepl/auth message gets the reply of the
+first one, without touching Mongo or sending the email again.
+Key: the rack request_id when given, else (rack_id, user_id, action, timestamp).
+Lookup: in-memory TTL cache, then the auth_requests collection (_id = key, survives ingest restarts).
+"""
+
+AUTH_DEDUP_SECONDS = int(os.environ.get("AUTH_DEDUP_SECONDS", "600")) # In-memory cache TTL
+AUTH_DEDUP_SIZE = int(os.environ.get("AUTH_DEDUP_SIZE", "10000")) # In-memory cache entries
+AUTH_DEDUP_MONGO_SECONDS = int(os.environ.get("AUTH_DEDUP_MONGO_SECONDS", str(24 * 3600))) # auth_requests TTL
+
+AUTH_REQUESTS_COLLECTION = "auth_requests"
+
+def auth_key(data):
+    if not isinstance(data, dict):
+        return None
+    if data.get("request_id"):
+        return f"id:{data['request_id']}"
+    fields = (data.get("rack_id"), data.get("user_id"), data.get("action"), data.get("timestamp"))
+    if not all(fields[:2]) or not fields[3]:
+        return None
+    return "|".join(str(f) for f in fields)
+
+class TTLCache:
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.entries = OrderedDict()  # key -> (expires, value), oldest first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+replies = TTLCache(AUTH_DEDUP_SECONDS, AUTH_DEDUP_SIZE)
+
+def request_document(key, reply):
+    now = datetime.now(timezone.utc)
+    return {"_id": key, "reply": reply, "created": now,
+            "expire_at": now + timedelta(seconds=AUTH_DEDUP_MONGO_SECONDS)}
+
+def ensure_indexes(db):
+    db[AUTH_REQUESTS_COLLECTION].create_index("expire_at", expireAfterSeconds=0, name="expire_at_ttl")
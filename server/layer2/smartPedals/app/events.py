@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+"""
+Local event channel: newline-delimited JSON over a Unix stream socket.
+The ingest worker runs the hub, every web worker connects to it as a subscriber.
+Events sent upstream by a subscriber go to the hub handler and are relayed to the other subscribers.
+The hub never writes to a socket from the publishing thread: every subscriber has a bounded queue drained by its
+own writer thread, a subscriber that falls EVENTS_QUEUE_MAX events behind is dropped (it reconnects and gets the
+sticky events again).
+"""
+
+EVENTS_QUEUE_MAX = int(os.environ.get("EVENTS_QUEUE_MAX", "1000")) # Events queued per web worker before it is dropped
+
+logger = logging.getLogger("smartpedals.events")
+
+def encode_event(event):
+    return (json.dumps(event, default=str) + "\n").encode()
+
+# One web worker seen from the hub: its connection and outbound queue
+class Subscriber:
+    def __init__(self, conn, maxsize=EVENTS_QUEUE_MAX):
+        self.conn = conn
+        self.queue = queue.Queue(maxsize)
+
+# Ingest side
+class EventHub:
+    def __init__(self, path, on_event=None):
+        self.path = path
+        self.on_event = on_event  # Called with events coming from the web workers
+        self.clients = []
+        self.sticky = {}  # key -> last event, replayed to every new subscriber
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        os.chmod(self.path, 0o660)
+        self.server.listen()
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logger.info("[EVENTS] Hub listening on %s", self.path)
+
+    # Queued only: never blocks on a slow subscriber
+    def publish(self, event, key=None, exclude=None):
+        line = encode_event(event)
+        with self.lock:
+            if key:
+                self.sticky[key] = line
+            full = []
+            for client in self.clients:
+                if client is exclude:
+                    continue
+                try:
+                    client.queue.put_nowait(line)
+                except queue.Full:
+                    full.append(client)
+            for client in full:
+                logger.warning("[EVENTS] Subscriber %s events behind, dropped", EVENTS_QUEUE_MAX)
+                self._drop(client)
+
+    def subscribers(self):
+        return len(self.clients)
+
+    # Under self.lock
+    def _drop(self, client):
+        try:
+            self.clients.remove(client)
+        except ValueError:
+            return
+        try:
+            client.conn.shutdown(socket.SHUT_RDWR)  # Ends the read loop; the writer fails on its next send
+        except OSError:
+            pass
+        try:
+            client.queue.put_nowait(None)  # Wakes an idle writer
+        except queue.Full:
+            pass
+
+    def _write_loop(self, client):
+        try:
+            while (line := client.queue.get()) is not None:
+                client.conn.sendall(line)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self._drop(client)
+            client.conn.close()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError as e:
+                logger.error("[EVENTS] Accept error: %s", e)
+                time.sleep(1)
+                continue
+            # Send timeout (2s): a stuck subscriber ends its writer thread
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, struct.pack("ll", 2, 0))
+            client = Subscriber(conn)
+            with self.lock:
+                for line in self.sticky.values():
+                    client.queue.put_nowait(line)
+                self.clients.append(client)
+            threading.Thread(target=self._write_loop, args=(client,), daemon=True).start()
+            threading.Thread(target=self._read_loop, args=(client,), daemon=True).start()
+
+    def _read_loop(self, client):
+        try:
+            with client.conn.makefile("rb") as reader:
+                for line in reader:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if self.on_event:
+                        try:
+                            self.on_event(event)
+                        except Exception as e:
+                            logger.exception("[EVENTS] Hub handler error: %s", e)
+                    self.publish(event, exclude=client)
+        except OSError:
+            pass
+        finally:
+            with self.lock:
+                self._drop(client)
+
+# Command-line tools: send events to the hub (relayed to the web workers) and disconnect; False if it is not running
+def send_once(path, events):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.connect(path)
+            conn.sendall(b"".join(encode_event(event) for event in events))
+        return True
+    except OSError:
+        return False
+
+# Web side
+class EventSubscriber:
+    def __init__(self, path, on_event):
+        self.path = path
+        self.on_event = on_event
+        self.conn = None
+        self.started = False
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+
+    # Started lazily (first request) so that importing the web app has no side effect
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def connected(self):
+        return self.conn is not None
+
+    def send(self, event):
+        conn = self.conn
+        if conn is None:
+            return False
+        try:
+            with self.send_lock:
+                conn.sendall(encode_event(event))
+            return True
+        except OSError:
+            return False
+
+    def _run(self):
+        delay = 1
+        while True:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                conn.connect(self.path)
+                self.conn = conn
+                delay = 1
+                logger.info("[EVENTS] Connected to ingest hub %s", self.path)
+                with conn.makefile("rb") as reader:
+                    for line in reader:
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            continue
+                        try:
+                            self.on_event(event)
+                        except Exception as e:
+                            logger.exception("[EVENTS] Subscriber handler error: %s", e)
+            except OSError as e:
+                logger.warning("[EVENTS] Hub unavailable (%s), retrying in %ss", e, delay)
+            finally:
+                self.conn = None
+                conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 30)
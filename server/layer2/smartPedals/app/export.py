@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import time
+
+from datetime import datetime, timezone
+
+from bson import ObjectId
+
+from bsonjson import bson_default, dumps_bytes
+from common import BRUSSELS
+
+"""
+Streaming export of data/locations: _id-ordered cursor (time bounds on the ObjectId, served by the _id index),
+fixed-size batches, each batch written as its own gzip member / zstd frame (concatenation is a valid stream)
+or Parquet row group. Memory stays at one batch whatever the row count.
+
+Resumable: every line carries its "id", export again with after=<last id>. The CLI checkpoints
+<out>.state.json after each batch and continues from there when run again with the same arguments.
+
+    python3 export.py data --since 2025-01-01 --until 2025-02-01 --topic hepl/location --format ndjson.zst --out data.ndjson.zst
+    python3 export.py locations --bike-id bike-1 --format parquet --out locations/   # part-00000.parquet, ...
+"""
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_BATCH_ROWS = int(os.environ.get("EXPORT_BATCH_ROWS", "10000")) # Rows per cursor batch / compressed block
+EXPORT_PART_ROWS = int(os.environ.get("EXPORT_PART_ROWS", "5000000")) # Parquet rows per part file (CLI)
+EXPORT_GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", "6"))
+EXPORT_ZSTD_LEVEL = int(os.environ.get("EXPORT_ZSTD_LEVEL", "3"))
+
+# collection -> filter name -> document field
+COLLECTIONS = {
+    "data": {"topic": "topic", "bike_id": "payload.bike_id"},
+    "locations": {"bike_id": "bike_id"},
+}
+FORMATS = ("ndjson.gz", "ndjson.zst", "parquet")
+MIMETYPES = {"ndjson.gz": "application/gzip", "ndjson.zst": "application/zstd",
+             "parquet": "application/vnd.apache.parquet"}
+
+class ExportError(ValueError):
+    pass
+
+def parse_time(value):
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"Invalid time '{value}' (ISO 8601 expected)")
+    return ts if ts.tzinfo else ts.replace(tzinfo=BRUSSELS)
+
+def check_format(fmt):
+    if fmt not in FORMATS:
+        raise ExportError(f"Unknown format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt == "ndjson.zst" and zstandard is None:
+        raise ExportError("ndjson.zst needs the zstandard package")
+    if fmt == "parquet" and pa is None:
+        raise ExportError("parquet needs the pyarrow package")
+
+# Mongo filter: insertion time in [since, until) through the ObjectId, strictly after `after`, equality filters
+def build_query(collection, since=None, until=None, after=None, **filters):
+    if collection not in COLLECTIONS:
+        raise ExportError(f"Unknown collection '{collection}', expected one of {', '.join(COLLECTIONS)}")
+    bounds = {}
+    if since:
+        bounds["$gte"] = ObjectId.from_datetime(since)
+    if after:
+        try:
+            bounds["$gt"] = ObjectId(after)
+        except Exception:
+            raise ExportError(f"Invalid after '{after}'")
+    if until:
+        bounds["$lt"] = ObjectId.from_datetime(until)
+    query = {"_id": bounds} if bounds else {}
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in COLLECTIONS[collection]:
+            raise ExportError(f"Unknown filter '{name}' for {collection}")
+        query[COLLECTIONS[collection][name]] = value
+    return query
+
+# Lists of at most batch_rows documents; the cursor fetches batch_rows per round trip
+def batches(col, query, batch_rows=EXPORT_BATCH_ROWS):
+    batch = []
+    for doc in col.find(query, sort=[("_id", 1)], batch_size=batch_rows):
+        batch.append(doc)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ndjson_lines(batch):
+    return b"".join(dumps_bytes({"id": doc.pop("_id"), **doc}) + b"\n" for doc in batch)
+
+# One self-contained gzip member / zstd frame per batch
+def block_compressor(fmt):
+    if fmt == "ndjson.gz":
+        return lambda data: gzip.compress(data, compresslevel=EXPORT_GZIP_LEVEL, mtime=0)
+    return zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL).compress
+
+"""
+Parquet: one level of nesting flattened ("coordinates.lat"), lists and deeper values as JSON text.
+Schema inferred from the first batch (integers widened to float64); later fields not in it are dropped.
+"""
+
+def flat_row(doc):
+    row = {"id": str(doc.pop("_id"))}
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            for sub, subvalue in value.items():
+                row[f"{key}.{sub}"] = parquet_value(subvalue)
+        else:
+            row[key] = parquet_value(value)
+    return row
+
+def parquet_value(value):
+    if isinstance(value, (dict, list, tuple)):
+        return json.dumps(value, default=bson_default, ensure_ascii=False, separators=(",", ":"))
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, bool) or value is None or isinstance(value, (str, int, float, bytes, datetime)):
+        return value
+    return str(value)
+
+def parquet_schema(rows):
+    fields = []
+    for field in pa.Table.from_pylist(rows).schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.float64())
+        elif pa.types.is_null(field.type):
+            field = field.with_type(pa.string())
+        fields.append(field)
+    return pa.schema(fields)
+
+def parquet_table(batch, schema):
+    rows = [flat_row(doc) for doc in batch]
+    if schema is None:
+        schema = parquet_schema(rows)
+    return pa.Table.from_pylist(rows, schema=schema), schema
+
+# Write-only file object: pyarrow writes into it, the HTTP response drains it after every row group
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+# Response body: compressed blocks as the batches come (ids in the lines, resume with after=)
+def stream(col, query, fmt, batch_rows=EXPORT_BATCH_ROWS):
+    if fmt == "parquet":
+        sink, writer, schema = ChunkSink(), None, None
+        for batch in batches(col, query, batch_rows):
+            table, schema = parquet_table(batch, schema)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, schema, compression="zstd")
+            writer.write_table(table)
+            yield sink.drain()
+        if writer is not None:
+            writer.close()
+            yield sink.drain()
+        return
+    compress = block_compressor(fmt)
+    for batch in batches(col, query, batch_rows):
+        yield compress(ndjson_lines(batch))
+
+"""
+CLI: checkpointed file export
+"""
+
+def load_state(path, args):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get("args") != args:
+        raise ExportError(f"{path} belongs to another export ({state.get('args')}), remove it or use --restart")
+    return state
+
+def save_state(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def export_ndjson(col, query, fmt, out, state, state_path):
+    compress = block_compressor(fmt)
+    mode = "r+b" if state["rows"] and os.path.exists(out) else "wb"
+    with open(out, mode) as f:
+        # Drop whatever was written after the last checkpoint
+        f.truncate(state["offset"])
+        f.seek(state["offset"])
+        for batch in batches(col, query):
+            last_id = str(batch[-1]["_id"])
+            f.write(compress(ndjson_lines(batch)))
+            f.flush()
+            os.fsync(f.fileno())
+            state.update(after=last_id, rows=state["rows"] + len(batch), offset=f.tell())
+            save_state(state_path, state)
+            yield len(batch)
+
+def export_parquet(col, query, out, state, state_path):
+    os.makedirs(out, exist_ok=True)
+    for name in os.listdir(out):
+        if name.endswith(".tmp"):
+            os.remove(os.path.join(out, name))
+    writer, schema, part_rows, last_id = None, None, 0, None
+
+    def close_part():
+        writer.close()
+        os.replace(tmp_path, tmp_path[:-len(".tmp")])
+        state.update(after=last_id, rows=state["rows"] + part_rows, parts=state["parts"] + 1)
+        save_state(state_path, state)
+
+    for batch in batches(col, query):
+        last_id = str(batch[-1]["_id"])
+        table, schema = parquet_table(batch, schema)
+        if writer is None:
+            tmp_path = os.path.join(out, f"part-{state['parts']:05d}.parquet.tmp")
+            writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+        writer.write_table(table)
+        part_rows += len(batch)
+        if part_rows >= EXPORT_PART_ROWS:
+            close_part()
+            writer, part_rows = None, 0
+        yield len(batch)
+    if writer is not None:
+        close_part()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Streaming export of SmartPedals telemetry.")
+    parser.add_argument("collection", choices=sorted(COLLECTIONS))
+    parser.add_argument("--format", default="ndjson.gz", choices=FORMATS)
+    parser.add_argument("--out", required=True, help="Output file (ndjson) or directory (parquet).")
+    parser.add_argument("--since", help="ISO 8601, inclusive (insertion time).")
+    parser.add_argument("--until", help="ISO 8601, exclusive (insertion time).")
+    parser.add_argument("--topic", help="data only.")
+    parser.add_argument("--bike-id")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over.")
+    args = parser.parse_args(argv)
+
+    try:
+        check_format(args.format)
+        key = {k: v for k, v in vars(args).items() if k != "restart"}
+        state_path = args.out.rstrip("/") + ".state.json"
+        state = None if args.restart else load_state(state_path, key)
+        if state and state.get("done"):
+            print(f"{args.out}: already complete ({state['rows']} rows), use --restart to export again")
+            return
+        state = state or {"args": key, "after": None, "rows": 0, "offset": 0, "parts": 0}
+        if state["rows"] and not os.path.exists(args.out):
+            raise ExportError(f"{args.out} is missing but {state_path} has a checkpoint, use --restart")
+        if state["rows"]:
+            print(f"{args.out}: resuming after {state['after']} ({state['rows']} rows already exported)")
+        query = build_query(args.collection, parse_time(args.since), parse_time(args.until), state["after"],
+                            topic=args.topic, bike_id=args.bike_id)
+    except ExportError as e:
+        parser.error(str(e))
+
+    from common import init_db
+    _, db, *_ = init_db()
+    col = db[args.collection]
+    rows = exported = state["rows"]
+    t0 = time.perf_counter()
+    if args.format == "parquet":
+        progress = export_parquet(col, query, args.out, state, state_path)
+    else:
+        progress = export_ndjson(col, query, args.format, args.out, state, state_path)
+    for n in progress:
+        rows += n
+        elapsed = time.perf_counter() - t0
+        print(f"\r{rows} rows ({(rows - exported) / elapsed:.0f}/s)", end="", file=sys.stderr)
+    state["done"] = True
+    save_state(state_path, state)
+    print(f"\n{args.out}: {rows} rows, finished {datetime.now(timezone.utc).isoformat(timespec='seconds')}",
+          file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+import metrics
+
+"""
+In-process read model of the fleet (stations, racks, bikes: small and read on every request and auth decision).
+Loaded from Mongo at start, then kept current by a change stream on the database (replica set), or by a full
+reload every FLEET_POLL_SECONDS on a standalone mongod. Documents are stored in their API shape (same as
+api_projection in app.py) minus the NOT_IN_MODEL fields, and must not be mutated by the callers: history grows
+without bound, it is left out of the loads and joined from Mongo by the requests that name it.
+
+Reads are only served while the model is fresh (synced less than FLEET_MAX_STALENESS_SECONDS ago); callers fall
+back to Mongo otherwise. Writes still go to Mongo, the decisions that matter stay conditional updates there.
+Every applied change bumps version (X-Fleet-Version on the API responses served from memory).
+"""
+
+FLEET_SYNC = os.environ.get("FLEET_SYNC", "auto") # auto (change stream, polling on a standalone mongod), changestream, poll or off
+FLEET_POLL_SECONDS = float(os.environ.get("FLEET_POLL_SECONDS", "2")) # Full reload interval without change streams
+FLEET_MAX_STALENESS_SECONDS = float(os.environ.get("FLEET_MAX_STALENESS_SECONDS", "5")) # Older model: read from Mongo
+RETRY_SECONDS = 5
+# Change stream events that leave no documentKey to apply: the model is reloaded (invalidate also ends the stream)
+RELOAD_OPERATIONS = ("drop", "rename", "dropDatabase", "invalidate")
+
+# collection -> (key field, API fields, defaults for missing/null fields)
+COLLECTIONS = {
+    "stations": ("station_id", ("station_id", "name", "racks"), {"racks": []}),
+    "racks": ("rack_id", ("rack_id", "station_id", "currentBike"), {}),
+    "bikes": ("bike_id", ("bike_id", "status", "currentUser", "currentRack"), {}),
+}
+# API fields left in Mongo
+NOT_IN_MODEL = {"racks": ("history",), "bikes": ("history",)}
+
+logger = logging.getLogger("smartpedals.fleet")
+
+# Requested API fields the model does not hold (read from Mongo)
+def not_in_model(collection, fields):
+    return [f for f in fields if f in NOT_IN_MODEL.get(collection, ())]
+
+# API fields held by the model (the default ?fields of the fleet documents)
+def api_fields(collection):
+    return ["id", *COLLECTIONS[collection][1]]
+
+def api_document(collection, doc):
+    _, fields, defaults = COLLECTIONS[collection]
+    shaped = {"id": doc["_id"]}
+    for field in fields:
+        value = doc.get(field)
+        shaped[field] = defaults.get(field) if value is None else value
+    return shaped
+
+class FleetModel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.docs = {name: {} for name in COLLECTIONS}  # collection -> key -> API document
+        self.keys = {name: {} for name in COLLECTIONS}  # collection -> _id -> key (deletes only carry _id)
+        self.bikes_by_user = {}  # currentUser -> bike_id
+        self.rack_station = {}   # rack_id -> station_id
+        self.version = 0
+        self.synced = None       # time.monotonic() of the last confirmed sync
+        self.mode = None         # "changestream" or "poll" once started
+
+    # Reads (None when unknown or stale: ask Mongo)
+
+    def fresh(self):
+        return self.synced is not None and time.monotonic() - self.synced <= FLEET_MAX_STALENESS_SECONDS
+
+    def get(self, collection, key):
+        doc = self.docs[collection].get(str(key)) if self.fresh() else None
+        metrics.FLEET_READS.inc(collection, "mongo" if doc is None else "memory")
+        return doc
+
+    # Several keys: {key: doc} for the known ones (empty when stale, the caller reads the rest from Mongo)
+    def get_many(self, collection, keys):
+        docs = self.docs[collection] if self.fresh() else {}
+        found = {str(k): docs[str(k)] for k in keys if str(k) in docs}
+        metrics.FLEET_READS.inc(collection, "memory", value=len(found))
+        metrics.FLEET_READS.inc(collection, "mongo", value=len(keys) - len(found))
+        return found
+
+    def bike(self, bike_id):
+        return self.get("bikes", bike_id)
+
+    def rack(self, rack_id):
+        return self.get("racks", rack_id)
+
+    def station(self, station_id):
+        return self.get("stations", station_id)
+
+    def bike_of_user(self, user_id):
+        if not self.fresh():
+            return None
+        bike_id = self.bikes_by_user.get(str(user_id))
+        return self.docs["bikes"].get(bike_id) if bike_id else None
+
+    def station_of_rack(self, rack_id):
+        return self.rack_station.get(str(rack_id)) if self.fresh() else None
+
+    def stats(self):
+        return {"mode": self.mode, "version": self.version, "fresh": self.fresh(),
+                "age_s": round(time.monotonic() - self.synced, 3) if self.synced is not None else None,
+                **{name: len(docs) for name, docs in self.docs.items()}}
+
+    # Writes (tailer thread)
+
+    def load(self, db):
+        docs = {name: {} for name in COLLECTIONS}
+        for name, (key, fields, _) in COLLECTIONS.items():
+            for doc in db[name].find({key: {"$ne": None}}, dict.fromkeys(fields, 1)):
+                docs[name][str(doc[key])] = api_document(name, doc)
+        with self.lock:
+            if docs != self.docs:
+                self.docs = docs
+                self.keys = {name: {d["id"]: k for k, d in col.items()} for name, col in docs.items()}
+                self.bikes_by_user = {str(d["currentUser"]): k for k, d in docs["bikes"].items() if d["currentUser"]}
+                self.rack_station = {k: d["station_id"] for k, d in docs["racks"].items()}
+                self.version += 1
+            self.synced = time.monotonic()
+
+    # One change stream event (fullDocument=updateLookup: the document as it is now, None when gone since)
+    def apply(self, change):
+        collection = change.get("ns", {}).get("coll")
+        if collection not in COLLECTIONS or "_id" not in change.get("documentKey", {}):
+            return
+        _id = change["documentKey"]["_id"]
+        doc = change.get("fullDocument")
+        key = COLLECTIONS[collection][0]
+        with self.lock:
+            old_key = self.keys[collection].pop(_id, None)
+            if old_key is not None:
+                self._unindex(collection, self.docs[collection].pop(old_key))
+            if doc is not None and change["operationType"] != "delete" and doc.get(key) is not None:
+                shaped = api_document(collection, doc)
+                self.docs[collection][str(doc[key])] = shaped
+                self.keys[collection][_id] = str(doc[key])
+                self._index(collection, shaped)
+            self.version += 1
+
+    def _index(self, collection, doc):
+        if collection == "bikes" and doc["currentUser"]:
+            self.bikes_by_user[str(doc["currentUser"])] = str(doc["bike_id"])
+        elif collection == "racks":
+            self.rack_station[str(doc["rack_id"])] = doc["station_id"]
+
+    def _unindex(self, collection, doc):
+        if collection == "bikes" and doc["currentUser"]:
+            if self.bikes_by_user.get(str(doc["currentUser"])) == str(doc["bike_id"]):
+                del self.bikes_by_user[str(doc["currentUser"])]
+        elif collection == "racks":
+            self.rack_station.pop(str(doc["rack_id"]), None)
+
+    # Tailer
+
+    def start(self, db, mode=FLEET_SYNC):
+        if mode == "off" or self.mode is not None:
+            return
+        self.mode = "poll" if mode == "poll" else "changestream"
+        threading.Thread(target=self._run, args=(db, mode), name="fleet-model", daemon=True).start()
+
+    def _run(self, db, mode):
+        while True:
+            try:
+                if self.mode == "changestream":
+                    self._tail(db)
+                else:
+                    self.load(db)
+                    time.sleep(FLEET_POLL_SECONDS)
+            except OperationFailure as e:
+                if self.mode == "changestream" and mode == "auto":
+                    # Standalone mongod: "The $changeStream stage is only supported on replica sets"
+                    logger.warning("[FLEET] Change streams unavailable (%s), polling every %ss", e, FLEET_POLL_SECONDS)
+                    self.mode = "poll"
+                else:
+                    logger.error("[FLEET] Sync failed: %s", e)
+                    time.sleep(RETRY_SECONDS)
+            except PyMongoError as e:
+                logger.error("[FLEET] Sync failed, retrying in %ss: %s", RETRY_SECONDS, e)
+                time.sleep(RETRY_SECONDS)
+            except Exception as e:
+                # Unexpected event or document shape: the thread must survive, the model reloads on the next pass
+                logger.exception("[FLEET] Sync crashed, retrying in %ss: %s", RETRY_SECONDS, e)
+                time.sleep(RETRY_SECONDS)
+
+    # Stream opened before the load: a write racing the load comes back as a change (documents are applied whole)
+    def _tail(self, db):
+        pipeline = [{"$match": {"$or": [{"ns.coll": {"$in": list(COLLECTIONS)}}, {"to.coll": {"$in": list(COLLECTIONS)}},
+                                        {"operationType": {"$in": ["dropDatabase", "invalidate"]}}]}},
+                    {"$project": {"updateDescription": 0, "fullDocument.history": 0}}]  # NOT_IN_MODEL
+        with db.watch(pipeline, full_document="updateLookup", max_await_time_ms=1000) as stream:
+            self.load(db)
+            logger.info("[FLEET] Loaded %s, following the change stream", self.stats())
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None and change.get("operationType") in RELOAD_OPERATIONS:
+                    logger.info("[FLEET] %s event, reloading", change["operationType"])
+                    self.load(db)
+                elif change is not None:
+                    self.apply(change)
+                self.synced = time.monotonic()
+
+model = FleetModel()
@@ -0,0 +1,121 @@
+import os
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+"""
+Distance and speed of a bike from its GPS fixes (locations collection: bike_id, timestamp, coordinates.lat/lon).
+The fixes of a time window are loaded into NumPy arrays and every segment (fix i -> i+1) is computed at once:
+haversine distance, duration, speed. Then:
+- distance: sum of the segments, without the GPS jumps (segment speed above GPS_MAX_SPEED_KMH),
+- moving time: segments at GPS_IDLE_SPEED_KMH or more and shorter than GPS_MAX_GAP_SECONDS (fix lost: not moving),
+- average speed (over the moving time) and max speed,
+- idle periods: runs of non-moving segments lasting GPS_IDLE_MIN_SECONDS or more.
+Compute time is linear in the fixes (~0.1 s per million); loading them from Mongo is the larger part.
+"""
+
+GPS_MAX_FIXES = int(os.environ.get("GPS_MAX_FIXES", "2000000")) # Larger windows are refused (~24 bytes per fix in memory)
+GPS_WINDOW_HOURS = float(os.environ.get("GPS_WINDOW_HOURS", "24")) # Default window (until = now)
+GPS_IDLE_SPEED_KMH = float(os.environ.get("GPS_IDLE_SPEED_KMH", "2")) # Slower segments: not moving (GPS drift)
+GPS_IDLE_MIN_SECONDS = float(os.environ.get("GPS_IDLE_MIN_SECONDS", "60")) # Shorter stops are not idle periods
+GPS_MAX_SPEED_KMH = float(os.environ.get("GPS_MAX_SPEED_KMH", "60")) # Faster segments are GPS jumps
+GPS_MAX_GAP_SECONDS = float(os.environ.get("GPS_MAX_GAP_SECONDS", "300")) # Longer gaps between fixes: not moving
+GPS_MAX_IDLE_PERIODS = 100 # Idle periods listed (all counted)
+GPS_BATCH = 10000 # Cursor batch size
+
+EARTH_R = 6371000.0  # meters, same sphere as gps_simulator.py
+
+def ensure_indexes(db):
+    db.locations.create_index([("bike_id", 1), ("timestamp", 1)], name="bike_timestamp")
+
+class TooManyFixes(ValueError):
+    pass
+
+# Fixes of one bike in [since, until) -> (t epoch seconds, lat, lon) float64 arrays in time order, invalid count
+def load_fixes(col, bike_id, since, until, max_fixes=GPS_MAX_FIXES):
+    cursor = col.find({"bike_id": bike_id, "timestamp": {"$gte": since, "$lt": until}},
+                      {"_id": 0, "timestamp": 1, "coordinates": 1},
+                      sort=[("timestamp", 1)], limit=max_fixes + 1, batch_size=GPS_BATCH)
+    times, lats, lons = [], [], []
+    invalid = 0
+    for doc in cursor:
+        coordinates = doc.get("coordinates")
+        try:
+            lat, lon = float(coordinates["lat"]), float(coordinates["lon"])
+            ts = doc["timestamp"]
+        except (TypeError, KeyError, ValueError):
+            invalid += 1
+            continue
+        # No fix yet (0, 0) or out of range
+        if (lat == 0 and lon == 0) or not (-90 <= lat <= 90 and -180 <= lon <= 180) or not isinstance(ts, datetime):
+            invalid += 1
+            continue
+        times.append((ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)).timestamp())  # Naive from Mongo: UTC
+        lats.append(lat)
+        lons.append(lon)
+    if len(times) + invalid > max_fixes:
+        raise TooManyFixes(f"More than {max_fixes} fixes in the window, narrow it")
+    return np.array(times, dtype=np.float64), np.array(lats, dtype=np.float64), np.array(lons, dtype=np.float64), invalid
+
+# Segment distances (m) between consecutive fixes
+def haversine(lat, lon):
+    phi, lam = np.radians(lat), np.radians(lon)
+    a = np.sin(np.diff(phi) / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(np.diff(lam) / 2) ** 2
+    return 2 * EARTH_R * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# Runs of True in a boolean array -> (start, end) index arrays, end exclusive
+def runs(mask):
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+def iso(epoch):
+    return datetime.fromtimestamp(float(epoch), timezone.utc).isoformat(timespec="seconds")
+
+def route_metrics(t, lat, lon, idle_speed_kmh=GPS_IDLE_SPEED_KMH, idle_min_s=GPS_IDLE_MIN_SECONDS,
+                  max_speed_kmh=GPS_MAX_SPEED_KMH, max_gap_s=GPS_MAX_GAP_SECONDS, max_periods=GPS_MAX_IDLE_PERIODS):
+    result = {"fixes": int(len(t)), "distance_m": 0.0, "elapsed_s": 0.0, "moving_s": 0.0, "avg_speed_kmh": None,
+              "max_speed_kmh": None, "jumps": 0, "idle": {"count": 0, "total_s": 0.0, "periods": []}}
+    if len(t) < 2:
+        return result
+    d = haversine(lat, lon)
+    dt = np.diff(t)
+    timed = dt > 0  # Same-millisecond duplicates: no speed
+    speed = np.divide(d, dt, out=np.zeros_like(d), where=timed) * 3.6
+    jump = timed & (speed > max_speed_kmh)
+    plausible = ~jump
+    moving = timed & plausible & (speed >= idle_speed_kmh) & (dt <= max_gap_s)
+
+    moving_s = float(dt[moving].sum())
+    result.update(
+        distance_m=round(float(d[plausible].sum()), 1),
+        elapsed_s=round(float(t[-1] - t[0]), 3),
+        moving_s=round(moving_s, 3),
+        avg_speed_kmh=round(float(d[moving].sum()) / moving_s * 3.6, 2) if moving_s else None,
+        max_speed_kmh=round(float(speed[moving].max()), 2) if moving.any() else None,
+        jumps=int(jump.sum()),
+    )
+
+    # Idle: consecutive non-moving segments, segment i spans t[i] .. t[i + 1]
+    starts, ends = runs(~moving)
+    durations = t[ends] - t[starts]
+    keep = durations >= idle_min_s
+    starts, ends, durations = starts[keep], ends[keep], durations[keep]
+    result["idle"] = {
+        "count": int(len(starts)),
+        "total_s": round(float(durations.sum()), 3),
+        "periods": [{"start": iso(t[s]), "end": iso(t[e]), "duration_s": round(float(dur), 3),
+                     "lat": float(lat[s]), "lon": float(lon[s])}
+                    for s, e, dur in zip(starts[:max_periods], ends[:max_periods], durations[:max_periods])],
+    }
+    return result
+
+# Window from ?since/?until (aware datetimes or None): until defaults to now, since to GPS_WINDOW_HOURS before
+def window(since=None, until=None):
+    until = until or datetime.now(timezone.utc)
+    return since or until - timedelta(hours=GPS_WINDOW_HOURS), until
+
+def bike_metrics(col, bike_id, since, until):
+    t, lat, lon, invalid = load_fixes(col, bike_id, since, until)
+    return {"bike_id": bike_id, "since": since.isoformat(), "until": until.isoformat(), "invalid_fixes": invalid,
+            **route_metrics(t, lat, lon)}
@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+# Web tier only: the MQTT ingest runs in its own process (ingest.py)
+bind = f"0.0.0.0:{os.environ.get('FLASK_TLS_PORT', '8443')}"
+workers = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count()))
+# Threads per worker: SSE streams keep a thread busy for their whole lifetime
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "16"))
+timeout = 0  # SSE streams are long-lived
+
+# TLS
+certfile = os.environ.get("FLASK_TLS_CERT", "/etc/ssl/client-flask.crt")
+keyfile = os.environ.get("FLASK_TLS_KEY", "/etc/ssl/client-flask.key.unlocked")
+
+accesslog = "-"
+
+# JSON logs through a queue listener thread, started in each worker (not in the master before fork)
+def post_worker_init(worker):
+    import logs
+    logs.setup_logging(f"web-{os.getpid()}")
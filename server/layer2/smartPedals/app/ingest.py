@@ -0,0 +1,819 @@
+import os
+import threading
+import time
+import ssl
+import re
+import json
+import logging
+import signal
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+import paho.mqtt.client as mqtt
+from twilio.rest import Client as TwilioClient
+
+import alerts
+import availability
+import cache
+import dedup
+import fleet
+import gps
+import logs
+import metrics
+import profiler
+import replay
+import retention
+import trips
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+
+from common import BRUSSELS, EVENTS_SOCKET, init_db, json_loads
+from events import EventHub
+
+"""
+Ingest worker: owns the MQTT clients, the alert state and the Mongo writes.
+Run it as a single process next to the web tier (python3 ingest.py), which receives live events through the hub.
+"""
+
+# MQTT (local / secured)
+MQTT_BROKER = os.environ.get("MQTT_BROKER", "localhost")
+MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
+MQTT_USERNAME = os.environ.get("MQTT_USERNAME", "smartadmin")
+MQTT_PASSWORD = os.environ.get("MQTT_PASSWORD", "smartpass")
+MQTT_CLIENT_ID = os.environ.get("MQTT_CLIENT_ID", "trusted-hepl_smartPedals")
+
+# TLS certs (paths must exist in container/host)
+MQTT_CA_CERT = os.environ.get("MQTT_CA_CERT", "/etc/ssl/ca.crt")
+MQTT_CLIENT_CERT = os.environ.get("MQTT_CLIENT_CERT", "/etc/ssl/client-mqtt.crt")
+MQTT_CLIENT_KEY = os.environ.get("MQTT_CLIENT_KEY", "/etc/ssl/client-mqtt.key.unlocked")
+
+# External MQTT (test.mosquitto.org)
+EXT_MQTT_BROKER = os.environ.get("EXT_MQTT_BROKER", "test.mosquitto.org")
+EXT_MQTT_PORT = int(os.environ.get("EXT_MQTT_PORT", 8884))
+EXT_MQTT_CLIENT_ID = os.environ.get("EXT_MQTT_CLIENT_ID", "smartPedals-ext-disponibilities")
+EXT_MQTT_CA_CERT = os.environ.get("EXT_MQTT_CA_CERT", "/etc/ssl/testmosquitto/mosquitto.org.crt")
+EXT_MQTT_CLIENT_CERT = os.environ.get("EXT_MQTT_CLIENT_CERT", "/etc/ssl/testmosquitto/client.crt")
+EXT_MQTT_CLIENT_KEY = os.environ.get("EXT_MQTT_CLIENT_KEY", "/etc/ssl/testmosquitto/client.key")
+
+# Mailtrap
+MAILTRAP_TOKEN = os.environ.get("MAILTRAP_TOKEN", "")
+MAILTRAP_EMAIL = os.environ.get("MAILTRAP_EMAIL", "")
+MAILTRAP_CAT = os.environ.get("MAILTRAP_CAT", "end-user")
+
+# Twilio (SMS notifications)
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
+TWILIO_NUMBER = os.environ.get("TWILIO_NUMBER", "")
+TARGET_NUMBER = os.environ.get("TARGET_NUMBER", "")
+ZERO_ALERT_SECONDS = int(os.environ.get("ZERO_ALERT_SECONDS", 15 * 60)) # Send message after 15
+ZERO_ALERT_RETRY_SECONDS = int(os.environ.get("ZERO_ALERT_RETRY_SECONDS", "60")) # Failed alert SMS tried again after
+ALERT_TICK_SECONDS = 1 # Alert timer wheel resolution
+AVAILABILITY_SOURCE = os.environ.get("AVAILABILITY_SOURCE", "racks") # Alerts from the rack counters (racks) or hepl/disponibilities (external)
+AVAILABILITY_RECONCILE_SECONDS = int(os.environ.get("AVAILABILITY_RECONCILE_SECONDS", "300")) # Full recount (missed rack events)
+
+# Ingest engine: "threads" (paho loop threads, blocking I/O) or "asyncio" (ingest_async.py, single event loop)
+INGEST_ENGINE = os.environ.get("INGEST_ENGINE", "threads")
+INGEST_MAX_INFLIGHT = int(os.environ.get("INGEST_MAX_INFLIGHT", "5000")) # asyncio engine only
+
+# Topics
+AUTH_TOPIC = "hepl/auth"
+AUTH_REPLY_TOPIC = "hepl/auth_reply"
+LOCATION_TOPIC = "hepl/location"
+PARKED_TOPIC = "hepl/parked"
+DISPONIBILITIES_TOPIC = "hepl/disponibilities"
+AVAILABILITY_TOPIC = availability.AVAILABILITY_TOPIC # Published by this worker (hepl/availability[/<station_id>])
+
+# Other
+AUTH_MAX_SKEW_SECONDS = int(os.environ.get("AUTH_MAX_SKEW_SECONDS", "120"))
+# External topic cache
+latest_disponibilities = None
+latest_disponibilities_count = None
+# Twilio
+twilio_client = None
+# MQTT clients (created by main)
+mqtt_client = None
+mqtt_client_ext = None
+
+"""
+Initialization and helpers
+"""
+
+logger = logging.getLogger("smartpedals.ingest")
+
+client, db, data_col, users_col, bikes_col, racks_col, stations_col, locations_col = init_db()
+telemetry_col = db[retention.TELEMETRY_COLLECTION]  # capped, DATA_CAPPED_TOPICS only
+auth_requests_col = db[dedup.AUTH_REQUESTS_COLLECTION]  # Auth replies by request key (idempotency)
+alert_state_col = db.alert_state  # Stations at zero (alerts.py), reloaded on start
+trips_col = db[trips.TRIPS_COLLECTION]  # Unlock/lock pairs (trips.py), open ones reloaded on start
+
+# Profiler cprofile mode (thread engine): hook the paho callbacks for the window
+def profile_hooks(wrap):
+    clients = [c for c in (mqtt_client, mqtt_client_ext) if c is not None]
+    originals = [c.on_message for c in clients]
+    for c, f in zip(clients, originals):
+        c.on_message = wrap(f)
+    def restore():
+        for c, f in zip(clients, originals):
+            c.on_message = f
+    return restore
+
+# Requests from the web workers
+def on_web_event(event):
+    kind = event.get("type")
+    if kind == "profile" and event.get("scope") in ("all", "ingest"):
+        install = profile_hooks if INGEST_ENGINE == "threads" else None
+        profiler.run_requested(event, "ingest", hub.publish, install)
+    elif kind == "racks_changed":
+        refresh_racks(event.get("racks"))
+    elif kind == "trips_reload":
+        load_trips()
+
+# Live events towards the web workers
+hub = EventHub(EVENTS_SOCKET, on_web_event)
+
+# Cached API responses (web workers, cache.py) made stale by an auth decision
+def invalidate_cache(keys):
+    hub.publish({"type": "cache_invalidate", "keys": keys})
+
+def publish_ping():
+    hub.publish({"type": "ping"})
+
+metrics.Gauge("smartpedals_event_subscribers", "Web workers connected to the event hub", fn=hub.subscribers)
+
+"""
+Payloads: decoded once per message, stored parsed
+"""
+
+# bytes -> parsed JSON value, or None if the payload is not JSON
+def decode_payload(raw):
+    try:
+        return json_loads(raw)
+    except ValueError:
+        return None
+
+# Device timestamp (ISO string or epoch seconds) -> aware datetime, None if missing or invalid
+def parse_ts(value):
+    try:
+        if isinstance(value, str):
+            ts = datetime.fromisoformat(value)
+            return ts if ts.tzinfo else ts.replace(tzinfo=BRUSSELS)
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 1e9:
+            return datetime.fromtimestamp(value, timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        pass
+    return None
+
+# data_col document: parsed payload + typed ts (device time, else reception time); raw bytes only for non-JSON
+# expire_at: reception time + topic retention (TTL index), not set for capped topics or topics kept forever
+def data_document(topic, raw, data):
+    now = datetime.now(timezone.utc)
+    ts = parse_ts(data.get("timestamp")) if isinstance(data, dict) else None
+    doc = {"topic": topic, "ts": ts or now}
+    if data is None:
+        doc["raw"] = Binary(bytes(raw))
+    else:
+        doc["payload"] = data
+    if not retention.is_capped(topic):
+        expire_at = retention.expire_at(topic, now)
+        if expire_at:
+            doc["expire_at"] = expire_at
+    return doc
+
+# Insert MQTT messages inside the mongodb
+def insert_to_mongo(topic, raw, data):
+    try:
+        col = telemetry_col if retention.is_capped(topic) else data_col
+        result = col.insert_one(data_document(topic, raw, data))
+        logger.debug("[MQTT] Inserted: %s", result.inserted_id)
+        publish_ping()
+    except Exception as e:
+        logger.error("[MQTT] Error during insert: %s", e)
+
+# Send email via Mailtrap
+@metrics.notification("mailtrap")
+def send_mailtrap_email(to_email: str, subject: str, text: str, to_name: str | None = None) -> bool:
+    try:
+        if not MAILTRAP_TOKEN or not MAILTRAP_EMAIL:
+            logger.warning("[MAILTRAP] Missing MAILTRAP_TOKEN or MAILTRAP_EMAIL")
+            return False
+
+        headers = {
+            "Authorization": f"Bearer {MAILTRAP_TOKEN}",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "from": {"email": MAILTRAP_EMAIL, "name": "SmartPedals"},
+            "to": [{"email": to_email, "name": (to_name or "User")}],
+            "subject": subject,
+            "text": text,
+            "category": MAILTRAP_CAT,
+        }
+
+        resp = requests.post(
+            "https://send.api.mailtrap.io/api/send",
+            headers=headers,
+            json=payload,
+            timeout=5,
+        )
+        if 200 <= resp.status_code < 300:
+            logger.info("[MAILTRAP] Email sent to %s: %s", to_email, subject)
+            return True
+        else:
+            logger.warning("[MAILTRAP] Send failed %s: %s", resp.status_code, resp.text)
+            return False
+    except Exception as e:
+        logger.exception("[MAILTRAP] Exception while sending email: %s", e)
+        return False
+
+# Twilio message
+@metrics.notification("twilio")
+def twilio_send_sms(body: str) -> bool:
+    try:
+        msg = twilio_client.messages.create(
+            from_=TWILIO_NUMBER,
+            to=TARGET_NUMBER,
+            body=body
+        )
+        logger.info("[TWILIO] SMS sent: sid=%s", msg.sid)
+        return True
+    except Exception as e:
+        logger.error("[TWILIO] Send error: %s", e)
+        return False
+
+"""
+MQTT local secured for authentication (+email) and location messages AND external MQTT for disponibilities (+twilio sms)
+"""
+
+# Auth reply published on hepl/auth_reply (shared by both ingest engines)
+def build_auth_reply(user_id, action, rack_id, now_iso, station_id, reply):
+    metrics.AUTH_REPLIES.inc(action if action in ("lock", "unlock") else "other", reply)
+    return {
+        "user_id": user_id,
+        "action": action,
+        "rack_id": rack_id,
+        "timestamp": now_iso,
+        "type": "auth_response",
+        "station_id": station_id,
+        "reply": reply
+    }
+
+# Unlock notification email: (to_email, subject, text, full_name), or None if the user has no email
+def build_unlock_email(user, user_id, bike_id, rack_id, now_iso):
+    to_email = user.get("email") if isinstance(user, dict) else None
+    first = user.get("firstName") if isinstance(user, dict) else None
+    last  = user.get("lastName")  if isinstance(user, dict) else None
+    full_name = f"{first} {last}".strip() if first or last else "User"
+
+    if not to_email:
+        logger.warning("[MAILTRAP] No email for user %s; skipping email", user_id)
+        return None
+    subject = f"Bike {bike_id} unlocked"
+    text = (
+        f"Hello {full_name},\n\n"
+        f"Your bike {bike_id} has been unlocked at {now_iso}.\n"
+        f"Rack: {rack_id or 'n/a'}.\n"
+        f"Enjoy the ride!\n\n— HEPL Team"
+    )
+    return to_email, subject, text, full_name
+
+# Handle authentication messages: duplicates get the first reply again, nothing else is redone
+@metrics.AUTH_SECONDS.time()
+def handle_auth_message(mqtt_client_instance, data):
+    key = dedup.auth_key(data)
+    if key is not None:
+        reply = dedup.replies.get(key)
+        source = "cache"
+        if reply is None:
+            source = "mongo"
+            try:
+                doc = auth_requests_col.find_one({"_id": key}, {"reply": 1})
+                reply = doc.get("reply") if doc else None
+            except Exception as e:
+                logger.error("[AUTH] Request lookup failed for %s: %s", key, e)
+        if reply is not None:
+            dedup.replies.put(key, reply)
+            metrics.AUTH_DUPLICATES.inc(source)
+            logger.info("[AUTH] Duplicate request %s, %s reply resent", key, reply.get("reply"))
+            mqtt_client_instance.publish(AUTH_REPLY_TOPIC, json.dumps(reply), qos=2, retain=False)
+            return
+    reply = process_auth_message(mqtt_client_instance, data)
+    if key is not None and reply is not None:
+        dedup.replies.put(key, reply)
+        try:
+            auth_requests_col.insert_one(dedup.request_document(key, reply))
+        except DuplicateKeyError:
+            pass
+        except Exception as e:
+            logger.error("[AUTH] Could not store request %s: %s", key, e)
+
+# The reply is out: a failing side effect (hub, retained publish...) is logged, never turned into a second "deny"
+def after_accept(what, fn, *args):
+    try:
+        fn(*args)
+    except Exception as e:
+        logger.exception("%s failed after accept: %s", what, e)
+
+# Decide and apply one auth request; returns the published reply (None after an error: not replayed)
+def process_auth_message(mqtt_client_instance, data):
+    reply_topic = AUTH_REPLY_TOPIC
+    now = datetime.now(BRUSSELS)
+    now_iso = now.isoformat(timespec="seconds")
+
+    def send_deny(reason=None):
+        reply = build_auth_reply(user_id, action, rack_id, now_iso, None, "deny")
+        mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
+        if reason:
+            logger.info("[AUTH] %s → deny", reason, extra={"user_id": user_id, "rack_id": rack_id, "action": action})
+        return reply
+
+    user_id = action = rack_id = None
+    try:
+        if not isinstance(data, dict):
+            return send_deny("Invalid JSON payload")
+        user_id = data.get("user_id")
+        bike_id = data.get("bike_id")
+        rack_id = data.get("rack_id")
+        # action = data.get("type") or data.get("action") # receive smth different now ...
+        action = data.get("action")
+        action_type = data.get("type")  # 'lock' or 'unlock'
+        ts_str = data.get("timestamp")
+
+        # Check if all required fields are present
+        # if not all([user_id, bike_id, rack_id, action, ts_str]):
+        # if not all([user_id, rack_id, action, ts_str]): # bike_id is optional for lock action
+        if not all([user_id, rack_id, ts_str]): # bike_id is optional for lock action
+            return send_deny("Missing fields")
+
+        # Check user
+        user = users_col.find_one({"rfid": str(user_id)})
+        if not user:
+            return send_deny(f"Unknown user {user_id}")
+
+        # Check bike
+        # bike_doc = bikes_col.find_one({"bike_id": str(bike_id)})
+        # if not bike_doc:
+        #     return send_deny(f"No bike found in rack {rack_id}")
+
+        # Check timestamp
+        try:
+            ts_msg = datetime.fromisoformat(str(ts_str))
+            if ts_msg.tzinfo is None:
+                ts_msg = ts_msg.replace(tzinfo=BRUSSELS)
+            skew = abs((now - ts_msg).total_seconds())
+        except Exception:
+            logger.info("[AUTH] Invalid timestamp format: %s, improvement point", ts_str)
+            pass
+            # return send_deny(f"Invalid timestamp format {ts_str}")
+
+        # if skew > AUTH_MAX_SKEW_SECONDS:
+        #     logger.info(f"[AUTH] Timestamp skew too large: {skew:.1f}s (max {AUTH_MAX_SKEW_SECONDS}s), improvement point")
+        #     return send_deny(f"Timestamp skew too large ({skew:.1f}s)")
+
+        # Get rack and station_id for the reply
+        rack_doc = fleet.model.rack(rack_id) or racks_col.find_one({"rack_id": str(rack_id)})
+        logger.debug("[AUTH] Rack doc: %s", rack_doc)
+        station_id = str(rack_doc.get("station_id")) if rack_doc else None
+
+        # Action: unlock
+        if action == "unlock":
+            update_bike = bikes_col.update_one(
+                {"bike_id": str(bike_id), "status": "available", "currentRack": str(rack_id)},
+                {"$set": {"status": "in_use", "currentUser": str(user_id), "currentRack": None},
+                "$push": {"history": {"action": "unlock", "user_id": str(user_id), "timestamp": now}}}
+            )
+            if update_bike.modified_count == 0:
+                return send_deny(f"Unlock denied for user={user_id} bike={bike_id} rack={rack_id}")
+
+            update_rack = racks_col.update_one(
+                {"rack_id": str(rack_id), "currentBike": str(bike_id)},
+                {"$set": {"currentBike": None},
+                "$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
+            )
+            if update_rack.modified_count == 0:
+                bikes_col.update_one(
+                    {"bike_id": str(bike_id), "status": "in_use", "currentUser": str(user_id), "currentRack": None},
+                    {"$set": {"status": "available", "currentUser": None, "currentRack": str(rack_id)},
+                    "$push": {"history": {"action": "unlock_rollback", "user_id": str(user_id), "timestamp": now}}}
+                )
+                invalidate_cache(cache.keys("bike", str(bike_id)))
+                return send_deny(f"Rack update failed for rack={rack_id} bike={bike_id} [rollback ok]")
+
+            users_col.update_one(
+                {"rfid": str(user_id)},
+                {"$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
+            )
+            reply = build_auth_reply(user_id, action, rack_id, now_iso, station_id, "accept")
+            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
+            logger.info("[AUTH] Unlock accepted for user=%s bike=%s rack=%s", user_id, bike_id, rack_id)
+            after_accept("[HUB] Ping", publish_ping)
+            after_accept("[CACHE] Invalidation", invalidate_cache, cache.keys("bike", str(bike_id))
+                         + cache.keys("rack", str(rack_id)) + cache.keys("user", str(user_id)))
+            after_accept("[AVAILABILITY] Publish", lambda: publish_availability(
+                fleet_availability.set_rack(rack_id, rack_doc.get("station_id"), False)))
+            after_accept("[TRIPS] Trip event", trip_builder.event,
+                         "unlock", user_id, bike_id, rack_id, station_id, now)
+
+            try:
+                # User email notification
+                email = build_unlock_email(user, user_id, bike_id, rack_id, now_iso)
+                if email:
+                    to_email, subject, text, full_name = email
+                    send_mailtrap_email(to_email=to_email, subject=subject, text=text, to_name=full_name)
+            except Exception as e:
+                logger.exception("[MAILTRAP] Error while preparing/sending unlock email: %s", e)
+
+            # If we reach here, the unlock was successful
+            return reply
+
+        # Action: lock
+        if action == "lock":
+            # update_bike = bikes_col.update_one(
+            #     {"bike_id": str(bike_id), "status": "in_use", "currentUser": str(user_id)},
+            #     {"$set": {"status": "available", "currentUser": None, "currentRack": str(rack_id)},
+            #     "$push": {"history": {"action": "lock", "user_id": str(user_id), "timestamp": now}}}
+            # )
+            # if update_bike.modified_count == 0:
+            #     return send_deny(f"Lock denied for user={user_id} bike={bike_id} (not in use by this user)")
+
+            update_rack = racks_col.update_one(
+                {"rack_id": str(rack_id), "currentBike": None},
+                {"$set": {"currentBike": str(bike_id)},
+                "$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
+            )
+            # if update_rack.modified_count == 0:
+            #     bikes_col.update_one(
+            #         {"bike_id": str(bike_id), "status": "available", "currentUser": None, "currentRack": str(rack_id)},
+            #         {"$set": {"status": "in_use", "currentUser": str(user_id), "currentRack": None},
+            #         "$push": {"history": {"action": "lock_rollback", "user_id": str(user_id), "timestamp": now}}}
+            #     )
+            #     return send_deny(f"Rack busy/missing for rack={rack_id} bike={bike_id} [rollback ok]")
+
+            users_col.update_one(
+                {"rfid": str(user_id)},
+                {"$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
+            )
+            reply = build_auth_reply(user_id, action, rack_id, now_iso, station_id, "accept")
+            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
+            logger.info("[AUTH] Lock accepted for user=%s bike=%s rack=%s", user_id, bike_id, rack_id)
+            after_accept("[HUB] Ping", publish_ping)
+            after_accept("[CACHE] Invalidation", invalidate_cache,
+                         cache.keys("rack", str(rack_id)) + cache.keys("user", str(user_id)))
+            if update_rack.modified_count:
+                after_accept("[AVAILABILITY] Publish", lambda: publish_availability(
+                    fleet_availability.set_rack(rack_id, rack_doc.get("station_id"), True)))
+            after_accept("[TRIPS] Trip event", trip_builder.event,
+                         "lock", user_id, bike_id, rack_id, station_id, now)
+            return reply
+
+        # Unknown action
+        return send_deny(f"Unknown action '{action}'")
+
+    except Exception as e:
+        logger.info("[AUTH] Error: %s", e)
+        try:
+            reply = build_auth_reply(
+                data.get("user_id") if isinstance(data, dict) else None,
+                (data.get("type") or data.get("action")) if isinstance(data, dict) else None,
+                data.get("rack_id") if isinstance(data, dict) else None,
+                now_iso, None, "deny")
+            mqtt_client_instance.publish(reply_topic, json.dumps(reply), qos=2, retain=False)
+        except Exception:
+            pass
+
+# MQTT local (secured)
+def on_connect(client, userdata, flags, rc):
+    logger.info("[MQTT] Connected with result code %s", rc)
+    metrics.mqtt_connected("local")
+    #client.subscribe("sensors/#")
+    client.subscribe("hepl/#")
+    client.subscribe(AUTH_TOPIC, qos=2)  # auth messages
+    client.subscribe(LOCATION_TOPIC)  # location messages
+    client.subscribe(PARKED_TOPIC, qos=2) # bike_id rack_id station_id
+    publish_availability({}, full=True)  # Retained counters, in case the broker lost them
+
+def on_message(client, userdata, msg):
+    if msg.topic.startswith(AVAILABILITY_TOPIC):
+        return  # Our own counters (hepl/# subscription)
+    t0 = time.perf_counter()
+    replay.record("local", msg.topic, msg.payload, msg.qos)
+    try:
+        data = decode_payload(msg.payload)
+        logger.debug("[MQTT] Message received on %s: %s", msg.topic, msg.payload)
+        # Authentification
+        if msg.topic == AUTH_TOPIC:
+            handle_auth_message(client, data)
+        elif msg.topic == LOCATION_TOPIC:
+            if isinstance(data, dict):
+                try:
+                    locations_col.insert_one({**data, "timestamp": datetime.now(BRUSSELS)})
+                    logger.debug("[MQTT] Location data inserted into database")
+                except Exception as e:
+                    logger.error("[MQTT] Error inserting location data: %s", e)
+            else:
+                logger.warning("[MQTT] Error decoding JSON payload for location message")
+        insert_to_mongo(msg.topic, msg.payload, data)
+    except Exception as e:
+        logger.exception("[MQTT] Error in on_message: %s", e)
+    metrics.MQTT_MESSAGES.inc("local", msg.topic)
+    metrics.MQTT_HANDLE_SECONDS.observe(time.perf_counter() - t0, "local", msg.topic)
+
+def start_mqtt_loop():
+    while True:
+        try:
+            mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+            mqtt_client.loop_start()
+            while True:
+                if not mqtt_client.is_connected():
+                    logger.warning("[MQTT] Disconnected! Reconnecting...")
+                    mqtt_client.reconnect()
+                time.sleep(5)
+        except Exception as e:
+            logger.error("[MQTT] loop error: %s", e)
+            time.sleep(5)
+
+# MQTT ext (test broker)
+def on_connect_ext(client, userdata, flag, rc):
+    logger.info("[EXT MQTT] Connected to %s with rc %s", EXT_MQTT_BROKER, rc)
+    metrics.mqtt_connected("ext")
+    client.subscribe(DISPONIBILITIES_TOPIC)
+
+# Trips (trips.py): built from the accepted unlock/lock decisions as they are taken
+def persist_trip(trip):
+    try:
+        trips_col.replace_one({"trip_id": trip["trip_id"]}, trip, upsert=True)
+    except Exception as e:
+        logger.error("[TRIPS] Could not store trip %s: %s", trip["trip_id"], e)
+
+trip_builder = trips.TripBuilder(persist=persist_trip)
+
+metrics.Gauge("smartpedals_trips_open", "Trips started and not locked yet", fn=trip_builder.open_count)
+
+# On start, and after a backfill (trips_reload)
+def load_trips():
+    try:
+        count = trip_builder.load(trips_col.find({"status": "open"}))
+        logger.info("[TRIPS] %d open trip(s) restored", count)
+    except Exception as e:
+        logger.error("[TRIPS] Could not load open trips: %s", e)
+
+# Zero-availability alerts per station (alerts.py): SMS after ZERO_ALERT_SECONDS at 0, again on recovery
+def persist_alert_state(station, state):
+    try:
+        if state is None:
+            alert_state_col.delete_one({"_id": station})
+        else:
+            alert_state_col.replace_one({"_id": station}, alerts.state_document(station, state), upsert=True)
+    except Exception as e:
+        logger.error("[ALERT] Could not persist state of %s: %s", station, e)
+
+zero_alerts = alerts.ZeroAlerts(ZERO_ALERT_SECONDS, time.time(), persist=persist_alert_state,
+                                retry=ZERO_ALERT_RETRY_SECONDS, tick=ALERT_TICK_SECONDS)
+
+metrics.Gauge("smartpedals_zero_stations", "Stations with no available bike", ("state",), fn=zero_alerts.summary)
+
+def load_alert_state():
+    try:
+        count = zero_alerts.load(alert_state_col.find(), time.time())
+        logger.info("[ALERT] %d station(s) at zero restored", count)
+    except Exception as e:
+        logger.error("[ALERT] Could not load alert state: %s", e)
+
+# Fleet count ("*") and per-station counts when the payload has them
+def handle_disponibility_alerts(count, stations=None):
+    now = time.time()
+    notifications = zero_alerts.observe(alerts.FLEET, count, now)
+    for station, station_count in (stations or {}).items():
+        notifications += zero_alerts.observe(station, station_count, now)
+    send_alerts(notifications)
+
+# SMS sent by one worker thread, in order: a slow Twilio call never holds an MQTT loop (auth replies)
+alert_sender = ThreadPoolExecutor(1, thread_name_prefix="alerts-sms")
+
+def send_alerts(notifications):
+    if notifications:
+        alert_sender.submit(deliver_alerts, notifications)
+
+def deliver_alerts(notifications):
+    try:
+        for kind, station, count in notifications:
+            ok = twilio_send_sms(alerts.alert_text(kind, station, count, ZERO_ALERT_SECONDS))
+            if kind == "zero":
+                zero_alerts.sent(station, ok, time.time())
+    except Exception as e:
+        logger.exception("[ALERT] Delivery failed: %s", e)
+
+# Fires the pending deadlines, whether or not availability messages keep coming
+def alerts_loop():
+    while True:
+        time.sleep(ALERT_TICK_SECONDS)
+        try:
+            send_alerts(zero_alerts.tick(time.time()))
+        except Exception as e:
+            logger.exception("[ALERT] Tick failed: %s", e)
+
+# Availability counters from the rack state (availability.py), served to the web workers and published retained
+fleet_availability = availability.Availability()
+
+def availability_event():
+    return {"type": "availability", **fleet_availability.snapshot()}
+
+# Alert notifications for the changed stations (AVAILABILITY_SOURCE=racks)
+def availability_notifications(changed):
+    if AVAILABILITY_SOURCE != "racks" or not changed:
+        return []
+    now = time.time()
+    notifications = zero_alerts.observe(alerts.FLEET, fleet_availability.fleet, now)
+    for station, (count, _) in changed.items():
+        if station == alerts.FLEET:
+            continue
+        if count is None:
+            zero_alerts.forget(station)
+        else:
+            notifications += zero_alerts.observe(station, count, now)
+    return notifications
+
+# Change-only: nothing when no count moved; full=True republishes every station (broker (re)connect)
+def publish_availability(changed, full=False):
+    if not changed and not full:
+        return
+    if changed:
+        hub.publish(availability_event(), key="availability")
+    if mqtt_client is not None and mqtt_client.is_connected():
+        for topic, payload in fleet_availability.messages(changed, full):
+            mqtt_client.publish(topic, payload, qos=1, retain=True)
+    send_alerts(availability_notifications(changed))
+
+# Rack changes made by the web API (replaced by the asyncio engine)
+availability_sink = publish_availability
+
+def refresh_racks(rack_ids):
+    if not rack_ids:
+        return
+    try:
+        docs = {str(d["rack_id"]): d for d in racks_col.find({"rack_id": {"$in": rack_ids}}, availability.RACK_FIELDS)}
+    except Exception as e:
+        logger.error("[AVAILABILITY] Could not read racks %s: %s", rack_ids, e)
+        return
+    changed = {}
+    for rack_id in rack_ids:
+        changed.update(fleet_availability.set_rack_doc(rack_id, docs.get(str(rack_id))))
+    availability_sink(changed)
+
+def load_availability():
+    try:
+        changed = fleet_availability.load(racks_col.find({}, availability.RACK_FIELDS))
+    except Exception as e:
+        logger.error("[AVAILABILITY] Recount failed: %s", e)
+        return
+    if changed:
+        logger.info("[AVAILABILITY] %d bike(s) docked, %d station(s) updated", fleet_availability.fleet, len(changed))
+    publish_availability(changed)
+
+def availability_loop():
+    while True:
+        time.sleep(AVAILABILITY_RECONCILE_SECONDS)
+        load_availability()
+
+# Parse a disponibilities payload -> (message, count, {station_id: count} or None)
+def parse_disponibilities(topic, payload):
+    # # Regex to extract number -> old way, without JSONPath (only message)
+    # m = re.search(r"\d+", payload)
+    # latest_disponibilities_count = int(m.group(0)) if m else None
+    try:
+        # Try to parse as JSON
+        data = json.loads(payload)
+        message = data.get("message", payload) # String
+        count = data.get("availableBikes")  # Number
+        stations = parse_station_counts(data.get("stations"))  # Optional {station_id: availableBikes}
+        logger.debug("[EXT MQTT] %s=%s (count=%s)", topic, payload, count)
+    except json.JSONDecodeError:
+        # If not JSON, fallback to regex
+        message = payload
+        m = re.search(r"\d+", payload)
+        count = int(m.group(0)) if m else None
+        stations = None
+        logger.debug("[EXT MQTT] %s=%s (fallback count=%s)", topic, payload, count)
+    return message, count, stations
+
+def parse_station_counts(value):
+    if not isinstance(value, dict):
+        return None
+    return {str(k): v for k, v in value.items() if isinstance(v, int) and not isinstance(v, bool)}
+
+# Reload SSE (sticky: web workers connecting later get the last value)
+def publish_disponibilities():
+    hub.publish({
+        "type": "disponibilities",
+        "message": latest_disponibilities,
+        "count": latest_disponibilities_count,
+    }, key="disponibilities")
+
+def on_message_ext(client, userdata, msg):
+    global latest_disponibilities, latest_disponibilities_count
+    t0 = time.perf_counter()
+    replay.record("ext", msg.topic, msg.payload, msg.qos)
+    try:
+        payload = msg.payload.decode()
+        latest_disponibilities, latest_disponibilities_count, stations = parse_disponibilities(msg.topic, payload)
+
+        # Trigger alerts logic after we have the count
+        if latest_disponibilities_count is not None and AVAILABILITY_SOURCE == "external":
+            handle_disponibility_alerts(latest_disponibilities_count, stations)
+
+        publish_disponibilities()
+    except Exception as e:
+        logger.exception("[EXT MQTT] Error in on_message_ext: %s", e)
+    metrics.MQTT_MESSAGES.inc("ext", msg.topic)
+    metrics.MQTT_HANDLE_SECONDS.observe(time.perf_counter() - t0, "ext", msg.topic)
+
+def start_mqtt_loop_ext():
+    while True:
+        try:
+            mqtt_client_ext.connect(EXT_MQTT_BROKER, EXT_MQTT_PORT, 60)
+            mqtt_client_ext.loop_start()
+            while True:
+                if not mqtt_client_ext.is_connected():
+                    logger.warning("[MQTT EXT] Disconnected! Reconnecting...")
+                    mqtt_client_ext.reconnect()
+                time.sleep(5)
+        except Exception as e:
+            logger.error("[MQTT EXT] loop error: %s", e)
+
+"""
+Entry point
+"""
+
+# MQTT client setup
+def create_mqtt_client():
+    c = mqtt.Client(client_id=MQTT_CLIENT_ID)
+    c.username_pw_set(username=MQTT_USERNAME, password=MQTT_PASSWORD)
+    c.tls_set(
+        ca_certs=MQTT_CA_CERT,
+        certfile=MQTT_CLIENT_CERT,
+        keyfile=MQTT_CLIENT_KEY,
+        tls_version=ssl.PROTOCOL_TLSv1_2
+    )
+    c.tls_insecure_set(True)
+    c.on_connect = on_connect
+    c.on_message = on_message
+    return c
+
+def create_mqtt_client_ext():
+    c = mqtt.Client(client_id=EXT_MQTT_CLIENT_ID)
+    c.tls_set(
+        ca_certs=EXT_MQTT_CA_CERT,
+        certfile=EXT_MQTT_CLIENT_CERT,
+        keyfile=EXT_MQTT_CLIENT_KEY,
+        tls_version=ssl.PROTOCOL_TLSv1_2
+    )
+    c.on_connect = on_connect_ext
+    c.on_message = on_message_ext
+    return c
+
+def main():
+    global twilio_client, mqtt_client, mqtt_client_ext
+    logs.setup_logging("ingest")
+    # Sticky: web workers starting later get the ingest metrics right away
+    metrics.start_push("ingest", lambda event: hub.publish(event, key="metrics:ingest"))
+    try:
+        for action in retention.ensure_collections(db):
+            logger.info("[MONGO] Retention: %s", action)
+        dedup.ensure_indexes(db)
+        trips.ensure_indexes(db)
+        gps.ensure_indexes(db)
+    except Exception as e:
+        logger.error("[MONGO] Collection setup failed: %s", e)
+    load_alert_state()
+    load_trips()
+    replay.start_recording()
+    fleet.model.start(db)  # Both engines: rack lookups of the auth path
+
+    if INGEST_ENGINE == "asyncio":
+        import ingest_async
+        return ingest_async.run()
+
+    twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    hub.start()
+    load_availability()
+
+    mqtt_client = create_mqtt_client()
+    mqtt_client_ext = create_mqtt_client_ext()
+
+    # Start MQTT threads
+    threading.Thread(target=start_mqtt_loop, daemon=True).start()
+    threading.Thread(target=start_mqtt_loop_ext, daemon=True).start()
+    threading.Thread(target=alerts_loop, name="alerts", daemon=True).start()
+    threading.Thread(target=availability_loop, name="availability", daemon=True).start()
+
+    # Wait for SIGTERM/SIGINT (docker stop)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    stop.wait()
+    mqtt_client.disconnect()
+    mqtt_client_ext.disconnect()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+import asyncio
+import json
+import logging
+import signal
+import ssl
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import aiomqtt
+import httpx
+from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError
+
+import ingest
+import alerts
+import availability
+import cache
+import dedup
+import fleet
+import metrics
+import replay
+import retention
+from common import BRUSSELS, MONGO_URL
+from ingest import (
+    MQTT_BROKER, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_CLIENT_ID,
+    MQTT_CA_CERT, MQTT_CLIENT_CERT, MQTT_CLIENT_KEY,
+    EXT_MQTT_BROKER, EXT_MQTT_PORT, EXT_MQTT_CLIENT_ID,
+    EXT_MQTT_CA_CERT, EXT_MQTT_CLIENT_CERT, EXT_MQTT_CLIENT_KEY,
+    MAILTRAP_TOKEN, MAILTRAP_EMAIL, MAILTRAP_CAT,
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_NUMBER, TARGET_NUMBER, ZERO_ALERT_SECONDS, ALERT_TICK_SECONDS,
+    INGEST_MAX_INFLIGHT, AVAILABILITY_SOURCE, AVAILABILITY_RECONCILE_SECONDS,
+    AUTH_TOPIC, AUTH_REPLY_TOPIC, LOCATION_TOPIC, PARKED_TOPIC, DISPONIBILITIES_TOPIC, AVAILABILITY_TOPIC,
+    build_auth_reply, build_unlock_email, data_document, decode_payload, parse_disponibilities, publish_ping,
+    publish_disponibilities,
+)
+
+"""
+asyncio ingest engine (INGEST_ENGINE=asyncio): both brokers, Mongo and the outbound HTTP calls share one event loop.
+Same topics, replies and collections as the thread engine in ingest.py. Every message is a task of one TaskGroup,
+at most INGEST_MAX_INFLIGHT at once (the broker loops stop reading while the limit is reached).
+"""
+
+logger = logging.getLogger("smartpedals.ingest.async")
+
+RECONNECT_SECONDS = 5
+RACK_LOCK_STRIPES = 256 # Auth requests of racks sharing a stripe are handled in order (rack ids are untrusted input)
+
+def tls_context(ca_cert, client_cert, client_key, check_hostname=True):
+    ctx = ssl.create_default_context(cafile=ca_cert)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_2
+    ctx.load_cert_chain(certfile=client_cert, keyfile=client_key)
+    # Same as tls_insecure_set(True) for the local broker: hostname is not the service name
+    ctx.check_hostname = check_hostname
+    return ctx
+
+class AsyncIngest:
+    def __init__(self, tg):
+        self.tg = tg
+        self.mongo = AsyncMongoClient(MONGO_URL, event_listeners=[metrics.mongo_listener])
+        db = self.mongo.smartpedals
+        self.data_col = db.data
+        self.telemetry_col = db[retention.TELEMETRY_COLLECTION]
+        self.users_col = db.users
+        self.bikes_col = db.bikes
+        self.racks_col = db.racks
+        self.locations_col = db.locations
+        self.auth_requests_col = db[dedup.AUTH_REQUESTS_COLLECTION]
+        # Alert state writes (rare) go through the sync client, in order, off the event loop
+        self.alert_writer = ThreadPoolExecutor(1, thread_name_prefix="alert-state")
+        ingest.zero_alerts.persist = lambda station, state: self.alert_writer.submit(
+            ingest.persist_alert_state, station, state)
+        # Same for the trip documents (one per unlock/lock)
+        self.trip_writer = ThreadPoolExecutor(1, thread_name_prefix="trips")
+        ingest.trip_builder.persist = lambda trip: self.trip_writer.submit(ingest.persist_trip, trip)
+        # And the event hub sends (blocking socket writes to the web workers)
+        self.hub_writer = ThreadPoolExecutor(1, thread_name_prefix="hub-send")
+        self.http = httpx.AsyncClient(timeout=5)
+        self.inflight = asyncio.Semaphore(INGEST_MAX_INFLIGHT)
+        self.rack_locks = [asyncio.Lock() for _ in range(RACK_LOCK_STRIPES)]  # auth requests of one rack in order
+        self.alert_order = asyncio.Lock()  # SMS tasks delivered one at a time, in order
+        self.mqtt = None
+        # Rack changes from the web API arrive on the hub thread: publish them from the loop
+        loop = asyncio.get_running_loop()
+        ingest.availability_sink = lambda changed: changed and loop.call_soon_threadsafe(
+            self.spawn, self.publish_availability(changed), "[AVAILABILITY] Publish")
+
+    async def close(self):
+        await self.http.aclose()
+        await self.mongo.close()
+        self.alert_writer.shutdown(wait=True)
+        self.trip_writer.shutdown(wait=True)
+        self.hub_writer.shutdown(wait=True)
+
+    # Run a handler as a task of the group, with backpressure on the broker loop
+    async def dispatch(self, handler, message):
+        await self.inflight.acquire()
+        self.tg.create_task(self._guarded(handler, message))
+
+    # Background side effect (retained publish, email): a failure is logged, never raised into the TaskGroup
+    def spawn(self, coro, what):
+        self.tg.create_task(self._logged(coro, what))
+
+    # Event hub send, off the loop and in order: a failure is logged
+    def hub_send(self, fn, *args, **kwargs):
+        self.hub_writer.submit(self._hub_call, fn, args, kwargs)
+
+    @staticmethod
+    def _hub_call(fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception("[HUB] %s failed: %s", fn.__name__, e)
+
+    async def _logged(self, coro, what):
+        try:
+            await coro
+        except Exception as e:
+            logger.exception("%s failed: %s", what, e)
+
+    async def _guarded(self, handler, message):
+        try:
+            await handler(message)
+        except Exception as e:
+            # Never let one message cancel the whole TaskGroup
+            logger.exception("[MQTT] Error in %s: %s", handler.__name__, e)
+        finally:
+            self.inflight.release()
+
+    # Brokers
+
+    async def consume_local(self):
+        tls = tls_context(MQTT_CA_CERT, MQTT_CLIENT_CERT, MQTT_CLIENT_KEY, check_hostname=False)
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    MQTT_BROKER, MQTT_PORT,
+                    username=MQTT_USERNAME, password=MQTT_PASSWORD,
+                    identifier=MQTT_CLIENT_ID, tls_context=tls, keepalive=60,
+                ) as client:
+                    self.mqtt = client
+                    await client.subscribe("hepl/#")
+                    await client.subscribe(AUTH_TOPIC, qos=2)  # auth messages
+                    await client.subscribe(LOCATION_TOPIC)  # location messages
+                    await client.subscribe(PARKED_TOPIC, qos=2) # bike_id rack_id station_id
+                    metrics.mqtt_connected("local")
+                    logger.info("[MQTT] Connected to %s:%s (asyncio)", MQTT_BROKER, MQTT_PORT)
+                    await self.publish_availability({}, full=True)
+                    async for message in client.messages:
+                        if message.topic.value.startswith(AVAILABILITY_TOPIC):
+                            continue  # Our own counters
+                        replay.record("local", message.topic.value, message.payload, message.qos)
+                        await self.dispatch(self.on_message, message)
+            except aiomqtt.MqttError as e:
+                logger.warning("[MQTT] Disconnected (%s), reconnecting in %ss", e, RECONNECT_SECONDS)
+            finally:
+                self.mqtt = None
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def consume_ext(self):
+        tls = tls_context(EXT_MQTT_CA_CERT, EXT_MQTT_CLIENT_CERT, EXT_MQTT_CLIENT_KEY)
+        while True:
+            try:
+                async with aiomqtt.Client(
+                    EXT_MQTT_BROKER, EXT_MQTT_PORT,
+                    identifier=EXT_MQTT_CLIENT_ID, tls_context=tls, keepalive=60,
+                ) as client:
+                    await client.subscribe(DISPONIBILITIES_TOPIC)
+                    metrics.mqtt_connected("ext")
+                    logger.info("[EXT MQTT] Connected to %s (asyncio)", EXT_MQTT_BROKER)
+                    async for message in client.messages:
+                        replay.record("ext", message.topic.value, message.payload, message.qos)
+                        await self.dispatch(self.on_message_ext, message)
+            except aiomqtt.MqttError as e:
+                logger.warning("[MQTT EXT] Disconnected (%s), reconnecting in %ss", e, RECONNECT_SECONDS)
+            await asyncio.sleep(RECONNECT_SECONDS)
+
+    # Handlers
+
+    async def on_message(self, message):
+        t0 = time.perf_counter()
+        topic = message.topic.value
+        data = decode_payload(message.payload)
+        if topic == AUTH_TOPIC:
+            await self.handle_auth_message(data)
+        elif topic == LOCATION_TOPIC:
+            if isinstance(data, dict):
+                try:
+                    await self.locations_col.insert_one({**data, "timestamp": datetime.now(BRUSSELS)})
+                except Exception as e:
+                    logger.error("[MQTT] Error inserting location data: %s", e)
+            else:
+                logger.warning("[MQTT] Error decoding JSON payload for location message")
+        await self.insert_to_mongo(topic, message.payload, data)
+        metrics.MQTT_MESSAGES.inc("local", topic)
+        metrics.MQTT_HANDLE_SECONDS.observe(time.perf_counter() - t0, "local", topic)
+
+    async def insert_to_mongo(self, topic, raw, data):
+        try:
+            col = self.telemetry_col if retention.is_capped(topic) else self.data_col
+            await col.insert_one(data_document(topic, raw, data))
+            self.hub_send(publish_ping)
+        except Exception as e:
+            logger.error("[MQTT] Error during insert: %s", e)
+
+    async def publish_reply(self, reply):
+        if self.mqtt is None:
+            logger.warning("[AUTH] Broker disconnected, reply dropped: %s", reply)
+            return reply
+        await self.mqtt.publish(AUTH_REPLY_TOPIC, json.dumps(reply), qos=2, retain=False)
+        return reply
+
+    # Same idempotency as ingest.handle_auth_message, inside the rack lock (a duplicate waits for the first)
+    @metrics.AUTH_SECONDS.time()
+    async def handle_auth_message(self, data):
+        rack_id = data.get("rack_id") if isinstance(data, dict) else None
+        lock = self.rack_locks[hash(str(rack_id)) % RACK_LOCK_STRIPES]
+        async with lock:
+            key = dedup.auth_key(data)
+            if key is not None:
+                reply = dedup.replies.get(key)
+                source = "cache"
+                if reply is None:
+                    source = "mongo"
+                    try:
+                        doc = await self.auth_requests_col.find_one({"_id": key}, {"reply": 1})
+                        reply = doc.get("reply") if doc else None
+                    except Exception as e:
+                        logger.error("[AUTH] Request lookup failed for %s: %s", key, e)
+                if reply is not None:
+                    dedup.replies.put(key, reply)
+                    metrics.AUTH_DUPLICATES.inc(source)
+                    logger.info("[AUTH] Duplicate request %s, %s reply resent", key, reply.get("reply"))
+                    await self.publish_reply(reply)
+                    return
+            reply = await self._handle_auth_message(data)
+            if key is not None and reply is not None:
+                dedup.replies.put(key, reply)
+                try:
+                    await self.auth_requests_col.insert_one(dedup.request_document(key, reply))
+                except DuplicateKeyError:
+                    pass
+                except Exception as e:
+                    logger.error("[AUTH] Could not store request %s: %s", key, e)
+
+    # Same decisions and writes as ingest.process_auth_message (returns the reply, None after an error)
+    async def _handle_auth_message(self, data):
+        now = datetime.now(BRUSSELS)
+        now_iso = now.isoformat(timespec="seconds")
+        user_id = action = rack_id = None
+
+        async def send_deny(reason=None):
+            reply = await self.publish_reply(build_auth_reply(user_id, action, rack_id, now_iso, None, "deny"))
+            if reason:
+                logger.info("[AUTH] %s → deny", reason, extra={"user_id": user_id, "rack_id": rack_id, "action": action})
+            return reply
+
+        try:
+            if not isinstance(data, dict):
+                return await send_deny("Invalid JSON payload")
+            user_id = data.get("user_id")
+            bike_id = data.get("bike_id")
+            rack_id = data.get("rack_id")
+            action = data.get("action")
+            ts_str = data.get("timestamp")
+
+            if not all([user_id, rack_id, ts_str]): # bike_id is optional for lock action
+                return await send_deny("Missing fields")
+
+            user = await self.users_col.find_one({"rfid": str(user_id)})
+            if not user:
+                return await send_deny(f"Unknown user {user_id}")
+
+            rack_doc = fleet.model.rack(rack_id) or await self.racks_col.find_one({"rack_id": str(rack_id)})
+            station_id = str(rack_doc.get("station_id")) if rack_doc else None
+
+            # Action: unlock
+            if action == "unlock":
+                update_bike = await self.bikes_col.update_one(
+                    {"bike_id": str(bike_id), "status": "available", "currentRack": str(rack_id)},
+                    {"$set": {"status": "in_use", "currentUser": str(user_id), "currentRack": None},
+                    "$push": {"history": {"action": "unlock", "user_id": str(user_id), "timestamp": now}}}
+                )
+                if update_bike.modified_count == 0:
+                    return await send_deny(f"Unlock denied for user={user_id} bike={bike_id} rack={rack_id}")
+
+                update_rack = await self.racks_col.update_one(
+                    {"rack_id": str(rack_id), "currentBike": str(bike_id)},
+                    {"$set": {"currentBike": None},
+                    "$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
+                )
+                if update_rack.modified_count == 0:
+                    await self.bikes_col.update_one(
+                        {"bike_id": str(bike_id), "status": "in_use", "currentUser": str(user_id), "currentRack": None},
+                        {"$set": {"status": "available", "currentUser": None, "currentRack": str(rack_id)},
+                        "$push": {"history": {"action": "unlock_rollback", "user_id": str(user_id), "timestamp": now}}}
+                    )
+                    self.hub_send(ingest.invalidate_cache, cache.keys("bike", str(bike_id)))
+                    return await send_deny(f"Rack update failed for rack={rack_id} bike={bike_id} [rollback ok]")
+
+                await self.users_col.update_one(
+                    {"rfid": str(user_id)},
+                    {"$push": {"history": {"bike_id": str(bike_id), "action": "unlock", "timestamp": now}}}
+                )
+                reply = await self.publish_reply(build_auth_reply(user_id, action, rack_id, now_iso, station_id, "accept"))
+                logger.info("[AUTH] Unlock accepted for user=%s bike=%s rack=%s", user_id, bike_id, rack_id)
+                self.hub_send(publish_ping)
+                self.hub_send(ingest.invalidate_cache, cache.keys("bike", str(bike_id))
+                              + cache.keys("rack", str(rack_id)) + cache.keys("user", str(user_id)))
+                await self._logged(self.publish_rack(rack_id, rack_doc.get("station_id"), False),
+                                   "[AVAILABILITY] Publish")
+                ingest.after_accept("[TRIPS] Trip event", ingest.trip_builder.event,
+                                    "unlock", user_id, bike_id, rack_id, station_id, now)
+
+                # User email notification, off the reply path
+                email = build_unlock_email(user, user_id, bike_id, rack_id, now_iso)
+                if email:
+                    self.spawn(self.send_mailtrap_email(*email), "[MAILTRAP] Unlock email")
+                return reply
+
+            # Action: lock
+            if action == "lock":
+                update_rack = await self.racks_col.update_one(
+                    {"rack_id": str(rack_id), "currentBike": None},
+                    {"$set": {"currentBike": str(bike_id)},
+                    "$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
+                )
+                await self.users_col.update_one(
+                    {"rfid": str(user_id)},
+                    {"$push": {"history": {"bike_id": str(bike_id), "action": "lock", "timestamp": now}}}
+                )
+                reply = await self.publish_reply(build_auth_reply(user_id, action, rack_id, now_iso, station_id, "accept"))
+                logger.info("[AUTH] Lock accepted for user=%s bike=%s rack=%s", user_id, bike_id, rack_id)
+                self.hub_send(publish_ping)
+                self.hub_send(ingest.invalidate_cache,
+                              cache.keys("rack", str(rack_id)) + cache.keys("user", str(user_id)))
+                if update_rack.modified_count:
+                    await self._logged(self.publish_rack(rack_id, rack_doc.get("station_id"), True),
+                                       "[AVAILABILITY] Publish")
+                ingest.after_accept("[TRIPS] Trip event", ingest.trip_builder.event,
+                                    "lock", user_id, bike_id, rack_id, station_id, now)
+                return reply
+
+            # Unknown action
+            return await send_deny(f"Unknown action '{action}'")
+
+        except Exception as e:
+            logger.info("[AUTH] Error: %s", e)
+            try:
+                await self.publish_reply(build_auth_reply(
+                    data.get("user_id") if isinstance(data, dict) else None,
+                    (data.get("type") or data.get("action")) if isinstance(data, dict) else None,
+                    data.get("rack_id") if isinstance(data, dict) else None,
+                    now_iso, None, "deny"))
+            except Exception:
+                pass
+
+    async def on_message_ext(self, message):
+        t0 = time.perf_counter()
+        payload = message.payload.decode()
+        ingest.latest_disponibilities, ingest.latest_disponibilities_count, stations = parse_disponibilities(
+            message.topic.value, payload)
+        if ingest.latest_disponibilities_count is not None and AVAILABILITY_SOURCE == "external":
+            await self.handle_disponibility_alerts(ingest.latest_disponibilities_count, stations)
+        self.hub_send(publish_disponibilities)
+        metrics.MQTT_MESSAGES.inc("ext", message.topic.value)
+        metrics.MQTT_HANDLE_SECONDS.observe(time.perf_counter() - t0, "ext", message.topic.value)
+
+    # Same as ingest.handle_disponibility_alerts / alerts_loop (state machines in ingest.zero_alerts)
+    async def handle_disponibility_alerts(self, count, stations=None):
+        now = time.time()
+        notifications = ingest.zero_alerts.observe(alerts.FLEET, count, now)
+        for station, station_count in (stations or {}).items():
+            notifications += ingest.zero_alerts.observe(station, station_count, now)
+        self.send_alerts(notifications)
+
+    # SMS in background tasks (one at a time, in order): Twilio latency never delays an auth reply or a handler
+    def send_alerts(self, notifications):
+        if notifications:
+            self.spawn(self.deliver_alerts(notifications), "[ALERT] Delivery")
+
+    async def deliver_alerts(self, notifications):
+        async with self.alert_order:
+            for kind, station, count in notifications:
+                ok = await self.twilio_send_sms(alerts.alert_text(kind, station, count, ZERO_ALERT_SECONDS))
+                if kind == "zero":
+                    ingest.zero_alerts.sent(station, ok, time.time())
+
+    # Same as ingest.publish_availability / availability_loop (counters in ingest.fleet_availability)
+    async def publish_availability(self, changed, full=False):
+        if not changed and not full:
+            return
+        if changed:
+            self.hub_send(ingest.hub.publish, ingest.availability_event(), key="availability")
+        if self.mqtt is not None:
+            for topic, payload in ingest.fleet_availability.messages(changed, full):
+                await self.mqtt.publish(topic, payload, qos=1, retain=True)
+        self.send_alerts(ingest.availability_notifications(changed))
+
+    async def publish_rack(self, rack_id, station_id, docked):
+        await self.publish_availability(ingest.fleet_availability.set_rack(rack_id, station_id, docked))
+
+    async def availability_loop(self):
+        while True:
+            try:
+                racks = await self.racks_col.find({}, availability.RACK_FIELDS).to_list()
+                await self.publish_availability(ingest.fleet_availability.load(racks))
+            except Exception as e:
+                logger.error("[AVAILABILITY] Recount failed: %s", e)
+            await asyncio.sleep(AVAILABILITY_RECONCILE_SECONDS)
+
+    async def alerts_loop(self):
+        while True:
+            await asyncio.sleep(ALERT_TICK_SECONDS)
+            try:
+                self.send_alerts(ingest.zero_alerts.tick(time.time()))
+            except Exception as e:
+                logger.exception("[ALERT] Tick failed: %s", e)
+
+    # Outbound HTTP
+
+    @metrics.notification("mailtrap")
+    async def send_mailtrap_email(self, to_email, subject, text, to_name=None):
+        if not MAILTRAP_TOKEN or not MAILTRAP_EMAIL:
+            logger.warning("[MAILTRAP] Missing MAILTRAP_TOKEN or MAILTRAP_EMAIL")
+            return False
+        try:
+            resp = await self.http.post(
+                "https://send.api.mailtrap.io/api/send",
+                headers={"Authorization": f"Bearer {MAILTRAP_TOKEN}"},
+                json={
+                    "from": {"email": MAILTRAP_EMAIL, "name": "SmartPedals"},
+                    "to": [{"email": to_email, "name": (to_name or "User")}],
+                    "subject": subject,
+                    "text": text,
+                    "category": MAILTRAP_CAT,
+                },
+            )
+            if resp.is_success:
+                logger.info("[MAILTRAP] Email sent to %s: %s", to_email, subject)
+                return True
+            logger.warning("[MAILTRAP] Send failed %s: %s", resp.status_code, resp.text)
+        except httpx.HTTPError as e:
+            logger.error("[MAILTRAP] Exception while sending email: %s", e)
+        return False
+
+    # Twilio REST API called directly (the twilio SDK client is blocking)
+    @metrics.notification("twilio")
+    async def twilio_send_sms(self, body):
+        try:
+            resp = await self.http.post(
+                f"https://api.twilio.com/2010-04-01/Accounts/{TWILIO_ACCOUNT_SID}/Messages.json",
+                auth=(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN),
+                data={"From": TWILIO_NUMBER, "To": TARGET_NUMBER, "Body": body},
+            )
+            resp.raise_for_status()
+            logger.info("[TWILIO] SMS sent: sid=%s", resp.json().get('sid'))
+            return True
+        except httpx.HTTPError as e:
+            logger.error("[TWILIO] Send error: %s", e)
+            return False
+
+"""
+Entry point (called by ingest.main when INGEST_ENGINE=asyncio)
+"""
+
+async def main():
+    # docker stop -> cancel the TaskGroup (in-flight handlers are cancelled too)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    ingest.hub.start()
+    engine = None
+    try:
+        async with asyncio.TaskGroup() as tg:
+            engine = AsyncIngest(tg)
+            tg.create_task(engine.consume_local())
+            tg.create_task(engine.consume_ext())
+            tg.create_task(engine.alerts_loop())
+            tg.create_task(engine.availability_loop())
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if engine:
+            await engine.close()
+
+def run():
+    asyncio.run(main())
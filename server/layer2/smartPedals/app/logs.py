@@ -0,0 +1,136 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+from datetime import datetime, timezone
+
+import metrics
+
+"""
+Logging for both tiers: one JSON object per line on stdout, written by a QueueListener thread.
+The caller only checks the level and enqueues the record; the message is formatted (lazily, "%s" args) by the
+listener. Identical messages (same logger and template) are rate-limited before the enqueue.
+
+    LOG_LEVEL=INFO LOG_LEVELS="smartpedals.ingest=DEBUG,pymongo=WARNING"
+"""
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "") # Per-logger overrides: name=LEVEL,name=LEVEL
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000")) # Records dropped (and counted) when full
+LOG_RATE_LIMIT = int(os.environ.get("LOG_RATE_LIMIT", "20")) # Identical messages per window, 0 = no limit
+LOG_RATE_WINDOW = float(os.environ.get("LOG_RATE_WINDOW", "10"))
+
+LOG_DROPPED = metrics.Counter("smartpedals_log_dropped_total", "Log records dropped (queue full or rate-limited)",
+                              ("reason",))
+
+# LogRecord attributes that are not user fields
+RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, process):
+        super().__init__()
+        self.process = process
+
+    def format(self, record):
+        doc = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": self.process,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        # extra={...} fields
+        for key, value in vars(record).items():
+            if key not in RESERVED:
+                doc[key] = value
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str, ensure_ascii=False)
+
+# At most LOG_RATE_LIMIT records per (logger, template) per window; the next one let through carries "suppressed"
+# Runs in every logging thread: the counters are updated under self.lock
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit, window):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.seen = {}  # (logger, template) -> [window start, count, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.limit:
+            return True
+        now = record.created
+        key = (record.name, record.msg)
+        with self.lock:
+            state = self.seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                if len(self.seen) > 10_000:
+                    self.seen.clear()
+                self.seen[key] = [now, 1, 0]
+                return True
+            state[1] += 1
+            if state[1] <= self.limit:
+                return True
+            state[2] += 1
+        LOG_DROPPED.inc("rate_limited")
+        return False
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    # The stdlib prepare() formats the message in the calling thread: keep msg/args, the listener formats them
+    # (log args must not be mutated after the call)
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc("queue_full")
+
+def parse_levels(text):
+    levels = {}
+    for part in text.split(","):
+        name, _, level = part.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+listener = None
+setup_lock = threading.Lock()
+
+# Once per process (ingest main, gunicorn post_worker_init, app.py __main__)
+def setup_logging(process):
+    global listener
+    with setup_lock:
+        if listener is not None:
+            return
+        q = queue.Queue(LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter(process))
+        listener = logging.handlers.QueueListener(q, output, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+
+        handler = LazyQueueHandler(q)
+        handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW))
+        root = logging.getLogger()
+        for h in list(root.handlers):
+            root.removeHandler(h)
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL.upper())
+        for name, level in parse_levels(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+        # Flask's app.logger and the libraries propagate to the root handler
+        logging.captureWarnings(True)
+        # Record fields the JSON lines don't use: skip the per-record getpid() and multiprocessing lookup
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
@@ -0,0 +1,249 @@
+import functools
+import inspect
+import os
+import threading
+import time
+
+from bisect import bisect_left
+
+from pymongo import monitoring
+
+"""
+Metrics in the Prometheus text exposition format, without a client library.
+An observation is one dict lookup and an in-place list increment (plus a bisect for histograms) under the metric's
+lock, a few hundred ns, so the instrumentation stays on in production. The increment needs the lock: cell[0] += value
+is a load/add/store that another thread (gthread workers, hub thread) can interleave with, losing counts.
+Every process (ingest worker, each web worker) keeps its own registry and pushes a snapshot through the event hub;
+/smartpedals/metrics renders all of them with a process label, aggregate with sum by (...) in PromQL.
+"""
+
+METRICS_PUSH_SECONDS = float(os.environ.get("METRICS_PUSH_SECONDS", "5"))
+
+# Seconds: 0.5ms .. 10s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values tuple -> [value]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, value=1):
+        cell = self.values.get(labels) or self._new(labels)
+        with self.lock:
+            cell[0] += value
+
+    def _new(self, labels):
+        with self.lock:
+            return self.values.setdefault(labels, [0])
+
+    def value(self, *labels):
+        cell = self.values.get(labels)
+        return cell[0] if cell else 0
+
+    def series(self):
+        with self.lock:
+            return [[list(k), v[0]] for k, v in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    # fn: called at snapshot time instead of set()/inc() (e.g. the size of a listener list)
+    def __init__(self, name, help, labels=(), fn=None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = [value]
+
+    def series(self):
+        if self.fn:
+            return [[list(k), v] for k, v in self.fn().items()] if self.labels else [[[], self.fn()]]
+        return super().series()
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}  # label values tuple -> [count per bucket..., count above the last bucket, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels) or self._new(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts[index] += 1
+            counts[-1] += value
+
+    def _new(self, labels):
+        with self.lock:
+            return self.values.setdefault(labels, [0] * (len(self.buckets) + 2))
+
+    # Decorator for whole functions (sync or async): observe(elapsed, *labels)
+    def time(self, *labels):
+        def decorator(f):
+            if inspect.iscoroutinefunction(f):
+                async def timed(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    try:
+                        return await f(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - t0, *labels)
+            else:
+                def timed(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    try:
+                        return f(*args, **kwargs)
+                    finally:
+                        self.observe(time.perf_counter() - t0, *labels)
+            return functools.wraps(f)(timed)
+        return decorator
+
+    def series(self):
+        with self.lock:
+            return [[list(k), list(v)] for k, v in self.values.items()]
+
+# Snapshot of this process: JSON-able, sent through the event hub
+def snapshot():
+    out = {}
+    for m in REGISTRY:
+        out[m.name] = {"type": m.kind, "help": m.help, "labels": list(m.labels), "series": m.series()}
+        if m.kind == "histogram":
+            out[m.name]["buckets"] = list(m.buckets)
+    return out
+
+# Snapshots of the other processes: process name -> (received at, snapshot)
+remote_snapshots = {}
+
+def store_remote(process, data):
+    remote_snapshots[process] = (time.time(), data)
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def label_text(names, values, extra=()):
+    pairs = [f'{n}="{escape(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render(process):
+    # Own registry is live; remote ones are dropped after 3 missed pushes (worker gone)
+    stale = time.time() - 3 * METRICS_PUSH_SECONDS
+    snapshots = {process: snapshot()}
+    for name, (received, data) in list(remote_snapshots.items()):
+        if received < stale:
+            remote_snapshots.pop(name, None)
+        elif name != process:
+            snapshots[name] = data
+
+    families = {}
+    for proc, data in sorted(snapshots.items()):
+        for name, family in data.items():
+            families.setdefault(name, (family, []))[1].append((proc, family))
+
+    lines = []
+    for name, (first, per_process) in families.items():
+        lines.append(f"# HELP {name} {first['help']}")
+        lines.append(f"# TYPE {name} {first['type']}")
+        for proc, family in per_process:
+            extra = [("process", proc)]
+            for labels, value in family["series"]:
+                if family["type"] != "histogram":
+                    lines.append(f"{name}{label_text(family['labels'], labels, extra)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(family["buckets"] + ["+Inf"], value[:-1]):
+                    cumulative += count
+                    le = extra + [("le", bound)]
+                    lines.append(f"{name}_bucket{label_text(family['labels'], labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{label_text(family['labels'], labels, extra)} {value[-1]}")
+                lines.append(f"{name}_count{label_text(family['labels'], labels, extra)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+# Push this process' snapshot every METRICS_PUSH_SECONDS: send(event) is hub.publish or EventSubscriber.send
+def start_push(process, send):
+    def loop():
+        while True:
+            time.sleep(METRICS_PUSH_SECONDS)
+            try:
+                send({"type": "metrics", "process": process, "metrics": snapshot()})
+            except Exception:
+                pass
+    threading.Thread(target=loop, daemon=True).start()
+
+"""
+Metrics shared by the web tier and the ingest worker
+"""
+
+MQTT_MESSAGES = Counter("smartpedals_mqtt_messages_total", "MQTT messages received", ("broker", "topic"))
+MQTT_HANDLE_SECONDS = Histogram("smartpedals_mqtt_handle_seconds", "MQTT message handling time", ("broker", "topic"))
+MQTT_RECONNECTS = Counter("smartpedals_mqtt_reconnects_total", "MQTT connections after the first one", ("broker",))
+AUTH_SECONDS = Histogram("smartpedals_auth_handle_seconds", "handle_auth_message time (request to reply)")
+AUTH_REPLIES = Counter("smartpedals_auth_replies_total", "Auth replies published", ("action", "reply"))
+AUTH_DUPLICATES = Counter("smartpedals_auth_duplicates_total", "Auth requests answered from an earlier reply",
+                          ("source",))
+FLEET_READS = Counter("smartpedals_fleet_reads_total", "Fleet lookups served from the read model or Mongo",
+                      ("collection", "source"))
+TRIPS = Counter("smartpedals_trips_total", "Trip documents written (open: trip started)", ("status",))
+CACHE_REQUESTS = Counter("smartpedals_response_cache_requests_total", "Response cache lookups", ("result",))
+CACHE_EVICTIONS = Counter("smartpedals_response_cache_evictions_total", "Response cache entries dropped", ("reason",))
+CACHE_INVALIDATIONS = Counter("smartpedals_response_cache_invalidations_total", "Response cache keys invalidated")
+HTTP_SECONDS = Histogram("smartpedals_http_request_seconds", "Flask route time (to the first byte for streams)",
+                         ("method", "route"))
+HTTP_REQUESTS = Counter("smartpedals_http_requests_total", "Flask requests", ("method", "route", "status"))
+MONGO_SECONDS = Histogram("smartpedals_mongo_command_seconds", "MongoDB command time", ("command",))
+MONGO_FAILURES = Counter("smartpedals_mongo_command_failures_total", "Failed MongoDB commands", ("command",))
+NOTIFY_SECONDS = Histogram("smartpedals_notification_seconds", "Outbound notification call time", ("channel",))
+NOTIFY_FAILURES = Counter("smartpedals_notification_failures_total", "Notifications not sent", ("channel",))
+
+# MQTT connects per broker: the first one is not a reconnect
+mqtt_connects = {}
+
+def mqtt_connected(broker):
+    if mqtt_connects.get(broker):
+        MQTT_RECONNECTS.inc(broker)
+    mqtt_connects[broker] = mqtt_connects.get(broker, 0) + 1
+
+# Senders returning True/False (send_mailtrap_email, twilio_send_sms): time every call, count the False ones
+def notification(channel):
+    def decorator(f):
+        if inspect.iscoroutinefunction(f):
+            async def counted(*args, **kwargs):
+                ok = await f(*args, **kwargs)
+                if not ok:
+                    NOTIFY_FAILURES.inc(channel)
+                return ok
+        else:
+            def counted(*args, **kwargs):
+                ok = f(*args, **kwargs)
+                if not ok:
+                    NOTIFY_FAILURES.inc(channel)
+                return ok
+        return NOTIFY_SECONDS.time(channel)(functools.wraps(f)(counted))
+    return decorator
+
+# pymongo command monitoring (sync and async clients): durations come with the succeeded/failed events
+class MongoCommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        MONGO_SECONDS.observe(event.duration_micros / 1e6, event.command_name)
+        MONGO_FAILURES.inc(event.command_name)
+
+mongo_listener = MongoCommandMetrics()
@@ -0,0 +1,139 @@
+import cProfile
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter, defaultdict
+
+"""
+On-demand profiler for one bounded window, output as collapsed stacks ("a;b;c value" lines, flamegraph.pl / speedscope).
+- sample: a thread snapshots every thread's stack at `hz` (value = samples). Nothing runs outside the window.
+- cprofile: every `every`-th call of the hooked entry points (Flask wsgi_app, MQTT on_message) runs under cProfile
+  (value = microseconds). The hooks are installed for the window only and the original callables restored after.
+"""
+
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MAX_HZ = 1000
+
+window = threading.Lock()  # One window at a time per process
+
+class ProfilerBusy(Exception):
+    pass
+
+def code_label(filename, name):
+    return f"{os.path.basename(filename)}:{name}"
+
+# Thread names without their counters, so that pool threads merge (ThreadPoolExecutor-0_3 -> ThreadPoolExecutor-N_N)
+def thread_label(name):
+    return re.sub(r"\d+", "N", name)
+
+def sample_stacks(seconds, hz):
+    stacks = Counter()
+    me = threading.get_ident()
+    interval = 1 / hz
+    deadline = time.perf_counter() + seconds
+    next_tick = time.perf_counter()
+    while next_tick < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(code_label(frame.f_code.co_filename, frame.f_code.co_qualname))
+                frame = frame.f_back
+            frames.append(thread_label(names.get(ident, "unknown")))
+            stacks[";".join(reversed(frames))] += 1
+        next_tick += interval
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return stacks
+
+# Runs every `every`-th call under one shared cProfile.Profile (one profiled call at a time)
+class CallProfiler:
+    def __init__(self, every):
+        self.every = max(1, every)
+        self.calls = 0
+        self.profile = cProfile.Profile()
+        self.busy = threading.Lock()
+
+    def wrap(self, f):
+        def profiled(*args, **kwargs):
+            self.calls += 1
+            if self.calls % self.every or not self.busy.acquire(blocking=False):
+                return f(*args, **kwargs)
+            try:
+                return self.profile.runcall(f, *args, **kwargs)
+            finally:
+                self.busy.release()
+        return profiled
+
+    # pstats caller graph -> collapsed stacks: a function's own time is split over its callers
+    # in proportion to the time spent under each of them
+    def stacks(self):
+        self.profile.create_stats()
+        stats = self.profile.stats  # func -> (cc, nc, tt, ct, callers)
+        callees = defaultdict(dict)
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller, edge in callers.items():
+                callees[caller][func] = edge[3]
+        out = Counter()
+
+        def visit(func, path, seen, budget):
+            _, _, tt, ct, _ = stats[func]
+            share = budget / ct if ct else 0
+            path = path + [code_label(func[0], func[2])]
+            out[";".join(path)] += tt * share
+            for callee, edge_ct in callees[func].items():
+                if callee not in seen and edge_ct * share > 1e-6:
+                    visit(callee, path, seen | {callee}, edge_ct * share)
+
+        for func, (_, _, _, ct, callers) in stats.items():
+            if not callers:
+                visit(func, [], {func}, ct)
+        return Counter({stack: round(t * 1e6) for stack, t in out.items() if round(t * 1e6) > 0})
+
+# One window. install(wrap) hooks the entry points and returns the function that restores them (cprofile mode).
+def run(mode, seconds, hz=100, every=10, install=None):
+    seconds = min(float(seconds), PROFILE_MAX_SECONDS)
+    if not window.acquire(blocking=False):
+        raise ProfilerBusy("a profiling window is already running")
+    try:
+        if mode == "sample":
+            return sample_stacks(seconds, min(max(float(hz), 1), PROFILE_MAX_HZ))
+        if mode == "cprofile":
+            if install is None:
+                raise ValueError("cprofile mode is not available in this process")
+            profiler = CallProfiler(int(every))
+            uninstall = install(profiler.wrap)
+            try:
+                time.sleep(seconds)
+            finally:
+                uninstall()
+            # Let a call that started inside the window finish
+            with profiler.busy:
+                return profiler.stacks()
+        raise ValueError(f"unknown mode '{mode}'")
+    finally:
+        window.release()
+
+# Event-hub request handler (both tiers): profile this process and send the stacks back with `send`
+def run_requested(event, process, send, install=None):
+    def job():
+        result = {"type": "profile_result", "id": event["id"], "process": process}
+        try:
+            result["stacks"] = run(event["mode"], event["seconds"], event.get("hz", 100), event.get("every", 10), install)
+        except (ProfilerBusy, ValueError) as e:
+            result["error"] = str(e)
+        send(result)
+    threading.Thread(target=job, daemon=True).start()
+
+def collapsed(stacks_by_process):
+    lines = []
+    for process, stacks in sorted(stacks_by_process.items()):
+        for stack, value in sorted(stacks.items()):
+            lines.append(f"{process};{stack} {value}")
+    return "\n".join(lines) + "\n"
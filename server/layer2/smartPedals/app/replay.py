@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+import argparse
+import atexit
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+
+from collections import namedtuple
+
+"""
+MQTT traffic recorder and replayer.
+The ingest appends every received message to MQTT_RECORD_FILE (both engines, receive order):
+    file   = b"SPMQ\\x01" record*
+    record = <d received (epoch s)> <B source (0 local, 1 ext)> <B qos> <H topic length> <I payload length> topic payload
+A truncated last record (crash) is ignored on read.
+
+The replayer feeds a recording back in recorded order (so per-topic order is kept) at 1x, Nx or max speed,
+either to the ingest handlers in-process (on_message / on_message_ext, real Mongo writes) or to the local broker:
+
+    python3 replay.py mqtt.rec --target handlers --speed max
+    python3 replay.py mqtt.rec --target broker --speed 10 --topics hepl/auth,hepl/parked
+"""
+
+MQTT_RECORD_FILE = os.environ.get("MQTT_RECORD_FILE", "") # Recording is off when empty
+MQTT_RECORD_MAX_MB = int(os.environ.get("MQTT_RECORD_MAX_MB", "1024")) # Recording stops at this size
+RECORD_FLUSH_SECONDS = 1
+
+MAGIC = b"SPMQ\x01"
+HEADER = struct.Struct("<dBBHI")
+SOURCES = ("local", "ext")
+SOURCE_CODES = {name: code for code, name in enumerate(SOURCES)}
+
+Record = namedtuple("Record", "received source topic payload qos")
+
+logger = logging.getLogger("smartpedals.replay")
+
+"""
+Recording
+"""
+
+class Recorder:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = open(path, "ab", buffering=1 << 16)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.size = self.file.tell()
+        self.full = False
+
+    def record(self, source, topic, payload, qos):
+        topic = topic.encode()
+        rec = HEADER.pack(time.time(), SOURCE_CODES[source], qos, len(topic), len(payload)) + topic + payload
+        with self.lock:
+            if self.full:
+                return
+            if self.size + len(rec) > self.max_bytes:
+                self.full = True
+                logger.warning("[RECORD] %s reached %d MB, recording stopped", self.path, self.max_bytes >> 20)
+                return
+            self.file.write(rec)
+            self.size += len(rec)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+recorder = None
+
+def start_recording(path=MQTT_RECORD_FILE, max_mb=MQTT_RECORD_MAX_MB):
+    global recorder
+    if not path or recorder is not None:
+        return
+    recorder = Recorder(path, max_mb << 20)
+    def flush_loop():
+        while True:
+            time.sleep(RECORD_FLUSH_SECONDS)
+            recorder.flush()
+    threading.Thread(target=flush_loop, name="mqtt-recorder", daemon=True).start()
+    atexit.register(recorder.close)
+    logger.info("[RECORD] Recording MQTT traffic to %s (%d bytes already)", path, recorder.size)
+
+# Called by the ingest for every received message; no-op unless recording
+def record(source, topic, payload, qos):
+    if recorder is not None:
+        recorder.record(source, topic, payload, qos)
+
+def read_records(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an MQTT recording")
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            received, source, qos, topic_len, payload_len = HEADER.unpack(header)
+            body = f.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len:
+                return
+            yield Record(received, SOURCES[source], body[:topic_len].decode(), body[topic_len:], qos)
+
+"""
+Replay
+"""
+
+# Deliver records in order; speed 0 = as fast as possible, else recorded gaps divided by speed
+def replay(records, deliver, speed=1.0):
+    first = None
+    late = 0.0
+    count = 0
+    t0 = time.perf_counter()
+    for rec in records:
+        if speed:
+            if first is None:
+                first = rec.received
+            delay = (rec.received - first) / speed - (time.perf_counter() - t0)
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late = max(late, -delay)
+        deliver(rec)
+        count += 1
+    elapsed = time.perf_counter() - t0
+    return {"messages": count, "seconds": round(elapsed, 3), "msg_per_s": round(count / elapsed) if elapsed else None,
+            "max_late_ms": round(late * 1000, 1) if speed else None}
+
+# Stands in for the paho client passed to the handlers: auth replies are counted, not sent
+class ReplyCounter:
+    def __init__(self):
+        self.replies = {}
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.replies[topic] = self.replies.get(topic, 0) + 1
+
+def handlers_target():
+    import paho.mqtt.client as mqtt
+    import ingest
+    client = ReplyCounter()
+    handlers = {"local": ingest.on_message, "ext": ingest.on_message_ext}
+    def deliver(rec):
+        msg = mqtt.MQTTMessage(topic=rec.topic.encode())
+        msg.payload = rec.payload
+        msg.qos = rec.qos
+        handlers[rec.source](client, None, msg)
+    return deliver, lambda: {"replies": client.replies}
+
+def broker_target():
+    import paho.mqtt.client as mqtt
+    import ingest
+    c = mqtt.Client(client_id=f"{ingest.MQTT_CLIENT_ID}-replay")
+    c.username_pw_set(username=ingest.MQTT_USERNAME, password=ingest.MQTT_PASSWORD)
+    c.tls_set(ca_certs=ingest.MQTT_CA_CERT, certfile=ingest.MQTT_CLIENT_CERT, keyfile=ingest.MQTT_CLIENT_KEY,
+              tls_version=ingest.ssl.PROTOCOL_TLSv1_2)
+    c.tls_insecure_set(True)
+    c.connect(ingest.MQTT_BROKER, ingest.MQTT_PORT, 60)
+    c.loop_start()
+    last = []
+    def deliver(rec):
+        info = c.publish(rec.topic, rec.payload, qos=rec.qos)
+        last[:] = [info]
+    def finish():
+        if last:
+            last[0].wait_for_publish(timeout=30)
+        c.loop_stop()
+        c.disconnect()
+        return {}
+    return deliver, finish
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded MQTT traffic.")
+    parser.add_argument("file")
+    parser.add_argument("--target", default="handlers", choices=("handlers", "broker"))
+    parser.add_argument("--speed", default="1", help="Multiplier (1, 10, 0.5) or 'max'.")
+    parser.add_argument("--topics", help="Comma-separated topics to replay (default: all).")
+    parser.add_argument("--source", choices=SOURCES, help="Only local or ext messages.")
+    parser.add_argument("--limit", type=int, help="Stop after N messages.")
+    args = parser.parse_args(argv)
+
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    topics = set(args.topics.split(",")) if args.topics else None
+    # ext messages come from the external broker: republishing them locally would not reach the ingest
+    source = "local" if args.target == "broker" else args.source
+
+    def selected():
+        n = 0
+        for rec in read_records(args.file):
+            if (topics and rec.topic not in topics) or (source and rec.source != source):
+                continue
+            if args.limit is not None and n >= args.limit:
+                return
+            n += 1
+            yield rec
+
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), stream=sys.stderr)
+    deliver, finish = handlers_target() if args.target == "handlers" else broker_target()
+    result = replay(selected(), deliver, speed)
+    result.update(finish())
+    print(json.dumps({"file": args.file, "target": args.target, "speed": args.speed, **result}, indent=2))
+
+if __name__ == "__main__":
+    main()
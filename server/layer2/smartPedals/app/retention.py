@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import re
+import sys
+
+from datetime import datetime, timedelta, timezone
+
+"""
+Raw MQTT data retention (data_col):
+- per-topic TTL: the ingest sets expire_at on every document, a TTL index (expireAfterSeconds=0) deletes it
+- pure telemetry topics can go to a capped collection instead (oldest documents overwritten)
+- both collections are created with zstd block compression (only applies at creation)
+
+    python3 retention.py apply [--dry-run] [--backfill]
+    python3 retention.py report [--days 7] [--json]
+"""
+
+# topic=duration list, "*" for every other topic; durations like 30d, 12h, 45m or seconds. Empty: keep forever
+DATA_RETENTION = os.environ.get("DATA_RETENTION", "")
+# Topics written to the capped telemetry collection instead of data_col
+DATA_CAPPED_TOPICS = os.environ.get("DATA_CAPPED_TOPICS", "")
+DATA_CAPPED_SIZE_MB = int(os.environ.get("DATA_CAPPED_SIZE_MB", "256"))
+DATA_CAPPED_MAX_DOCS = int(os.environ.get("DATA_CAPPED_MAX_DOCS", "0")) # 0: size limit only
+DATA_COMPRESSOR = os.environ.get("DATA_COMPRESSOR", "zstd") # zstd, snappy, zlib or none
+
+DATA_COLLECTION = "data"
+TELEMETRY_COLLECTION = "data_telemetry"
+TTL_INDEX = "expire_at_ttl"
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+def parse_duration(text):
+    m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*", text)
+    if not m:
+        raise ValueError(f"Invalid duration '{text}'")
+    return float(m.group(1)) * DURATION_UNITS[m.group(2) or "s"]
+
+def parse_retention(text):
+    retention = {}
+    for part in text.split(","):
+        topic, _, duration = part.partition("=")
+        if topic.strip() and duration.strip():
+            retention[topic.strip()] = parse_duration(duration)
+    return retention
+
+RETENTION = parse_retention(DATA_RETENTION)
+CAPPED_TOPICS = {t.strip() for t in DATA_CAPPED_TOPICS.split(",") if t.strip()}
+
+def retention_seconds(topic):
+    return RETENTION.get(topic, RETENTION.get("*"))
+
+# expire_at of a document received now on topic, None when the topic is kept forever
+def expire_at(topic, now):
+    seconds = retention_seconds(topic)
+    return now + timedelta(seconds=seconds) if seconds else None
+
+def is_capped(topic):
+    return topic in CAPPED_TOPICS
+
+def storage_options():
+    return {"wiredTiger": {"configString": f"block_compressor={DATA_COMPRESSOR}"}}
+
+# Create the collections (compressed, capped) and the TTL index; returns the actions (not run with dry_run)
+def ensure_collections(db, dry_run=False):
+    actions = []
+    existing = set(db.list_collection_names())
+    if DATA_COLLECTION not in existing:
+        actions.append((f"create {DATA_COLLECTION} (block_compressor={DATA_COMPRESSOR})",
+                        lambda: db.create_collection(DATA_COLLECTION, storageEngine=storage_options())))
+    if CAPPED_TOPICS and TELEMETRY_COLLECTION not in existing:
+        capped = {"capped": True, "size": DATA_CAPPED_SIZE_MB * 1024 * 1024}
+        if DATA_CAPPED_MAX_DOCS:
+            capped["max"] = DATA_CAPPED_MAX_DOCS
+        actions.append((f"create {TELEMETRY_COLLECTION} (capped {DATA_CAPPED_SIZE_MB} MB, "
+                        f"max {DATA_CAPPED_MAX_DOCS or 'unlimited'} docs, block_compressor={DATA_COMPRESSOR}) "
+                        f"for {sorted(CAPPED_TOPICS)}",
+                        lambda: db.create_collection(TELEMETRY_COLLECTION, storageEngine=storage_options(), **capped)))
+    if DATA_COLLECTION not in existing or TTL_INDEX not in db[DATA_COLLECTION].index_information():
+        actions.append((f"create TTL index {TTL_INDEX} on {DATA_COLLECTION}.expire_at",
+                        lambda: db[DATA_COLLECTION].create_index("expire_at", expireAfterSeconds=0, name=TTL_INDEX)))
+    if not dry_run:
+        for _, action in actions:
+            action()
+    return [description for description, _ in actions]
+
+# Documents stored before retention was configured: expire_at from their insertion time (ObjectId)
+def backfill_expire_at(db, dry_run=False):
+    col = db[DATA_COLLECTION]
+    missing = {"expire_at": {"$exists": False}}
+    results = []
+    topics = col.distinct("topic", missing)
+    for topic in topics:
+        seconds = retention_seconds(topic)
+        if not seconds:
+            continue
+        query = {**missing, "topic": topic}
+        count = col.count_documents(query)
+        if not dry_run:
+            col.update_many(query, [{"$set": {"expire_at": {
+                "$add": [{"$toDate": "$_id"}, int(seconds * 1000)]}}}])
+        results.append(f"backfill expire_at on {count} {topic} documents (+{seconds:g}s)")
+    return results
+
+def collection_stats(db, name):
+    try:
+        stats = db.command("collStats", name)
+    except Exception:
+        return None
+    m = re.search(r"block_compressor=(\w*)", stats.get("wiredTiger", {}).get("creationString", ""))
+    return {
+        "documents": stats.get("count", 0),
+        "data_bytes": stats.get("size", 0),
+        "storage_bytes": stats.get("storageSize", 0),
+        "index_bytes": stats.get("totalIndexSize", 0),
+        "capped": bool(stats.get("capped")),
+        "max_bytes": stats.get("maxSize"),
+        "compressor": (m.group(1) or "none") if m else None,
+    }
+
+# Size per topic and growth over the last `days` (insertion time from the ObjectId)
+def topic_report(db, name, days):
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    rows = db[name].aggregate([
+        {"$group": {
+            "_id": "$topic",
+            "documents": {"$sum": 1},
+            "bytes": {"$sum": {"$bsonSize": "$$ROOT"}},
+            "recent": {"$sum": {"$cond": [{"$gte": [{"$toDate": "$_id"}, since]}, 1, 0]}},
+            "oldest": {"$min": {"$toDate": "$_id"}},
+        }},
+        {"$sort": {"bytes": -1}},
+    ])
+    topics = []
+    for row in rows:
+        avg = row["bytes"] / row["documents"] if row["documents"] else 0
+        per_day = row["recent"] / days
+        seconds = retention_seconds(row["_id"]) if name == DATA_COLLECTION else None
+        topics.append({
+            "topic": row["_id"],
+            "documents": row["documents"],
+            "bytes": row["bytes"],
+            "avg_doc_bytes": round(avg),
+            "oldest": row["oldest"].isoformat() if row["oldest"] else None,
+            "docs_per_day": round(per_day, 1),
+            "growth_bytes_per_day": round(per_day * avg),
+            "retention_days": round(seconds / 86400, 2) if seconds else None,
+            # Size once the TTL keeps up: ingest rate x retention (None = grows forever)
+            "steady_state_bytes": round(per_day * avg * seconds / 86400) if seconds else None,
+        })
+    return topics
+
+def report(db, days):
+    out = {"generated": datetime.now(timezone.utc).isoformat(timespec="seconds"), "window_days": days,
+           "retention": RETENTION, "capped_topics": sorted(CAPPED_TOPICS), "collections": {}}
+    for name in (DATA_COLLECTION, TELEMETRY_COLLECTION):
+        stats = collection_stats(db, name)
+        if stats is None:
+            continue
+        topics = topic_report(db, name, days)
+        stats["growth_bytes_per_day"] = sum(t["growth_bytes_per_day"] for t in topics)
+        out["collections"][name] = {**stats, "topics": topics}
+    return out
+
+def human(n):
+    if n is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+def print_report(data):
+    print(f"Window: last {data['window_days']} days, retention: {data['retention'] or 'none'}, "
+          f"capped topics: {data['capped_topics'] or 'none'}")
+    for name, col in data["collections"].items():
+        print(f"\n{name}: {col['documents']} docs, data {human(col['data_bytes'])}, "
+              f"storage {human(col['storage_bytes'])} ({col['compressor']}), indexes {human(col['index_bytes'])}"
+              + (f", capped at {human(col['max_bytes'])}" if col["capped"] else "")
+              + f", growth {human(col['growth_bytes_per_day'])}/day")
+        print(f"  {'topic':<28}{'docs':>10}{'size':>12}{'avg':>9}{'docs/day':>11}{'growth/day':>12}"
+              f"{'retention':>11}{'steady':>12}")
+        for t in col["topics"]:
+            retention = f"{t['retention_days']:g}d" if t["retention_days"] else "forever"
+            print(f"  {str(t['topic']):<28}{t['documents']:>10}{human(t['bytes']):>12}{human(t['avg_doc_bytes']):>9}"
+                  f"{t['docs_per_day']:>11}{human(t['growth_bytes_per_day']):>12}{retention:>11}"
+                  f"{human(t['steady_state_bytes']):>12}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartPedals raw data retention.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    apply_cmd = sub.add_parser("apply", help="Create the compressed/capped collections and the TTL index.")
+    apply_cmd.add_argument("--dry-run", action="store_true")
+    apply_cmd.add_argument("--backfill", action="store_true", help="Set expire_at on documents stored without one.")
+    report_cmd = sub.add_parser("report", help="Size per topic and projected growth.")
+    report_cmd.add_argument("--days", type=float, default=7, help="Growth measured over this window.")
+    report_cmd.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    from common import init_db
+    db = init_db()[1]
+    if args.command == "apply":
+        actions = ensure_collections(db, dry_run=args.dry_run)
+        if args.backfill:
+            actions += backfill_expire_at(db, dry_run=args.dry_run)
+        for action in actions or ["nothing to do"]:
+            print(("[dry-run] " if args.dry_run else "") + action)
+        if DATA_COLLECTION in db.list_collection_names():
+            stats = collection_stats(db, DATA_COLLECTION)
+            if stats and stats["compressor"] not in (None, DATA_COMPRESSOR):
+                print(f"note: {DATA_COLLECTION} already exists with block_compressor={stats['compressor']}, "
+                      f"compression only applies to new collections (dump/restore to change it)")
+    else:
+        data = report(db, args.days)
+        if args.json:
+            json.dump(data, sys.stdout, indent=2, default=str)
+            print()
+        else:
+            print_report(data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import json
+import sys
+
+from collections import namedtuple
+from datetime import datetime
+
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import OperationFailure
+
+# YAML topologies, optional
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import cache
+from common import BRUSSELS, EVENTS_SOCKET
+from events import send_once
+
+"""
+Declarative fleet topology: stations -> racks -> docked bikes, from one file, synced to the stations/racks/bikes
+collections with the minimal set of writes (an unchanged topology writes nothing).
+
+    JSON/YAML: {"stations": [{"station_id": "S1", "name": "Gare", "racks": [{"rack_id": "R1", "bike": "B1"},
+                                                                          "R2"]}]}
+               Racks can be plain ids (empty rack) and bikes plain ids or objects ({"bike_id": "B1", ...}).
+               Extra fields of a station, rack or bike are set as given (and only those are compared).
+    CSV:       station_id,station_name,rack_id,bike_id (one row per rack, empty rack_id for a station without racks)
+
+Writes are grouped per station (station, its racks and the bikes docked there) and each group is applied in one
+transaction (replica set; applied without one on a standalone mongod). Bikes in use (currentUser set) are never
+moved nor deleted. Entries missing from the file are deleted unless --keep-extra.
+
+    python3 topology.py sync fleet.yaml --dry-run
+    python3 topology.py sync fleet.csv [--keep-extra] [--json]
+"""
+
+COLLECTIONS = ("stations", "racks", "bikes")
+KEYS = {"stations": "station_id", "racks": "rack_id", "bikes": "bike_id"}
+NO_STATION = ""  # Group of the bikes left without a rack
+
+# One planned write: group = station_id of the transaction, changes = {field: (before, after)}
+Change = namedtuple("Change", "group collection op key changes write")
+
+class TopologyError(ValueError):
+    pass
+
+"""
+Reading
+"""
+
+def read_topology(path):
+    if path.endswith(".csv"):
+        with open(path, newline="") as f:
+            return parse_csv(f)
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise TopologyError("YAML topologies need the PyYAML package (or use JSON/CSV)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+def parse_csv(f):
+    stations = {}
+    for n, row in enumerate(csv.DictReader(f), start=2):
+        station_id = (row.get("station_id") or "").strip()
+        if not station_id:
+            raise TopologyError(f"line {n}: missing station_id")
+        station = stations.setdefault(station_id, {"station_id": station_id, "racks": []})
+        if (row.get("station_name") or "").strip():
+            station["name"] = row["station_name"].strip()
+        rack_id = (row.get("rack_id") or "").strip()
+        if rack_id:
+            station["racks"].append({"rack_id": rack_id, "bike": (row.get("bike_id") or "").strip() or None})
+    return {"stations": list(stations.values())}
+
+# Topology -> target documents {collection: {id: fields}}, managed fields only
+def target_state(topology):
+    if not isinstance(topology, dict) or not isinstance(topology.get("stations"), list):
+        raise TopologyError("Expected a top-level 'stations' list")
+    target = {name: {} for name in COLLECTIONS}
+    for station in topology["stations"]:
+        station_id = station.get("station_id") if isinstance(station, dict) else None
+        if not station_id:
+            raise TopologyError(f"Station without station_id: {station!r}")
+        if station_id in target["stations"]:
+            raise TopologyError(f"Duplicate station '{station_id}'")
+        rack_ids = []
+        for rack in station.get("racks") or []:
+            rack = {"rack_id": rack} if isinstance(rack, str) else dict(rack)
+            rack_id = rack.pop("rack_id", None)
+            if not rack_id:
+                raise TopologyError(f"Rack without rack_id in station '{station_id}'")
+            if rack_id in target["racks"]:
+                raise TopologyError(f"Duplicate rack '{rack_id}'")
+            bike = rack.pop("bike", None)
+            bike = {"bike_id": bike} if isinstance(bike, str) else (dict(bike) if bike else None)
+            if bike is not None:
+                bike_id = bike.pop("bike_id", None)
+                if not bike_id:
+                    raise TopologyError(f"Bike without bike_id on rack '{rack_id}'")
+                if bike_id in target["bikes"]:
+                    raise TopologyError(f"Bike '{bike_id}' docked on two racks")
+                target["bikes"][bike_id] = {**bike, "currentRack": rack_id}
+            target["racks"][rack_id] = {**rack, "station_id": station_id,
+                                        "currentBike": bike_id if bike is not None else None}
+            rack_ids.append(rack_id)
+        extra = {k: v for k, v in station.items() if k not in ("station_id", "racks")}
+        target["stations"][station_id] = {**extra, "racks": rack_ids}
+    return target
+
+def current_state(db, target):
+    current = {}
+    for name in COLLECTIONS:
+        fields = {field for doc in target[name].values() for field in doc}
+        projection = {KEYS[name]: 1, **{field: 1 for field in fields}}
+        if name == "bikes":
+            projection.update(status=1, currentUser=1, currentRack=1)
+        current[name] = {doc[KEYS[name]]: doc for doc in db[name].find({}, projection)}
+    return current
+
+"""
+Plan
+"""
+
+def history(bike_id, action, now):
+    return {"bike_id": bike_id, "action": action, "timestamp": now}
+
+def plan(target, current, now, keep_extra=False):
+    changes, conflicts = [], []
+    bikes_in_use = {b: doc.get("currentUser") for b, doc in current["bikes"].items() if doc.get("currentUser")}
+
+    # Docking a bike that is out with a user: leave both the rack and the bike as they are
+    undocked = [b for b in target["bikes"] if b in bikes_in_use]
+    for bike_id in undocked:
+        rack_id = target["bikes"].pop(bike_id)["currentRack"]
+        target["racks"][rack_id]["currentBike"] = current["racks"].get(rack_id, {}).get("currentBike")
+        conflicts.append(f"bike {bike_id} is in use by {bikes_in_use[bike_id]}, not docked on {rack_id}")
+
+    def station_of(rack_id):
+        rack = target["racks"].get(rack_id) or current["racks"].get(rack_id) or {}
+        return rack.get("station_id") or NO_STATION
+
+    def diff(want, have):
+        return {f: (have.get(f), v) for f, v in want.items() if have.get(f) != v}
+
+    for station_id, want in target["stations"].items():
+        have = current["stations"].get(station_id)
+        if have is None:
+            changes.append(Change(station_id, "stations", "insert", station_id, {},
+                                  InsertOne({"station_id": station_id, **want})))
+        elif fields := diff(want, have):
+            changes.append(Change(station_id, "stations", "update", station_id, fields,
+                                  UpdateOne({"station_id": station_id}, {"$set": {f: v[1] for f, v in fields.items()}})))
+
+    for rack_id, want in target["racks"].items():
+        have = current["racks"].get(rack_id)
+        bike_id = want["currentBike"]
+        if have is None:
+            doc = {"rack_id": rack_id, **want, "history": [history(bike_id, "dock", now)] if bike_id else []}
+            changes.append(Change(want["station_id"], "racks", "insert", rack_id, {}, InsertOne(doc)))
+        elif fields := diff(want, have):
+            update = {"$set": {f: v[1] for f, v in fields.items()}}
+            if "currentBike" in fields:
+                old = fields["currentBike"][0]
+                update["$push"] = {"history": {"$each": ([history(old, "undock", now)] if old else [])
+                                                        + ([history(bike_id, "dock", now)] if bike_id else [])}}
+            changes.append(Change(want["station_id"], "racks", "update", rack_id, fields,
+                                  UpdateOne({"rack_id": rack_id}, update)))
+
+    for bike_id, want in target["bikes"].items():
+        have = current["bikes"].get(bike_id)
+        group = station_of(want["currentRack"])
+        if have is None:
+            doc = {"bike_id": bike_id, "status": "available", "currentUser": None, **want, "history": []}
+            changes.append(Change(group, "bikes", "insert", bike_id, {}, InsertOne(doc)))
+        elif fields := diff(want, have):
+            changes.append(Change(group, "bikes", "update", bike_id, fields,
+                                  UpdateOne({"bike_id": bike_id}, {"$set": {f: v[1] for f, v in fields.items()}})))
+
+    # --keep-extra: bikes kept off the file lose a rack the file gives to another bike, racks kept off the file
+    # lose a bike the file docks elsewhere
+    if keep_extra:
+        for rack_id, have in current["racks"].items():
+            bike_id = have.get("currentBike")
+            if not bike_id:
+                continue
+            if rack_id in target["racks"] and bike_id not in target["bikes"] and bike_id in current["bikes"] \
+                    and target["racks"][rack_id]["currentBike"] != bike_id:
+                changes.append(Change(station_of(rack_id), "bikes", "update", bike_id, {"currentRack": (rack_id, None)},
+                                      UpdateOne({"bike_id": bike_id}, {"$set": {"currentRack": None}})))
+            elif rack_id not in target["racks"] and bike_id in target["bikes"]:
+                changes.append(Change(station_of(rack_id), "racks", "update", rack_id, {"currentBike": (bike_id, None)},
+                                      UpdateOne({"rack_id": rack_id}, {"$set": {"currentBike": None},
+                                                                       "$push": {"history": history(bike_id, "undock", now)}})))
+
+    if not keep_extra:
+        for name in COLLECTIONS:
+            for ident, have in current[name].items():
+                if ident in target[name]:
+                    continue
+                if name == "bikes" and ident in bikes_in_use:
+                    if ident not in undocked:
+                        conflicts.append(f"bike {ident} is in use by {bikes_in_use[ident]}, not deleted")
+                    continue
+                if name == "stations":
+                    group = ident
+                elif name == "racks":
+                    group = have.get("station_id") or NO_STATION
+                else:
+                    group = station_of(have.get("currentRack")) if have.get("currentRack") else NO_STATION
+                changes.append(Change(group, name, "delete", ident, {}, DeleteOne({KEYS[name]: ident})))
+    return changes, conflicts
+
+def summary(changes):
+    counts = {}
+    for c in changes:
+        counts.setdefault(c.collection, {}).setdefault(c.op, 0)
+        counts[c.collection][c.op] += 1
+    return counts
+
+def print_plan(changes, conflicts):
+    marks = {"insert": "+", "update": "~", "delete": "-"}
+    for c in sorted(changes, key=lambda c: (c.group, COLLECTIONS.index(c.collection), c.key)):
+        detail = ", ".join(f"{f}: {before!r} -> {after!r}" for f, (before, after) in c.changes.items())
+        print(f"{marks[c.op]} {c.collection[:-1]} {c.key}" + (f" ({detail})" if detail else "")
+              + (f" [station {c.group}]" if c.group and c.collection != "stations" else ""))
+    for conflict in conflicts:
+        print(f"! {conflict}")
+    print(f"{len(changes)} write(s): {json.dumps(summary(changes))}" if changes else "Up to date, nothing to write")
+
+"""
+Apply
+"""
+
+# Transactions need a replica set / mongos: IllegalOperation (20) on a standalone mongod
+def transactions_unsupported(error):
+    return error.code == 20 or "Transaction numbers" in str(error)
+
+def apply(client, db, changes):
+    groups = {}
+    for c in changes:
+        groups.setdefault(c.group, {name: [] for name in COLLECTIONS})[c.collection].append(c.write)
+    use_transactions = True
+    for group, ops in sorted(groups.items(), key=lambda g: (g[0] == NO_STATION, g[0])):
+        def write(session=None):
+            for name in COLLECTIONS:
+                if ops[name]:
+                    db[name].bulk_write(ops[name], ordered=True, session=session)
+        if use_transactions:
+            try:
+                with client.start_session() as session:
+                    session.with_transaction(write)
+                continue
+            except OperationFailure as e:
+                if not transactions_unsupported(e):
+                    raise
+                print("note: transactions unavailable (standalone mongod), applying without", file=sys.stderr)
+                use_transactions = False
+        write()
+    return len(groups)
+
+# Tell the running web workers and ingest (availability counters, response cache), when they are up
+def notify(changes):
+    racks = sorted({c.key for c in changes if c.collection == "racks"}
+                   | {c.changes["currentRack"][0] for c in changes
+                      if c.collection == "bikes" and c.changes.get("currentRack", (None,))[0]})
+    keys = [cache.key(c.collection[:-1], c.key) for c in changes]
+    return send_once(EVENTS_SOCKET, [{"type": "racks_changed", "racks": racks}, {"type": "cache_invalidate", "keys": keys}])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartPedals fleet topology import/sync.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_cmd = sub.add_parser("sync", help="Make stations/racks/bikes match a topology file.")
+    sync_cmd.add_argument("file", help="Topology (.json, .yaml/.yml or .csv).")
+    sync_cmd.add_argument("--dry-run", action="store_true", help="Print the plan, write nothing.")
+    sync_cmd.add_argument("--keep-extra", action="store_true", help="Keep entries that are not in the file.")
+    sync_cmd.add_argument("--json", action="store_true", help="Print the plan as JSON.")
+    args = parser.parse_args(argv)
+
+    try:
+        target = target_state(read_topology(args.file))
+    except (OSError, ValueError) as e:
+        parser.exit(2, f"{args.file}: {e}\n")
+
+    from common import init_db
+    client, db = init_db()[:2]
+    changes, conflicts = plan(target, current_state(db, target), datetime.now(BRUSSELS), args.keep_extra)
+    if args.json:
+        json.dump({"dry_run": args.dry_run, "summary": summary(changes), "conflicts": conflicts,
+                   "changes": [{"station": c.group, "collection": c.collection, "op": c.op, "id": c.key,
+                                "fields": c.changes} for c in changes]}, sys.stdout, indent=2, default=str)
+        print()
+    else:
+        print_plan(changes, conflicts)
+    if changes and not args.dry_run:
+        groups = apply(client, db, changes)
+        notified = notify(changes)
+        print(f"Applied in {groups} station group(s)" + ("" if notified else " (ingest not reachable, "
+              "availability catches up at its next recount)"), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import json
+import os
+import sys
+import threading
+
+from datetime import datetime, timezone
+from itertools import groupby
+from operator import itemgetter
+
+from pymongo import ReplaceOne
+
+import metrics
+from common import BRUSSELS, EVENTS_SOCKET
+from events import send_once
+
+"""
+Trips: each accepted unlock paired with the next lock of the same bike (of the same user when the lock carries
+no bike_id), one document per trip in the trips collection:
+    {"trip_id": "<bike_id>@<unlock time>", "bike_id", "user_id", "status",
+     "start": {"rack_id", "station_id", "timestamp"}, "end": {...} or null, "duration_s"}
+status: open (ridden), closed (paired), missing_lock (the bike was unlocked again before any lock) or
+missing_unlock (lock without an open trip, start is null). The same event twice in a row is ignored.
+
+The ingest worker feeds TripBuilder with its auth decisions as they are taken (no history scan) and restores the
+open trips on start. Existing history is processed once with the backfill command: the lock/unlock entries of the
+racks and users histories (joined on bike, action and time, as the auth path writes them with the same timestamp),
+read in time order through aggregation cursors and written in batches. Documents are keyed by trip_id, so running
+it again rewrites the same trips.
+
+    python3 trips.py backfill [--since 2025-01-01] [--until 2025-06-01] [--batch 1000] [--dry-run] [--json]
+"""
+
+TRIPS_COLLECTION = "trips"
+TRIPS_BATCH = int(os.environ.get("TRIPS_BATCH", "1000")) # Backfill: cursor batch size and trips per bulk write
+ACTIONS = ("unlock", "lock")
+
+def ensure_indexes(db):
+    col = db[TRIPS_COLLECTION]
+    col.create_index("trip_id", unique=True, name="trip_id_unique")
+    col.create_index([("bike_id", 1), ("start.timestamp", -1)], name="bike_start")
+    col.create_index([("user_id", 1), ("start.timestamp", -1)], name="user_start")
+    col.create_index("status", name="status", partialFilterExpression={"status": "open"})
+
+# Mongo gives naive UTC datetimes back, the auth path aware Brussels ones: compare in aware UTC, at the
+# millisecond precision of BSON dates (a backfilled trip gets the trip_id the ingest worker gave it)
+def as_utc(ts):
+    ts = ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+    return ts.replace(microsecond=ts.microsecond // 1000 * 1000)
+
+# "None"/"" ids (lock payloads without a bike) -> None
+def known(value):
+    return None if value in (None, "", "None") else str(value)
+
+class TripBuilder:
+    def __init__(self, persist=None):
+        self.persist = persist or (lambda trip: None)
+        self.open_by_bike = {}  # bike_id -> open trip
+        self.open_by_user = {}  # user_id -> last open trip (locks without bike_id)
+        self.last = {}          # bike_id (or "user:<id>") -> (action, timestamp) of its last event
+        self.lock = threading.Lock()
+
+    # Open trips from the trips collection; a newer open trip already known for the bike wins
+    def load(self, docs):
+        with self.lock:
+            for doc in docs:
+                doc["start"]["timestamp"] = as_utc(doc["start"]["timestamp"])
+                current = self.open_by_bike.get(doc["bike_id"])
+                if current and current["start"]["timestamp"] >= doc["start"]["timestamp"]:
+                    continue
+                doc.pop("_id", None)
+                self.open_by_bike[doc["bike_id"]] = doc
+                if doc.get("user_id"):
+                    self.open_by_user[doc["user_id"]] = doc
+                self.last[doc["bike_id"]] = ("unlock", doc["start"]["timestamp"])
+            return len(self.open_by_bike)
+
+    # One accepted unlock/lock; returns the trip documents written (each also given to persist)
+    def event(self, action, user_id, bike_id, rack_id, station_id, timestamp):
+        if action not in ACTIONS:
+            return []
+        user_id, bike_id, ts = known(user_id), known(bike_id), as_utc(timestamp)
+        place = {"rack_id": known(rack_id), "station_id": known(station_id), "timestamp": ts}
+        with self.lock:
+            key = bike_id or f"user:{user_id}"
+            if self.last.get(key) == (action, ts):
+                return []
+            self.last[key] = (action, ts)
+            written = []
+            if action == "unlock":
+                if bike_id is None:
+                    return []
+                previous = self._close(self.open_by_bike.get(bike_id))
+                if previous:
+                    previous["status"] = "missing_lock"
+                    written.append(previous)
+                trip = {"trip_id": f"{bike_id}@{ts.isoformat()}", "bike_id": bike_id, "user_id": user_id,
+                        "status": "open", "start": place, "end": None, "duration_s": None}
+                self.open_by_bike[bike_id] = trip
+                if user_id:
+                    self.open_by_user[user_id] = trip
+                written.append(trip)
+            else:
+                trip = self.open_by_bike.get(bike_id) if bike_id else None
+                trip = trip or (self.open_by_user.get(user_id) if user_id else None)
+                if trip and trip["start"]["timestamp"] <= ts:
+                    self._close(trip)
+                    trip.update(status="closed", end=place,
+                                duration_s=round((ts - trip["start"]["timestamp"]).total_seconds(), 3))
+                else:
+                    trip = {"trip_id": f"{key}@lock:{ts.isoformat()}", "bike_id": bike_id, "user_id": user_id,
+                            "status": "missing_unlock", "start": None, "end": place, "duration_s": None}
+                written.append(trip)
+            for trip in written:
+                metrics.TRIPS.inc(trip["status"])
+                self.persist(dict(trip))
+            return written
+
+    def _close(self, trip):
+        if trip is None:
+            return None
+        self.open_by_bike.pop(trip["bike_id"], None)
+        if trip.get("user_id") and self.open_by_user.get(trip["user_id"]) is trip:
+            del self.open_by_user[trip["user_id"]]
+        return trip
+
+    def open_count(self):
+        return len(self.open_by_bike)
+
+"""
+Backfill
+"""
+
+# Lock/unlock entries of one history array, in time order (server-side sort, spilled to disk when large)
+def history_events(col, id_field, as_field, since=None, until=None, batch=TRIPS_BATCH):
+    when = {"$type": "date"}
+    if since:
+        when["$gte"] = since
+    if until:
+        when["$lt"] = until
+    pipeline = [
+        {"$match": {"history.action": {"$in": list(ACTIONS)}}},
+        {"$unwind": "$history"},
+        {"$match": {"history.action": {"$in": list(ACTIONS)}, "history.timestamp": when}},
+        {"$project": {"_id": 0, as_field: f"${id_field}", "bike_id": "$history.bike_id",
+                      "action": "$history.action", "timestamp": "$history.timestamp"}},
+        {"$sort": {"timestamp": 1}},
+    ]
+    return col.aggregate(pipeline, allowDiskUse=True, batchSize=batch)
+
+# Racks (rack_id) and users (user_id) entries merged: one event per (time, bike, action)
+def history(db, since=None, until=None, batch=TRIPS_BATCH):
+    merged = heapq.merge(history_events(db.racks, "rack_id", "rack_id", since, until, batch),
+                         history_events(db.users, "rfid", "user_id", since, until, batch),
+                         key=itemgetter("timestamp"))
+    for _, group in groupby(merged, key=itemgetter("timestamp")):
+        events = {}
+        for entry in group:
+            events.setdefault((str(entry.get("bike_id")), entry["action"]), {}).update(entry)
+        yield from events.values()
+
+def write(col, pending):
+    if pending:
+        col.bulk_write([ReplaceOne({"trip_id": t["trip_id"]}, t, upsert=True) for t in pending.values()],
+                       ordered=False)
+        pending.clear()
+
+def backfill(db, since=None, until=None, batch=TRIPS_BATCH, dry_run=False):
+    col = db[TRIPS_COLLECTION]
+    station_of = {r["rack_id"]: r.get("station_id") for r in db.racks.find({}, {"_id": 0, "rack_id": 1, "station_id": 1})}
+    pending = {}  # trip_id -> latest state (an open trip closed in the same batch is written once)
+    builder = TripBuilder(persist=lambda trip: pending.__setitem__(trip["trip_id"], trip))
+    if since:
+        builder.load(col.find({"status": "open", "start.timestamp": {"$lt": since}}))
+    counts = {"events": 0, "started": 0, "closed": 0, "missing_lock": 0, "missing_unlock": 0}
+    for event in history(db, since, until, batch):
+        counts["events"] += 1
+        rack_id = event.get("rack_id")
+        for trip in builder.event(event["action"], event.get("user_id"), event.get("bike_id"), rack_id,
+                                  station_of.get(rack_id), event["timestamp"]):
+            counts["started" if trip["status"] == "open" else trip["status"]] += 1
+        if len(pending) >= batch:
+            if not dry_run:
+                write(col, pending)
+            pending.clear()
+    if not dry_run:
+        write(col, pending)
+    counts["open"] = builder.open_count()
+    return counts
+
+def parse_time(value):
+    ts = datetime.fromisoformat(value)
+    return (ts if ts.tzinfo else ts.replace(tzinfo=BRUSSELS)).astimezone(timezone.utc)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SmartPedals trips.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill_cmd = sub.add_parser("backfill", help="Build the trips of the existing history.")
+    backfill_cmd.add_argument("--since", type=parse_time, help="ISO time (Brussels when naive); open trips before it are kept.")
+    backfill_cmd.add_argument("--until", type=parse_time, help="ISO time (Brussels when naive).")
+    backfill_cmd.add_argument("--batch", type=int, default=TRIPS_BATCH)
+    backfill_cmd.add_argument("--dry-run", action="store_true", help="Pair the events, write nothing.")
+    backfill_cmd.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    from common import init_db
+    db = init_db()[1]
+    if not args.dry_run:
+        ensure_indexes(db)
+    result = backfill(db, args.since, args.until, args.batch, args.dry_run)
+    # The ingest worker reloads the open trips (it only knows the ones it opened itself)
+    result["ingest_notified"] = not args.dry_run and send_once(EVENTS_SOCKET, [{"type": "trips_reload"}])
+    if args.json:
+        json.dump({"dry_run": args.dry_run, **result}, sys.stdout, indent=2)
+        print()
+    else:
+        print(("[dry-run] " if args.dry_run else "") + f"{result['events']} event(s): {result['started']} trip(s) started, "
+              f"{result['closed']} closed, {result['missing_lock']} without lock, {result['missing_unlock']} lock(s) "
+              f"without unlock, {result['open']} still open"
+              + ("" if args.dry_run or result["ingest_notified"] else " (ingest not reachable: restart it to pick up "
+                 "the open trips)"))
+
+if __name__ == "__main__":
+    main()
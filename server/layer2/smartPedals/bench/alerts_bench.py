@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import random
+import time
+
+from harness import run_metadata, write_report
+
+import alerts
+
+"""
+Zero-availability alert bookkeeping for N stations (user-040):
+- observe: ZeroAlerts.observe() for random 0 / >0 counts (arm + cancel in the timer wheel)
+- tick: one 1 s advance of the wheel with N pending deadlines spread over ZERO_ALERT_SECONDS
+- heap: the same arm/cancel pattern on a heapq with lazy deletion, for comparison
+
+    python3 alerts_bench.py --stations 1000,10000,100000
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Timer wheel cost of the per-station alerts.")
+    p.add_argument("--stations", default="1000,10000,100000")
+    p.add_argument("--ops", type=int, default=200_000)
+    p.add_argument("--delay", type=int, default=15 * 60)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def bench_observe(n, ops, delay, rng):
+    za = alerts.ZeroAlerts(delay, 0.0)
+    stations = [f"station-{i}" for i in range(n)]
+    updates = [(rng.choice(stations), rng.choice((0, 0, 1, 3))) for _ in range(ops)]
+    t0 = time.perf_counter()
+    for i, (station, count) in enumerate(updates):
+        za.observe(station, count, i * 0.001)
+    return (time.perf_counter() - t0) / ops
+
+def bench_tick(n, delay, rng):
+    za = alerts.ZeroAlerts(delay, 0.0)
+    for i in range(n):
+        za.observe(f"station-{i}", 0, rng.uniform(0, delay))
+    t0 = time.perf_counter()
+    fired = 0
+    for second in range(1, delay + 1):
+        fired += len(za.tick(float(delay + second)))
+    return (time.perf_counter() - t0) / delay, fired
+
+def bench_heap(n, ops, delay, rng):
+    heap, live = [], {}
+    stations = [f"station-{i}" for i in range(n)]
+    updates = [(rng.choice(stations), rng.choice((0, 0, 1, 3))) for _ in range(ops)]
+    t0 = time.perf_counter()
+    for i, (station, count) in enumerate(updates):
+        now = i * 0.001
+        if count == 0:
+            if station not in live:
+                live[station] = now + delay
+                heapq.heappush(heap, (now + delay, station))
+        else:
+            live.pop(station, None)
+        while heap and heap[0][0] <= now:
+            heapq.heappop(heap)
+    return (time.perf_counter() - t0) / ops
+
+def main():
+    args = parse_args()
+    results = {}
+    for n in (int(s) for s in args.stations.split(",")):
+        rng = random.Random(args.seed)
+        observe = bench_observe(n, args.ops, args.delay, rng)
+        tick, fired = bench_tick(n, args.delay, rng)
+        heap = bench_heap(n, args.ops, args.delay, rng)
+        results[n] = {"observe_ns": round(observe * 1e9), "heap_observe_ns": round(heap * 1e9),
+                      "tick_us": round(tick * 1e6, 1), "fired": fired}
+    write_report({"meta": run_metadata(benchmark="alerts", ops=args.ops, delay=args.delay), "results": results},
+                 args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from harness import (
+    InProcessBroker, latency_summary, open_db, quiet_stdout, run_metadata, seed_fleet,
+    start_ingest_consumer, start_mosquitto, wait_connected, wire_ingest, write_report,
+)
+from auth_payload import MQTT_AUTH_REPLY_TOPIC, MQTT_AUTH_TOPIC, build_auth_payload
+
+"""
+Auth round-trip latency: send hepl/auth requests built like the layer3 test buttons and time each one
+until its hepl/auth_reply comes back, at increasing request rates. A reply later than --timeout counts
+as a timeout, like the rack giving up. The layer2 lock path only updates the rack (the bike update is
+commented out), so unlocking a re-docked bike is denied: look at by_action when comparing runs.
+
+    python3 auth_latency.py --broker mosquitto --mongo mongomock --rates 5,20,50,100 --out before.json
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Layer2 auth round-trip latency benchmark.")
+    p.add_argument("--broker", default="mosquitto",
+                   help="'inprocess' (no network), 'mosquitto' (spawn a local one) or host:port.")
+    p.add_argument("--mongo", default="mongomock", help="'mongomock', 'spawn' (local mongod) or a mongodb:// URL.")
+    p.add_argument("--ingest", default="inprocess",
+                   help="'inprocess' (thread engine, on the benchmark broker) or 'external' (an ingest worker "
+                        "already subscribed to the broker, seeded with the same --mongo).")
+    p.add_argument("--rates", default="5,10,25,50,100", help="Offered auth requests/s, one stage each.")
+    p.add_argument("--duration", type=float, default=10.0, help="Seconds per stage.")
+    p.add_argument("--timeout", type=float, default=1.0, help="Seconds before a request counts as timed out.")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--racks", type=int, default=50)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+# One outstanding request per rack, like a real rack waiting on its reply. A rack that timed out is
+# retired for the rest of the run so a late reply can't be matched to a newer request.
+class AuthTracker:
+    def __init__(self, racks, rack_bikes, users, seed=None):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.rack_bikes = dict(rack_bikes)
+        self.free = set(racks)
+        self.retired = set()
+        self.riding = []  # bikes unlocked during the run, docked again by the next lock
+        self.pending = {}  # rack_id -> (user_id, action, bike_id, sent_at)
+        self.results = []  # (action, outcome, latency_s)
+        self.late = 0
+        self.lock = threading.Lock()
+
+    def next_request(self):
+        with self.lock:
+            if not self.free:
+                return None
+            rack_id = self.rng.choice(sorted(self.free))
+            self.free.discard(rack_id)
+            bike_id = self.rack_bikes.get(rack_id)
+            if bike_id:
+                action = "unlock"
+            else:
+                action = "lock"
+                bike_id = self.riding.pop() if self.riding else f"bench-bike-x{self.rng.randrange(10_000)}"
+            user_id = self.rng.choice(self.users)
+            self.pending[rack_id] = (user_id, action, bike_id, time.perf_counter())
+            return build_auth_payload(action, user_id=user_id, rack_id=rack_id, bike_id=bike_id)
+
+    def on_reply(self, payload):
+        now = time.perf_counter()
+        reply = json.loads(payload)
+        rack_id = reply.get("rack_id")
+        with self.lock:
+            req = self.pending.get(rack_id)
+            if not req or req[0] != reply.get("user_id"):
+                self.late += 1
+                return
+            del self.pending[rack_id]
+            user_id, action, bike_id, sent_at = req
+            outcome = reply.get("reply")
+            if outcome == "accept":
+                if action == "unlock":
+                    self.rack_bikes[rack_id] = None
+                    self.riding.append(bike_id)
+                else:
+                    self.rack_bikes[rack_id] = bike_id
+            elif action == "lock" and not bike_id.startswith("bench-bike-x"):
+                self.riding.append(bike_id)
+            self.results.append((action, outcome, now - sent_at))
+            self.free.add(rack_id)
+
+    def expire(self, timeout):
+        now = time.perf_counter()
+        with self.lock:
+            for rack_id, (_, action, _, sent_at) in list(self.pending.items()):
+                if now - sent_at > timeout:
+                    del self.pending[rack_id]
+                    self.retired.add(rack_id)
+                    self.results.append((action, "timeout", None))
+
+def summarize(results):
+    answered = [r for r in results if r[1] != "timeout"]
+    return {
+        "requests": len(results),
+        "accept": sum(1 for r in results if r[1] == "accept"),
+        "deny": sum(1 for r in results if r[1] == "deny"),
+        "timeout": sum(1 for r in results if r[1] == "timeout"),
+        **latency_summary([r[2] for r in answered]),
+    }
+
+def run_stage(send, tracker, rate, duration, timeout):
+    start = len(tracker.results)
+    busy = 0
+    t0 = time.perf_counter()
+    total = int(rate * duration)
+    for i in range(total):
+        target = t0 + i / rate
+        while True:
+            delay = target - time.perf_counter()
+            tracker.expire(timeout)
+            if delay <= 0:
+                break
+            time.sleep(min(delay, 0.01))
+        payload = tracker.next_request()
+        if payload is None:
+            busy += 1  # every rack is still waiting on its reply
+            continue
+        send(json.dumps(payload))
+    send_end = time.perf_counter()
+
+    while tracker.pending and time.perf_counter() < send_end + timeout + 0.1:
+        tracker.expire(timeout)
+        time.sleep(0.01)
+    tracker.expire(timeout)
+
+    results = tracker.results[start:]
+    return {
+        "offered_req_per_s": rate,
+        "duration_s": duration,
+        "skipped_all_racks_busy": busy,
+        "racks_retired": len(tracker.retired),
+        **summarize(results),
+        "by_action": {action: summarize([r for r in results if r[0] == action]) for action in ("unlock", "lock")},
+    }
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import ingest
+
+    mongo_proc, db = open_db(args.mongo)
+    broker_proc = None
+    clients = []
+    try:
+        wire_ingest(ingest, db)
+        ingest.send_mailtrap_email = lambda **kwargs: None  # The seeded users have no email; never hit Mailtrap
+        racks, rack_bikes = seed_fleet(db, users=args.users, racks=args.racks)
+        users = [f"bench-user-{i}" for i in range(args.users)]
+        tracker = AuthTracker(racks, rack_bikes, users, seed=args.seed)
+
+        if args.broker == "inprocess":
+            if args.ingest != "inprocess":
+                sys.exit("--broker inprocess needs --ingest inprocess")
+            on_publish = lambda topic, payload: topic == MQTT_AUTH_REPLY_TOPIC and tracker.on_reply(payload)
+            broker = InProcessBroker(ingest.on_message, on_publish)
+            send = lambda payload: broker.publish(MQTT_AUTH_TOPIC, payload.encode(), 1)
+        else:
+            if args.broker == "mosquitto":
+                broker_proc, host, port = start_mosquitto()
+            else:
+                host, _, port = args.broker.partition(":")
+                port = int(port or 1883)
+            if args.ingest == "inprocess":
+                clients.append(start_ingest_consumer(ingest, host, port))
+            # Rack side: publish requests, listen for replies (same QoS as layer3 publish_auth)
+            rack = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="bench-racks")
+            rack.on_connect = lambda c, u, f, rc, p: c.subscribe(MQTT_AUTH_REPLY_TOPIC, qos=1)
+            rack.on_message = lambda c, u, msg: tracker.on_reply(msg.payload)
+            rack.connect(host, port, 60)
+            rack.loop_start()
+            clients.append(rack)
+            wait_connected(*clients)
+            send = lambda payload: rack.publish(MQTT_AUTH_TOPIC, payload, qos=1)
+
+        report = {"meta": run_metadata(benchmark="auth_latency", broker=args.broker, mongo=args.mongo,
+                                       ingest=args.ingest, timeout_s=args.timeout), "stages": []}
+        for rate in [float(r) for r in args.rates.split(",")]:
+            stage = run_stage(send, tracker, rate, args.duration, args.timeout)
+            report["stages"].append(stage)
+            print(f"[BENCH] {rate:.0f} req/s -> p50={stage['p50_ms']}ms p99={stage['p99_ms']}ms, "
+                  f"accept={stage['accept']} deny={stage['deny']} timeout={stage['timeout']}",
+                  file=sys.stderr, flush=True)
+        report["late_or_unmatched_replies"] = tracker.late
+        write_report(report, args.out)
+    finally:
+        for client in clients:
+            client.loop_stop()
+            client.disconnect()
+        for proc in (broker_proc, mongo_proc):
+            if proc:
+                proc.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from harness import open_db, quiet_stdout, run_metadata, write_report
+
+"""
+Provisioning a site through the REST API (user-044): N racks (RACKS_PER_STATION per station) and one bike per
+other rack, with the single-item routes (one request per item) vs the _bulk routes (one request per kind).
+Runs the Flask app in-process (test client) against --mongo (a real server: mongomock's bulk_write does not take
+the UpdateOne of pymongo 4.13).
+
+    python3 bulk_bench.py --racks 1000,10000 --mongo spawn
+"""
+
+RACKS_PER_STATION = 20
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Single vs bulk provisioning.")
+    p.add_argument("--mongo", default="spawn", help="'spawn' (local mongod) or a mongodb:// URL.")
+    p.add_argument("--racks", default="1000,10000", help="Comma-separated rack counts.")
+    p.add_argument("--single-max", type=int, default=2000, help="Skip the single-route run above this many racks.")
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def site(n, prefix):
+    stations = [{"station_id": f"{prefix}-station-{s}", "name": f"Bench {s}", "racks": []}
+                for s in range((n + RACKS_PER_STATION - 1) // RACKS_PER_STATION)]
+    racks = [{"rack_id": f"{prefix}-rack-{r}", "station_id": f"{prefix}-station-{r // RACKS_PER_STATION}",
+              "currentBike": None, "history": []} for r in range(n)]
+    bikes = [{"bike_id": f"{prefix}-bike-{r}", "currentRack": f"{prefix}-rack-{r}", "currentUser": None,
+              "history": []} for r in range(0, n, 2)]
+    return stations, racks, bikes
+
+def wire(web, db):
+    for name in ("users", "bikes", "racks", "stations"):
+        setattr(web, f"{name}_col", db[name])
+    web.events.start = lambda: None
+    web.events.send = lambda event: None
+    web.fleet.model.mode = "off"
+
+def provision_single(client, headers, stations, racks, bikes):
+    for path, items in (("stations", stations), ("racks", racks), ("bikes", bikes)):
+        for item in items:
+            r = client.post(f"/smartpedals/api/{path}", json=item, headers=headers)
+            assert r.status_code == 201, r.get_data()
+
+def provision_bulk(client, headers, stations, racks, bikes):
+    for path, items in (("stations", stations), ("racks", racks), ("bikes", bikes)):
+        r = client.post(f"/smartpedals/api/{path}/_bulk", json=items, headers=headers)
+        assert r.status_code == 201, r.get_json()["counts"]
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import app as web
+    headers = {"x-api-key": web.SMARTPEDALS_API_KEY}
+    client = web.app.test_client()
+    results = {}
+    for n in (int(r) for r in args.racks.split(",")):
+        row = {}
+        for mode, provision in (("single", provision_single), ("bulk", provision_bulk)):
+            if mode == "single" and n > args.single_max:
+                continue
+            proc, db = open_db(args.mongo, name=f"smartpedals_bench_{mode}")
+            try:
+                wire(web, db)
+                stations, racks, bikes = site(n, mode)
+                t0 = time.perf_counter()
+                provision(client, headers, stations, racks, bikes)
+                elapsed = time.perf_counter() - t0
+                docked = db.racks.count_documents({"currentBike": {"$ne": None}})
+                row[mode] = {"seconds": round(elapsed, 2), "items_per_s": round((n + len(bikes) + len(stations)) / elapsed),
+                             "docked": docked}
+            finally:
+                if proc:
+                    proc.terminate()
+        results[n] = row
+    write_report({"meta": run_metadata(benchmark="bulk", mongo=args.mongo), "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import time
+
+from harness import run_metadata, write_report
+
+import compress
+
+"""
+Response compression (user-047): bytes saved and CPU cost per MB of input for the payloads the API serves,
+per encoding and level:
+- locations: GET /api/locations page (JSON list, one-shot compression),
+- bikes: GET /api/bikes page with rack history,
+- sse: support job events compressed as a stream with a flush after every event (what the client receives),
+  vs the same events compressed as one buffered body.
+brotli rows need the Brotli package (app/requirements.txt).
+
+    python3 compress_bench.py --docs 1000,10000 --levels gzip:1,gzip:6,br:4,br:5
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Compression ratio and CPU per MB.")
+    p.add_argument("--docs", default="1000,10000", help="Comma-separated documents per list response.")
+    p.add_argument("--events", type=int, default=500, help="SSE events per stream.")
+    p.add_argument("--levels", default="gzip:1,gzip:6,gzip:9,br:4,br:5,br:7",
+                   help="Comma-separated encoding:level (gzip level or brotli quality).")
+    p.add_argument("--repeat", type=int, default=5, help="Best of N timings.")
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def locations(n):
+    return json.dumps([{"bike_id": f"bike-{i % 500}", "type": "location", "timestamp": f"2025-01-01T{i // 3600 % 24:02d}:"
+                        f"{i // 60 % 60:02d}:{i % 60:02d}+00:00", "satellites": i % 12,
+                        "coordinates": {"lat": round(50.6 + i % 1000 / 1e5, 6), "lon": round(5.5 + i % 700 / 1e5, 6)}}
+                       for i in range(n)]).encode()
+
+def bikes(n):
+    return json.dumps([{"id": f"66a1{i:020x}", "bike_id": f"bike-{i}", "currentRack": f"rack-{i % 300}",
+                        "currentUser": None if i % 3 else f"user-{i % 100}",
+                        "history": [{"rack_id": f"rack-{(i + h) % 300}", "action": "dock" if h % 2 else "undock",
+                                     "timestamp": f"2025-01-{1 + h % 28:02d}T08:{h % 60:02d}:00+01:00"}
+                                    for h in range(10)]} for i in range(n)]).encode()
+
+def sse_events(n):
+    steps = ("queued", "scanning", "collecting", "uploading", "running")
+    return [f"data: {json.dumps({'step': steps[i % len(steps)], 'message': f'job step {i}', 'progress': i % 100})}\n\n"
+            .encode() for i in range(n)]
+
+def set_level(encoding, level):
+    if encoding == "br":
+        compress.COMPRESS_BROTLI_QUALITY = level
+    else:
+        compress.COMPRESS_GZIP_LEVEL = level
+
+def one_shot(data, encoding):
+    c = compress.Compressor(encoding)
+    return c.compress(data) + c.finish()
+
+def flushed(events, encoding):
+    c = compress.Compressor(encoding)
+    return sum(len(c.compress(e) + c.flush()) for e in events) + len(c.finish())
+
+def best_cpu(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.process_time()
+        result = fn()
+        elapsed = time.process_time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def row(size_in, size_out, cpu):
+    return {"bytes_in": size_in, "bytes_out": size_out, "ratio": round(size_in / size_out, 2),
+            "saved_pct": round(100 * (1 - size_out / size_in), 1), "cpu_ms_per_mb": round(cpu * 1000 / (size_in / 1e6), 2)}
+
+def main():
+    args = parse_args()
+    levels = []
+    for spec in args.levels.split(","):
+        encoding, level = spec.split(":")
+        if encoding == "br" and compress.brotli is None:
+            continue
+        levels.append((encoding, int(level)))
+    results = {}
+    for name, build in (("locations", locations), ("bikes", bikes)):
+        for n in (int(d) for d in args.docs.split(",")):
+            data = build(n)
+            for encoding, level in levels:
+                set_level(encoding, level)
+                cpu, out = best_cpu(lambda: one_shot(data, encoding), args.repeat)
+                results.setdefault(f"{name}/{n}", {})[f"{encoding}:{level}"] = row(len(data), len(out), cpu)
+    events = sse_events(args.events)
+    size_in = sum(len(e) for e in events)
+    body = b"".join(events)
+    for encoding, level in levels:
+        set_level(encoding, level)
+        cpu, size_out = best_cpu(lambda: flushed(events, encoding), args.repeat)
+        flushed_row = row(size_in, size_out, cpu)
+        flushed_row["bytes_per_event"] = round(size_out / len(events), 1)
+        cpu, out = best_cpu(lambda: one_shot(body, encoding), args.repeat)
+        results.setdefault(f"sse/{args.events}", {})[f"{encoding}:{level}"] = {
+            "flushed": flushed_row, "buffered": row(size_in, len(out), cpu),
+            "raw_bytes_per_event": round(size_in / len(events), 1)}
+    write_report({"meta": run_metadata(benchmark="compress", docs=args.docs, events=args.events,
+                                       brotli=compress.brotli is not None, min_bytes=compress.COMPRESS_MIN_BYTES),
+                  "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import tracemalloc
+
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+
+from harness import run_metadata, write_report
+
+import export
+
+"""
+Export throughput and memory of export.stream() for growing row counts (user-037). Documents come from a
+synthetic cursor (data_col shape, hepl/location payloads) so only the export side is measured:
+peak traced memory should not depend on the number of rows.
+
+    python3 export_bench.py --rows 100000,1000000 --format ndjson.gz
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Memory/throughput of the streaming export.")
+    p.add_argument("--rows", default="100000,1000000", help="Comma-separated row counts.")
+    p.add_argument("--format", default="ndjson.gz", choices=export.FORMATS)
+    p.add_argument("--batch", type=int, default=export.EXPORT_BATCH_ROWS)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+class SyntheticCollection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def find(self, query, sort=None, batch_size=None):
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        for i in range(self.rows):
+            ts = start + timedelta(seconds=i)
+            yield {"_id": ObjectId(), "topic": "hepl/location", "ts": ts,
+                   "expire_at": ts + timedelta(days=7),
+                   "payload": {"bike_id": f"bike-{i % 500}", "type": "location", "timestamp": ts.isoformat(),
+                               "satellites": i % 12, "coordinates": {"lat": 50.6 + i % 1000 / 1e5,
+                                                                     "lon": 5.5 + i % 700 / 1e5}}}
+
+def main():
+    args = parse_args()
+    export.check_format(args.format)
+    results = {}
+    for rows in (int(r) for r in args.rows.split(",")):
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        size = 0
+        for chunk in export.stream(SyntheticCollection(rows), {}, args.format, args.batch):
+            size += len(chunk)
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[rows] = {
+            "seconds": round(elapsed, 2),
+            "rows_per_s": round(rows / elapsed),
+            "output_mb": round(size / 1e6, 1),
+            "bytes_per_row": round(size / rows, 1),
+            "peak_traced_mb": round(peak / 1e6, 1),
+        }
+    write_report({"meta": run_metadata(benchmark="export", format=args.format, batch_rows=args.batch),
+                  "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
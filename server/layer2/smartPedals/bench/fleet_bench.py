@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+from harness import open_db, run_metadata, seed_fleet, write_report
+
+import fleet
+
+"""
+Hot fleet lookups (user-042): find_one on the racks/bikes collections vs the in-process read model (fleet.py),
+plus the model load time. With --mongo spawn or a URL the Mongo side includes the round trip.
+
+    python3 fleet_bench.py --mongo spawn --racks 1000 --lookups 20000
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Read model vs Mongo lookups.")
+    p.add_argument("--mongo", default="mongomock", help="'mongomock', 'spawn' (local mongod) or a mongodb:// URL.")
+    p.add_argument("--racks", type=int, default=1000)
+    p.add_argument("--lookups", type=int, default=20_000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def timed(fn, keys):
+    t0 = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return round((time.perf_counter() - t0) / len(keys) * 1e6, 2)
+
+def main():
+    args = parse_args()
+    proc, db = open_db(args.mongo)
+    try:
+        rack_ids, rack_bikes = seed_fleet(db, racks=args.racks)
+        bike_ids = [b for b in rack_bikes.values() if b]
+        rng = random.Random(args.seed)
+        racks = [rng.choice(rack_ids) for _ in range(args.lookups)]
+        bikes = [rng.choice(bike_ids) for _ in range(args.lookups)]
+
+        model = fleet.FleetModel()
+        t0 = time.perf_counter()
+        model.load(db)
+        load_ms = round((time.perf_counter() - t0) * 1000, 1)
+
+        results = {
+            "load_ms": load_ms,
+            "rack_us": {"mongo": timed(lambda r: db.racks.find_one({"rack_id": r}), racks),
+                        "model": timed(model.rack, racks)},
+            "bike_us": {"mongo": timed(lambda b: db.bikes.find_one({"bike_id": b}), bikes),
+                        "model": timed(model.bike, bikes)},
+            "model": model.stats(),
+        }
+    finally:
+        if proc:
+            proc.terminate()
+    write_report({"meta": run_metadata(benchmark="fleet", mongo=args.mongo, racks=args.racks, lookups=args.lookups),
+                  "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
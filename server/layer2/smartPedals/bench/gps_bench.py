@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from harness import run_metadata, write_report
+
+import gps
+from gps_simulator import haversine_m
+
+"""
+Route metrics of one bike (user-050): gps.route_metrics (NumPy, every segment at once) on N synthetic fixes
+(a ride at 5-25 km/h, one fix every 5 s, stops and GPS jumps mixed in) vs the scalar haversine of
+gps_simulator.py in a Python loop (distance only, measured on at most --scalar-max fixes and scaled).
+Mongo loading is not included (see load_fixes: one cursor pass, decoding dominates).
+
+    python3 gps_bench.py --fixes 100000,1000000
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Vectorized vs scalar route metrics.")
+    p.add_argument("--fixes", default="100000,1000000", help="Comma-separated fix counts.")
+    p.add_argument("--scalar-max", type=int, default=200_000, help="Scalar loop on at most this many fixes.")
+    p.add_argument("--repeat", type=int, default=5, help="Best of N timings.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def synthetic(n, rng):
+    t = 1.7e9 + np.arange(n) * 5.0
+    speed = rng.uniform(5, 25, n) / 3.6          # m/s
+    speed[rng.random(n) < 0.05] = 0.0            # stops
+    heading = np.cumsum(rng.normal(0, 0.2, n))
+    step = speed * 5.0
+    lat = 50.6 + np.cumsum(step * np.cos(heading)) / 111_320
+    lon = 5.5 + np.cumsum(step * np.sin(heading)) / (111_320 * np.cos(np.radians(50.6)))
+    jumps = rng.random(n) < 0.001                # GPS jumps of ~1 km
+    lat[jumps] += 0.01
+    return t, lat, lon
+
+def best(fn, repeat):
+    elapsed = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed.append(time.perf_counter() - t0)
+    return min(elapsed), result
+
+def scalar_distance(lat, lon):
+    points = list(zip(lat.tolist(), lon.tolist()))
+    return sum(haversine_m(points[i], points[i + 1]) for i in range(len(points) - 1))
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for n in (int(f) for f in args.fixes.split(",")):
+        t, lat, lon = synthetic(n, rng)
+        seconds, metrics = best(lambda: gps.route_metrics(t, lat, lon), args.repeat)
+        m = min(n, args.scalar_max)
+        scalar_s, scalar_m = best(lambda: scalar_distance(lat[:m], lon[:m]), 1)
+        vector_m = float(gps.haversine(lat[:m], lon[:m]).sum())
+        results[n] = {
+            "numpy_ms": round(seconds * 1000, 1),
+            "numpy_fixes_per_s": round(n / seconds),
+            "scalar_distance_ms": round(scalar_s * n / m * 1000, 1),
+            "scalar_scaled_from": m,
+            "distance_diff_m": round(abs(scalar_m - vector_m), 6),
+            "metrics": {k: v for k, v in metrics.items() if k != "idle"} | {"idle_periods": metrics["idle"]["count"]},
+        }
+    write_report({"meta": run_metadata(benchmark="gps", numpy=np.__version__), "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
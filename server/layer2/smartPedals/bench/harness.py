@@ -0,0 +1,282 @@
+import json
+import os
+import platform
+import queue
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime, timezone
+
+"""
+Shared helpers for the layer2 benchmarks: local broker/Mongo stand-ins, ingest wiring, payloads and reporting.
+Run the benchmarks from this directory (python3 ingest_bench.py --help).
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(HERE, "..", "app")
+LAYER3_APP_DIR = os.path.join(HERE, "..", "..", "..", "layer3", "smartPedals", "app")
+GPS_TOOL_DIR = os.path.join(HERE, "..", "..", "..", "..", "esp32_helthec_lora", "debug_tool_for_exam")
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, GPS_TOOL_DIR)
+sys.path.append(LAYER3_APP_DIR)  # auth_payload only; layer2 app/ wins on name clashes
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+from gps_simulator import ROUTE_WAYPOINTS, RouteCursor  # noqa: E402
+
+# Local stand-ins
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+# Plain (no TLS, anonymous) mosquitto on a free port
+def start_mosquitto():
+    binary = shutil.which("mosquitto")
+    if not binary:
+        raise RuntimeError("mosquitto not found (apt install mosquitto), or use --broker inprocess / host:port")
+    port = free_port()
+    conf = tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False)
+    conf.write(f"listener {port} 127.0.0.1\nallow_anonymous true\nmax_queued_messages 0\n")
+    conf.close()
+    proc = subprocess.Popen([binary, "-c", conf.name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_port(port)
+    return proc, "127.0.0.1", port
+
+# Throwaway mongod on a free port
+def start_mongod():
+    binary = shutil.which("mongod")
+    if not binary:
+        raise RuntimeError("mongod not found, use --mongo mongomock or --mongo mongodb://...")
+    port = free_port()
+    dbpath = tempfile.mkdtemp(prefix="bench-mongo-")
+    proc = subprocess.Popen([binary, "--dbpath", dbpath, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_port(port, timeout=30)
+    return proc, f"mongodb://127.0.0.1:{port}"
+
+# Broker stand-ins
+class FakeMessage:
+    def __init__(self, topic, payload, qos):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+
+class FakeClient:
+    def __init__(self, on_publish=None):
+        self.on_publish = on_publish
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if self.on_publish:
+            self.on_publish(topic, payload)
+
+# One queue drained by one consumer thread, like paho's network thread
+class InProcessBroker:
+    def __init__(self, on_message, on_publish=None):
+        self.q = queue.Queue()
+        self.on_message = on_message
+        self.client = FakeClient(on_publish)
+        threading.Thread(target=self._consume, daemon=True).start()
+
+    def _consume(self):
+        while True:
+            self.on_message(self.client, None, self.q.get())
+
+    def publish(self, topic, payload, qos):
+        self.q.put(FakeMessage(topic, payload, qos))
+
+# Ingest callbacks on a plain (no TLS) connection to the benchmark broker
+def start_ingest_consumer(ingest, host, port):
+    consumer = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1, client_id="bench-ingest")
+    consumer.on_connect = ingest.on_connect
+    consumer.on_message = ingest.on_message
+    consumer.connect(host, port, 60)
+    consumer.loop_start()
+    return consumer
+
+def wait_connected(*clients, timeout=10):
+    deadline = time.time() + timeout
+    while not all(c.is_connected() for c in clients) and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.5)  # Let the subscriptions settle
+
+# Database for the benchmark: "mongomock", "spawn" (local mongod) or a mongodb:// URL
+def open_db(spec, name="smartpedals_bench"):
+    proc = None
+    if spec == "mongomock":
+        import mongomock
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        if spec == "spawn":
+            proc, spec = start_mongod()
+        client = MongoClient(spec)
+        client.drop_database(name)
+    return proc, client[name]
+
+# Point the ingest module at the benchmark database
+def wire_ingest(ingest, db):
+    ingest.db = db
+    ingest.data_col = db.data
+    ingest.telemetry_col = db.data_telemetry
+    ingest.users_col = db.users
+    ingest.bikes_col = db.bikes
+    ingest.racks_col = db.racks
+    ingest.stations_col = db.stations
+    ingest.locations_col = db.locations
+    ingest.auth_requests_col = db.auth_requests
+    ingest.alert_state_col = db.alert_state
+    ingest.trips_col = db.trips
+
+# Synthetic fleet: stations -> racks (half of them with a bike) and users
+def seed_fleet(db, users=100, racks=50, racks_per_station=10):
+    db.users.insert_many([{"firstName": "Bench", "lastName": str(i), "email": None, "rfid": f"bench-user-{i}",
+                           "history": []} for i in range(users)])
+    rack_docs, bike_docs = [], []
+    for r in range(racks):
+        rack_id = f"bench-rack-{r}"
+        bike_id = f"bench-bike-{r}" if r % 2 == 0 else None
+        rack_docs.append({"rack_id": rack_id, "station_id": f"bench-station-{r // racks_per_station}",
+                          "currentBike": bike_id, "history": []})
+        if bike_id:
+            bike_docs.append({"bike_id": bike_id, "status": "available", "currentUser": None,
+                              "currentRack": rack_id, "history": []})
+    db.racks.insert_many(rack_docs)
+    db.bikes.insert_many(bike_docs)
+    db.stations.insert_many([{"station_id": f"bench-station-{s}", "name": f"Bench {s}",
+                              "racks": [d["rack_id"] for d in rack_docs if d["station_id"] == f"bench-station-{s}"]}
+                             for s in range((racks + racks_per_station - 1) // racks_per_station)])
+    return [d["rack_id"] for d in rack_docs], {d["rack_id"]: d["currentBike"] for d in rack_docs}
+
+# Payloads, same shapes as the Node-RED flows (Parse2Json, heartbeat) and gps_simulator.py
+class TrafficGenerator:
+    def __init__(self, mix, users=100, racks=None, rack_bikes=None, bikes=20, seed=None):
+        self.rng = random.Random(seed)
+        self.mix = mix  # {"auth": w, "location": w, "parked": w}
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.users = [f"bench-user-{i}" for i in range(users)]
+        self.racks = racks or [f"bench-rack-{i}" for i in range(50)]
+        self.rack_bikes = dict(rack_bikes or {})  # Generator view of the racks (lock when empty, unlock when full)
+        self.cursors = {f"bench-bike-{i}": RouteCursor(ROUTE_WAYPOINTS) for i in range(bikes)}
+        self.seq = 0
+
+    def next(self):
+        self.seq += 1
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        return getattr(self, kind)()
+
+    def stamp(self, payload):
+        payload["bench_seq"] = self.seq
+        return payload
+
+    # hepl/auth: Parse2Json "aut" output + rack_id/station_id added by the flow
+    def auth(self):
+        rack_id = self.rng.choice(self.racks)
+        bike_id = self.rack_bikes.get(rack_id)
+        if bike_id:
+            action = "unlock"
+            self.rack_bikes[rack_id] = None
+        else:
+            action = "lock"
+            bike_id = f"bench-bike-{self.rng.randrange(10_000)}"
+            self.rack_bikes[rack_id] = bike_id
+        return "hepl/auth", 1, self.stamp({
+            "bike_id": bike_id,
+            "type": "auth",
+            "action": action,
+            "user_id": self.rng.choice(self.users),
+            "rack_id": rack_id,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+
+    # hepl/location: Parse2Json "loc" output, positions along the gps_simulator route
+    def location(self):
+        bike_id = self.rng.choice(list(self.cursors))
+        cursor = self.cursors[bike_id]
+        cursor.advance(self.rng.uniform(5, 30))
+        if cursor.done():
+            cursor = self.cursors[bike_id] = RouteCursor(ROUTE_WAYPOINTS)
+        (lat, lon), _ = cursor.position_and_course()
+        return "hepl/location", 0, self.stamp({
+            "bike_id": bike_id,
+            "type": "location",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "satellites": self.rng.randint(3, 12),
+            "coordinates": {"lat": lat, "lon": lon},
+        })
+
+    # hepl/parked: rack heartbeat (esp32_wroom/main.py)
+    def parked(self):
+        rack_id = self.rng.choice(self.racks)
+        bike_id = self.rack_bikes.get(rack_id)
+        return "hepl/parked", 2, self.stamp({
+            "type": "heartbeat",
+            "rack_id": rack_id,
+            "status": "active",
+            "available": bike_id is None,
+            "current_bike": bike_id,
+            "state": "idle",
+            "timestamp": time.time(),
+        })
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+# Reporting
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def latency_summary(latencies_s):
+    values = sorted(latencies_s)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1] if values else None),
+    }
+
+def run_metadata(**extra):
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = None
+    return {"git_rev": rev or None, "python": platform.python_version(), "host": platform.node(),
+            "started": datetime.now(timezone.utc).isoformat(timespec="seconds"), **extra}
+
+# Keep stdout for the report: the app modules print on their hot paths
+def quiet_stdout():
+    sys.stdout = sys.stderr
+
+# One JSON document per run: {"meta": {...}, "stages": [...]}
+def write_report(report, path=None):
+    text = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(text + "\n")
+    print(text, file=sys.__stdout__, flush=True)
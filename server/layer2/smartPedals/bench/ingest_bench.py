@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+import time
+
+import paho.mqtt.client as mqtt
+
+from harness import (
+    InProcessBroker, TrafficGenerator, latency_summary, open_db, parse_mix, quiet_stdout, run_metadata, seed_fleet,
+    start_ingest_consumer, start_mosquitto, wait_connected, wire_ingest, write_report,
+)
+
+"""
+End-to-end ingest throughput: publish hepl/* traffic at increasing rates and time each message
+from publish to the end of its Mongo writes in the layer2 ingest worker (thread engine).
+
+    python3 ingest_bench.py --broker mosquitto --mongo mongomock --rates 100,500,1000 --out before.json
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Layer2 ingest throughput benchmark.")
+    p.add_argument("--broker", default="inprocess",
+                   help="'inprocess' (queue + consumer thread), 'mosquitto' (spawn a local one) or host:port.")
+    p.add_argument("--mongo", default="mongomock", help="'mongomock', 'spawn' (local mongod) or a mongodb:// URL.")
+    p.add_argument("--mix", default="auth=1,location=8,parked=1", help="Traffic weights per message kind.")
+    p.add_argument("--rates", default="100,250,500,1000,2000", help="Offered rates (msgs/s), one stage each.")
+    p.add_argument("--duration", type=float, default=10.0, help="Seconds per stage.")
+    p.add_argument("--drain", type=float, default=10.0, help="Max seconds to wait for stragglers after a stage.")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--racks", type=int, default=50)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--max-drop-pct", type=float, default=None, help="Stop increasing the rate past this drop ratio.")
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+class MqttBroker:
+    def __init__(self, host, port, ingest):
+        self.consumer = start_ingest_consumer(ingest, host, port)
+        self.producer = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="bench-producer")
+        self.producer.max_inflight_messages_set(1000)
+        self.producer.connect(host, port, 60)
+        self.producer.loop_start()
+        wait_connected(self.consumer, self.producer)
+
+    def publish(self, topic, payload, qos):
+        self.producer.publish(topic, payload, qos=qos)
+
+def run_stage(broker, gen, rate, duration, drain, sent, done):
+    total = int(rate * duration)
+    first = len(sent) + 1
+    topics = {}
+    t0 = time.perf_counter()
+    for i in range(total):
+        target = t0 + i / rate
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        topic, qos, payload = gen.next()
+        topics[gen.seq] = topic
+        sent[gen.seq] = time.perf_counter()
+        broker.publish(topic, json.dumps(payload).encode(), qos)
+    send_end = time.perf_counter()
+
+    seqs = range(first, first + total)
+    deadline = send_end + drain
+    while time.perf_counter() < deadline and any(s not in done for s in seqs):
+        time.sleep(0.05)
+
+    completed = [s for s in seqs if s in done]
+    last = max((done[s] for s in completed), default=send_end)
+    by_topic = {}
+    for topic in set(topics.values()):
+        mine = [s for s in seqs if topics[s] == topic]
+        ok = [s for s in mine if s in done]
+        by_topic[topic] = {"sent": len(mine), "completed": len(ok), "dropped": len(mine) - len(ok),
+                           **latency_summary([done[s] - sent[s] for s in ok])}
+    return {
+        "offered_msgs_per_s": rate,
+        "duration_s": duration,
+        "sent": total,
+        "completed": len(completed),
+        "dropped": total - len(completed),
+        "achieved_send_rate": round(total / max(send_end - t0, 1e-9), 1),
+        "sustained_msgs_per_s": round(len(completed) / max(last - t0, 1e-9), 1),
+        "latency": latency_summary([done[s] - sent[s] for s in completed]),
+        "by_topic": by_topic,
+    }
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import ingest
+
+    mongo_proc, db = open_db(args.mongo)
+    broker_proc = None
+    try:
+        wire_ingest(ingest, db)
+        racks, rack_bikes = seed_fleet(db, users=args.users, racks=args.racks)
+        gen = TrafficGenerator(parse_mix(args.mix), users=args.users, racks=racks, rack_bikes=rack_bikes, seed=args.seed)
+
+        # Completion probe: every message ends with insert_to_mongo in the ingest worker
+        sent, done = {}, {}
+        original_insert = ingest.insert_to_mongo
+        def probed_insert(topic, raw, data, *rest, **kwargs):
+            original_insert(topic, raw, data, *rest, **kwargs)
+            if isinstance(data, dict) and "bench_seq" in data:
+                done[data["bench_seq"]] = time.perf_counter()
+        ingest.insert_to_mongo = probed_insert
+
+        if args.broker == "inprocess":
+            broker = InProcessBroker(ingest.on_message)
+        elif args.broker == "mosquitto":
+            broker_proc, host, port = start_mosquitto()
+            broker = MqttBroker(host, port, ingest)
+        else:
+            host, _, port = args.broker.partition(":")
+            broker = MqttBroker(host, int(port or 1883), ingest)
+
+        report = {"meta": run_metadata(benchmark="ingest", engine="threads", broker=args.broker, mongo=args.mongo,
+                                       mix=parse_mix(args.mix)), "stages": []}
+        for rate in [float(r) for r in args.rates.split(",")]:
+            stage = run_stage(broker, gen, rate, args.duration, args.drain, sent, done)
+            report["stages"].append(stage)
+            print(f"[BENCH] {rate:.0f} msg/s offered -> {stage['sustained_msgs_per_s']} msg/s sustained, "
+                  f"p99={stage['latency']['p99_ms']}ms, dropped={stage['dropped']}", file=sys.stderr, flush=True)
+            if args.max_drop_pct is not None and stage["dropped"] * 100 > args.max_drop_pct * stage["sent"]:
+                break
+        write_report(report, args.out)
+    finally:
+        for proc in (broker_proc, mongo_proc):
+            if proc:
+                proc.terminate()
+
+if __name__ == "__main__":
+    main()
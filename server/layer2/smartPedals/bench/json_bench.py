@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import time
+
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from flask import Flask
+
+from harness import run_metadata, write_report
+
+import bsonjson
+
+"""
+JSON serialization throughput of the list routes on N bike/rack documents (half each), history included:
+- legacy: the old per-document dict copy with str(_id), then Flask's default provider
+- provider_stdlib / provider_orjson: documents as the Mongo projection returns them, through bsonjson
+
+    python3 json_bench.py --docs 100000
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Serialization throughput of the layer2 JSON provider.")
+    p.add_argument("--docs", type=int, default=100_000)
+    p.add_argument("--history", type=int, default=3, help="History entries per document.")
+    p.add_argument("--repeat", type=int, default=3, help="Best of N runs.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+# Raw documents as stored (bikes: user history, racks: bike history)
+def make_documents(n, history, rng):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(n):
+        when = [start + timedelta(minutes=rng.randrange(500_000)) for _ in range(history)]
+        if i % 2 == 0:
+            docs.append({"_id": ObjectId(), "bike_id": f"bike-{i}", "status": "available", "currentUser": None,
+                         "currentRack": f"rack-{i}",
+                         "history": [{"action": "unlock", "user_id": f"user-{rng.randrange(1000)}", "timestamp": t}
+                                     for t in when]})
+        else:
+            docs.append({"_id": ObjectId(), "rack_id": f"rack-{i}", "station_id": f"station-{i // 10}",
+                         "currentBike": None,
+                         "history": [{"bike_id": f"bike-{i - 1}", "action": "lock", "timestamp": t} for t in when]})
+    return docs
+
+def legacy(provider, docs):
+    out = []
+    for d in docs:
+        if "bike_id" in d:
+            out.append({"id": str(d["_id"]), "bike_id": d.get("bike_id"), "status": d.get("status"),
+                        "currentUser": d.get("currentUser"), "currentRack": d.get("currentRack"),
+                        "history": d.get("history", [])})
+        else:
+            out.append({"id": str(d["_id"]), "rack_id": d.get("rack_id"), "station_id": d.get("station_id"),
+                        "currentBike": d.get("currentBike"), "history": d.get("history", [])})
+    return provider.dumps(out).encode()
+
+def stdlib_dumps(obj):
+    return json.dumps(obj, default=bsonjson.bson_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+def best_of(repeat, fn):
+    best, size = None, 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        size = len(fn())
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    docs = make_documents(args.docs, args.history, rng)
+    # What the api_projection() queries return: "id" instead of "_id", same fields
+    projected = [{"id": d["_id"], **{k: v for k, v in d.items() if k != "_id"}} for d in docs]
+
+    default_provider = Flask("json_bench").json
+    cases = {
+        "legacy": lambda: legacy(default_provider, docs),
+        "provider_stdlib": lambda: stdlib_dumps(projected),
+    }
+    if bsonjson.orjson is not None:
+        cases["provider_orjson"] = lambda: bsonjson.dumps_bytes(projected)
+
+    results = {}
+    for name, fn in cases.items():
+        elapsed, size = best_of(args.repeat, fn)
+        results[name] = {
+            "ms": round(elapsed * 1000, 1),
+            "docs_per_s": round(args.docs / elapsed),
+            "mb_per_s": round(size / elapsed / 1e6, 1),
+            "bytes": size,
+        }
+    write_report({"meta": run_metadata(benchmark="json", docs=args.docs, history=args.history), "results": results},
+                 args.out)
+
+if __name__ == "__main__":
+    main()
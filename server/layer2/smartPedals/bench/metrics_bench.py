@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from harness import run_metadata, write_report
+
+import metrics
+
+"""
+Cost of one metrics observation (app/metrics.py), in ns per call, from a hot loop.
+The budget is well under 1 µs per observation.
+
+    python3 metrics_bench.py --calls 1000000
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Per-observation cost of the layer2 metrics.")
+    p.add_argument("--calls", type=int, default=1_000_000)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+class FakeCommandEvent:
+    command_name = "find"
+    duration_micros = 850
+
+def ns_per_call(fn, calls):
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    loop = time.perf_counter() - t0
+    # Subtract the loop and call overhead measured on an empty function
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        noop()
+    empty = time.perf_counter() - t0
+    return round((loop - empty) / calls * 1e9, 1)
+
+def noop():
+    pass
+
+def main():
+    args = parse_args()
+    counter = metrics.Counter("bench_total", "bench", ("broker", "topic"))
+    histogram = metrics.Histogram("bench_seconds", "bench", ("broker", "topic"))
+    timed = histogram.time("local", "hepl/auth")(noop)
+    event = FakeCommandEvent()
+    cases = {
+        "counter_inc": lambda: counter.inc("local", "hepl/auth"),
+        "histogram_observe": lambda: histogram.observe(0.0031, "local", "hepl/auth"),
+        "histogram_time_decorator": timed,
+        "mongo_listener_succeeded": lambda: metrics.mongo_listener.succeeded(event),
+    }
+    results = {name: ns_per_call(fn, args.calls) for name, fn in cases.items()}
+    t0 = time.perf_counter()
+    text = metrics.render("bench")
+    results["render_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    results["render_bytes"] = len(text)
+    write_report({"meta": run_metadata(benchmark="metrics", calls=args.calls), "ns_per_call": results}, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+
+from harness import latency_summary, open_db, quiet_stdout, run_metadata, seed_fleet, write_report
+
+"""
+Station page of a dashboard (user-048): GET station, then one GET per rack and one GET per docked bike (N+1),
+vs ?ids= multi-gets (3 requests) vs GET /api/stations/<id>?expand=racks,bikes (1 request).
+Runs the Flask app in-process (test client) against --mongo, with the fleet read model off (Mongo path) or
+loaded (--model). Every variant gets the same documents (read model fields, no history). mongomock does not evaluate the $ifNull projections of the API: use a real server for the
+Mongo path (--model runs on mongomock).
+
+    python3 mget_bench.py --mongo spawn --racks 400 --pages 200
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="N+1 vs multi-get vs expanded station page.")
+    p.add_argument("--mongo", default="spawn", help="'spawn' (local mongod) or a mongodb:// URL.")
+    p.add_argument("--racks", type=int, default=400)
+    p.add_argument("--racks-per-station", type=int, default=20)
+    p.add_argument("--pages", type=int, default=200, help="Station pages rendered per variant.")
+    p.add_argument("--model", action="store_true", help="Serve from the loaded fleet read model.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def get(client, url, headers, counter):
+    counter[0] += 1
+    r = client.get(url, headers=headers)
+    assert r.status_code == 200, (url, r.status_code)
+    return r.get_json()
+
+RACK_FIELDS = "id,rack_id,station_id,currentBike"
+BIKE_FIELDS = "id,bike_id,status,currentUser,currentRack"
+
+def n_plus_one(client, headers, station_id, counter):
+    station = get(client, f"/smartpedals/api/stations/{station_id}?fields=station_id,racks", headers, counter)
+    for rack_id in station["racks"]:
+        rack = get(client, f"/smartpedals/api/racks/{rack_id}?fields={RACK_FIELDS}", headers, counter)
+        if rack["currentBike"]:
+            get(client, f"/smartpedals/api/bikes/{rack['currentBike']}?fields={BIKE_FIELDS}", headers, counter)
+
+def multi_get(client, headers, station_id, counter):
+    station = get(client, f"/smartpedals/api/stations/{station_id}?fields=station_id,racks", headers, counter)
+    racks = get(client, f"/smartpedals/api/racks?ids={','.join(station['racks'])}&fields={RACK_FIELDS}", headers, counter)
+    bikes = [r["currentBike"] for r in racks if r["currentBike"]]
+    if bikes:
+        get(client, f"/smartpedals/api/bikes?ids={','.join(bikes)}&fields={BIKE_FIELDS}", headers, counter)
+
+def expanded(client, headers, station_id, counter):
+    get(client, f"/smartpedals/api/stations/{station_id}?expand=racks,bikes", headers, counter)
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import app as web
+    proc, db = open_db(args.mongo)
+    try:
+        seed_fleet(db, racks=args.racks, racks_per_station=args.racks_per_station)
+        for name in ("users", "bikes", "racks", "stations"):
+            setattr(web, f"{name}_col", db[name])
+        web.events.start = lambda: None
+        web.events.send = lambda event: None
+        web.response_cache.backend = None  # Every page reads the collections
+        if args.model:
+            web.fleet.model.load(db)
+            web.fleet.FLEET_MAX_STALENESS_SECONDS = float("inf")
+        else:
+            web.fleet.model.mode = "off"
+        headers = {"x-api-key": web.SMARTPEDALS_API_KEY}
+        client = web.app.test_client()
+        stations = db.stations.distinct("station_id")
+        rng = random.Random(args.seed)
+        pages = [rng.choice(stations) for _ in range(args.pages)]
+        results = {}
+        for name, page in (("n_plus_one", n_plus_one), ("multi_get", multi_get), ("expand", expanded)):
+            counter = [0]
+            latencies = []
+            for station_id in pages:
+                t0 = time.perf_counter()
+                page(client, headers, station_id, counter)
+                latencies.append(time.perf_counter() - t0)
+            results[name] = {"requests_per_page": round(counter[0] / len(pages), 1), **latency_summary(latencies)}
+    finally:
+        if proc:
+            proc.terminate()
+    write_report({"meta": run_metadata(benchmark="mget", mongo=args.mongo, racks=args.racks, model=args.model,
+                                       racks_per_station=args.racks_per_station), "results": results}, args.out)
+
+if __name__ == "__main__":
+    main()
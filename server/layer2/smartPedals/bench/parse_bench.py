@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import time
+
+import bson
+
+from harness import TrafficGenerator, open_db, parse_mix, quiet_stdout, run_metadata, seed_fleet, write_report
+
+"""
+Decode + insert cost per message, before/after parse-once ingest (user-034):
+- before: payload.decode(), json.loads for auth/location, data_col gets {"topic", "payload": <raw string>}
+- after: one decode_payload() (orjson or stdlib), data_col gets {"topic", "ts", "payload": <document>}
+"insert" is bson.encode (the client-side cost of insert_one) with --mongo none, a real insert_one otherwise.
+
+    python3 parse_bench.py --messages 20000 --mongo none
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Per-message decode+insert cost of the layer2 ingest.")
+    p.add_argument("--messages", type=int, default=20000, help="Messages per kind.")
+    p.add_argument("--mongo", default="none", help="'none' (bson.encode only), 'mongomock', 'spawn' or a URL.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+def before(ingest, topic, raw):
+    payload = raw.decode()
+    if topic in (ingest.AUTH_TOPIC, ingest.LOCATION_TOPIC):
+        try:
+            json.loads(payload)
+        except ValueError:
+            pass
+    return {"topic": topic, "payload": payload}
+
+def after(ingest, topic, raw):
+    return ingest.data_document(topic, raw, ingest.decode_payload(raw))
+
+def measure(build, ingest, messages, insert):
+    t0 = time.perf_counter()
+    for topic, raw in messages:
+        build(ingest, topic, raw)
+    decode = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    size = 0
+    for topic, raw in messages:
+        size += insert(build(ingest, topic, raw))
+    total = time.perf_counter() - t0
+    n = len(messages)
+    return {
+        "decode_ns": round(decode / n * 1e9),
+        "decode_insert_ns": round(total / n * 1e9),
+        "avg_bson_bytes": round(size / n),
+    }
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import common
+    import ingest
+
+    mongo_proc, db = (None, None) if args.mongo == "none" else open_db(args.mongo)
+    try:
+        if db is None:
+            insert = lambda doc: len(bson.encode(doc))
+        else:
+            col = db.parse_bench
+            insert = lambda doc: (col.insert_one(doc), len(bson.encode(doc)))[1]
+
+        racks = [f"bench-rack-{r}" for r in range(50)]
+        rack_bikes = {r: (f"bench-bike-{i}" if i % 2 == 0 else None) for i, r in enumerate(racks)}
+        if db is not None:
+            racks, rack_bikes = seed_fleet(db)
+
+        report = {"meta": run_metadata(benchmark="parse", mongo=args.mongo, messages_per_kind=args.messages,
+                                       orjson=common.json_loads is not json.loads), "kinds": {}}
+        for kind in ("auth", "location", "parked"):
+            gen = TrafficGenerator(parse_mix(f"{kind}=1"), racks=racks, rack_bikes=dict(rack_bikes), seed=args.seed)
+            messages = []
+            for _ in range(args.messages):
+                topic, _, payload = gen.next()
+                messages.append((topic, json.dumps(payload).encode()))
+            messages.append((messages[0][0], b"not json 42"))
+
+            results = {"before": measure(before, ingest, messages, insert)}
+            ingest.json_loads = json.loads
+            results["after_stdlib"] = measure(after, ingest, messages, insert)
+            ingest.json_loads = common.json_loads
+            if common.json_loads is not json.loads:
+                results["after_orjson"] = measure(after, ingest, messages, insert)
+            report["kinds"][kind] = results
+        write_report(report, args.out)
+    finally:
+        if mongo_proc:
+            mongo_proc.terminate()
+
+if __name__ == "__main__":
+    main()
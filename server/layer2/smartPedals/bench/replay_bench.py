@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from harness import (TrafficGenerator, open_db, parse_mix, quiet_stdout, run_metadata, seed_fleet, wire_ingest,
+                     write_report)
+
+import replay
+
+"""
+Record/replay round trip (user-038):
+- record: cost per message of Recorder.record() and bytes per message on disk
+- replay: the recording fed twice to the ingest handlers at max speed, each time into a fresh database;
+  both runs must leave the same data/locations/bikes/racks (minus _id and reception times)
+
+    python3 replay_bench.py --messages 5000 --mongo mongomock
+"""
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Record/replay cost and determinism of the layer2 ingest.")
+    p.add_argument("--messages", type=int, default=5000)
+    p.add_argument("--mix", default="auth=1,location=5,parked=2")
+    p.add_argument("--mongo", default="mongomock", help="'mongomock', 'spawn' or a mongodb:// URL.")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out", default=None, help="Write the JSON report to this file too.")
+    return p.parse_args()
+
+# Collection contents without the values that depend on when the replay ran
+def fingerprint(db):
+    volatile = {"_id", "ts", "expire_at", "timestamp"}
+    def strip(doc):
+        return {k: v for k, v in doc.items() if k not in volatile and k != "history"}
+    return {name: [strip(d) for d in db[name].find({}, sort=[("_id", 1)])]
+            for name in ("data", "locations", "bikes", "racks")}
+
+def main():
+    args = parse_args()
+    quiet_stdout()
+    import ingest
+
+    path = os.path.join(tempfile.mkdtemp(prefix="replay-bench-"), "mqtt.rec")
+    recorder = replay.Recorder(path, 1 << 40)
+    gen = TrafficGenerator(parse_mix(args.mix), seed=args.seed)
+    messages = []
+    for _ in range(args.messages):
+        topic, qos, payload = gen.next()
+        messages.append((topic, json.dumps(payload).encode(), qos))
+    t0 = time.perf_counter()
+    for topic, payload, qos in messages:
+        recorder.record("local", topic, payload, qos)
+    record_s = time.perf_counter() - t0
+    recorder.close()
+    recorded = list(replay.read_records(path))
+    assert [(r.topic, r.payload, r.qos) for r in recorded] == messages
+
+    runs = []
+    prints = []
+    for run in range(2):
+        mongo_proc, db = open_db(args.mongo, name=f"smartpedals_replay_{run}")
+        try:
+            seed_fleet(db)
+            wire_ingest(ingest, db)
+            deliver, finish = replay.handlers_target()
+            result = replay.replay(replay.read_records(path), deliver, speed=0)
+            result.update(finish())
+            runs.append(result)
+            prints.append(fingerprint(db))
+        finally:
+            if mongo_proc:
+                mongo_proc.terminate()
+
+    write_report({
+        "meta": run_metadata(benchmark="replay", mongo=args.mongo, messages=args.messages, mix=args.mix),
+        "record": {
+            "ns_per_message": round(record_s / args.messages * 1e9),
+            "file_bytes": os.path.getsize(path),
+            "bytes_per_message": round(os.path.getsize(path) / args.messages, 1),
+        },
+        "replays": runs,
+        "identical": prints[0] == prints[1],
+    }, args.out)
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ from twilio.rest import Client as TwilioClient
 from webex_bot.webex_bot import WebexBot
 from webex_bot.commands.echo import EchoCommand
 
+from auth_payload import MQTT_AUTH_TOPIC, MQTT_AUTH_REPLY_TOPIC, build_auth_payload
+
 app = Flask(__name__)
 app.secret_key = "dev"
 
@@ -27,8 +29,6 @@ app.secret_key = "dev"
 MQTT_BROKER = os.environ.get("MQTT_BROKER", "hepl.local")
 MQTT_PORT = int(os.environ.get("MQTT_PORT", 1883))
 MQTT_TOPIC_BASE = "hepl/sensors"
-MQTT_AUTH_TOPIC = "hepl/auth"
-MQTT_AUTH_REPLY_TOPIC = "hepl/auth_reply"
 MQTT_USERNAME = "smartadmin"
 MQTT_PASSWORD = "smartpass"
 MQTT_CLIENT_ID_SUB = "trusted-enterprise_smartPedals_sub" # Two different, publish.single() keep the connection a little -> broker kill the old
@@ -100,14 +100,7 @@ def publish_auth(action: str, user_id="1", rack_id="1", bike_id="1"):
     Publish an auth request (unlock/lock) with QoS 2 on hepl/auth.
     action: "unlock" or "lock"
     """
-    ts_iso = datetime.now(ZoneInfo("Europe/Brussels")).isoformat(timespec="seconds")
-    payload = {
-        "user_id": user_id,
-        "timestamp": ts_iso,   # ← ISO 8601 au lieu d'un entier
-        "rack_id": rack_id,
-        "bike_id": bike_id,
-        "type": action
-    }
+    payload = build_auth_payload(action, user_id=user_id, rack_id=rack_id, bike_id=bike_id)
     publish.single(
         MQTT_AUTH_TOPIC,       # ← corrige AUTH_TOPIC → MQTT_AUTH_TOPIC
         payload=json.dumps(payload),
@@ -0,0 +1,23 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+"""
+hepl/auth request payload, shared by the Flask test buttons (app.py) and the layer2 auth latency benchmark.
+"""
+
+MQTT_AUTH_TOPIC = "hepl/auth"
+MQTT_AUTH_REPLY_TOPIC = "hepl/auth_reply"
+
+def build_auth_payload(action: str, user_id="1", rack_id="1", bike_id="1"):
+    """
+    action: "unlock" or "lock"
+    """
+    ts_iso = datetime.now(ZoneInfo("Europe/Brussels")).isoformat(timespec="seconds")
+    return {
+        "user_id": user_id,
+        "timestamp": ts_iso,   # ← ISO 8601 au lieu d'un entier
+        "rack_id": rack_id,
+        "bike_id": bike_id,
+        "type": action,
+        "action": action       # ← layer2 handle_auth_message reads "action"
+    }